@@ -0,0 +1,200 @@
+"""API REST asincrona del Router AI (FastAPI + uvicorn).
+
+Le chiamate CPU-bound (encode, classificazione, Ollama) girano su un
+executor a thread limitato; oltre ``API_MAX_PENDING`` richieste in corso
+il servizio risponde subito 503 invece di accodare senza limiti.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+import ollama_service
+import predictor
+from artifacts import load_report
+from cache import ModelCache
+from config import Config
+from metrics import MetricsCollector
+from ollama_service import improve_prompt_with_ollama
+from predictor import predict_model, predict_models
+from retrainer import BackgroundTrainer
+
+logger = logging.getLogger(__name__)
+
+
+class RouteRequest(BaseModel):
+    prompt: str
+
+
+class BatchRouteRequest(BaseModel):
+    prompts: List[str]
+
+
+class ImproveRequest(BaseModel):
+    prompt: str
+    target_model: Optional[str] = None
+
+
+class _BoundedExecutor:
+    """Executor a thread con limite sulle richieste in corso (rifiuto immediato se pieno)."""
+
+    def __init__(self, max_workers: int, max_pending: int) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="api-worker"
+        )
+        self._max_pending = max_pending
+        self._pending = 0
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        # Il contatore è toccato solo dall'event loop: non serve un lock
+        if self._pending >= self._max_pending:
+            raise HTTPException(status_code=503, detail="Router sovraccarico, riprovare")
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def create_api(
+    config: Config,
+    model_cache: ModelCache,
+    metrics_collector: Optional[MetricsCollector] = None,
+    trainer: Optional[BackgroundTrainer] = None,
+) -> FastAPI:
+    """Crea l'app FastAPI condividendo ModelCache e Config con il resto del router."""
+    if metrics_collector is None:
+        metrics_collector = MetricsCollector()
+        metrics_collector.register_cache("predictions", model_cache.prediction_cache.stats)
+        if model_cache.optimization_cache is not None:
+            metrics_collector.register_cache(
+                "optimizations", model_cache.optimization_cache.stats
+            )
+        ollama_client = ollama_service.get_client(config)
+        metrics_collector.register_gauges("ollama_scheduler", ollama_client.scheduler.stats)
+        metrics_collector.register_gauges("ollama_circuit", ollama_client.breaker.stats)
+        metrics_collector.register_gauges("ollama_residency", ollama_client.residency.stats)
+    predictor.metrics_collector = metrics_collector
+    ollama_service.metrics_collector = metrics_collector
+
+    executor = _BoundedExecutor(config.API_EXECUTOR_WORKERS, config.API_MAX_PENDING)
+
+    @asynccontextmanager
+    async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+        ollama_service.start_health_monitor(config)
+        ollama_service.start_model_residency(config)
+        # Caricamento del modello (se non già fatto all'avvio) fuori dal loop:
+        # /healthz legge solo il modello pubblicato
+        try:
+            await executor.run(
+                model_cache.get_model_bundle, config.CLASSIFIER_PATH, config.ENCODER_PATH
+            )
+        except Exception:
+            logger.exception("Modello non caricato all'avvio: /healthz resta non pronto")
+        yield
+        executor.shutdown()
+
+    app = FastAPI(title="AI Router API", lifespan=lifespan)
+
+    @app.post("/route")
+    async def route(request: RouteRequest) -> Dict[str, Any]:
+        return await executor.run(predict_model, request.prompt, config, model_cache)
+
+    @app.post("/route/batch")
+    async def route_batch(request: BatchRouteRequest) -> Dict[str, Any]:
+        if len(request.prompts) > config.API_MAX_BATCH_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Massimo {config.API_MAX_BATCH_SIZE} prompt per richiesta",
+            )
+        results = await executor.run(predict_models, request.prompts, config, model_cache)
+        return {"results": results}
+
+    @app.post("/improve")
+    async def improve(request: ImproveRequest) -> Dict[str, Any]:
+        target_model = request.target_model
+        if target_model is None:
+            route = await executor.run(predict_model, request.prompt, config, model_cache)
+            target_model = route.get("predicted_model") if route.get("success") else None
+        result = await executor.run(
+            improve_prompt_with_ollama,
+            request.prompt,
+            config,
+            target_model=target_model,
+            cache=model_cache.optimization_cache,
+        )
+        if result.get("busy") or result.get("unavailable"):
+            raise HTTPException(status_code=503, detail=result["error"])
+        return result
+
+    @app.post("/retrain", status_code=202)
+    async def retrain() -> Dict[str, Any]:
+        if trainer is None:
+            raise HTTPException(status_code=404, detail="Riaddestramento in background non attivo")
+        started = trainer.trigger("richiesta API")
+        return {"started": started, **trainer.status()}
+
+    @app.get("/retrain")
+    async def retrain_status() -> Dict[str, Any]:
+        if trainer is None:
+            raise HTTPException(status_code=404, detail="Riaddestramento in background non attivo")
+        return trainer.status()
+
+    @app.get("/report")
+    async def report() -> Dict[str, Any]:
+        bundle = model_cache.current_bundle
+        version = bundle.manifest.get("version")
+        data = load_report(config.ARTIFACT_DIR, version) if version else None
+        if data is None:
+            raise HTTPException(status_code=404, detail="Report di valutazione non disponibile")
+        return {"model_version": bundle.version, **data}
+
+    @app.get("/metrics")
+    async def metrics() -> Dict[str, Any]:
+        data = metrics_collector.get_metrics()
+        data["api_pending_requests"] = executor.pending
+        return data
+
+    @app.get("/metrics/prometheus", response_class=PlainTextResponse)
+    async def metrics_prometheus() -> str:
+        return PlainTextResponse(
+            metrics_collector.to_prometheus(),
+            media_type="text/plain; version=0.0.4",
+        )
+
+    @app.get("/healthz")
+    async def healthz() -> Dict[str, Any]:
+        # Nessun caricamento nel loop degli eventi: conta il modello già pubblicato
+        bundle = model_cache.current_bundle
+        if not bundle.ready:
+            raise HTTPException(status_code=503, detail="Modello non caricato")
+        return {
+            "status": "ok",
+            "model_loaded": True,
+            "model_version": bundle.version,
+            "ollama": ollama_service.ollama_status(config),
+        }
+
+    return app
+
+
+def serve(app: FastAPI, host: str, port: int, log_level: str = "info") -> None:
+    """Avvia uvicorn sull'app (bloccante)."""
+    import uvicorn
+
+    logger.info("API REST in ascolto su http://%s:%s", host, port)
+    uvicorn.run(app, host=host, port=port, log_level=log_level.lower())
@@ -0,0 +1,205 @@
+"""Formato degli artefatti del modello: directory versionate al posto dei pickle.
+
+Ogni versione è una directory in ``ARTIFACT_DIR`` con:
+- ``<nome>.npy``: array del motore del backend (per il MLP ``coef_<i>`` /
+  ``intercept_<i>``, per il kNN ``embeddings`` / ``labels``, ...)
+- ``projection_<nome>.npy``: proiezione degli embedding, se attiva
+- ``labels.json``: nomi dei modelli nell'ordine delle colonne di output
+- ``evaluation.json``: report di valutazione sul holdout (``evaluation.py``)
+- ``manifest.json``: formato, backend e parametri del motore, modello di
+  embedding, dimensione, normalizzazione, impronta del dataset,
+  iperparametri e metriche
+
+Il file ``current`` contiene il nome della versione attiva e viene
+sostituito atomicamente. I pesi sono aperti con ``mmap_mode="r"``: il
+caricamento non deserializza classi sklearn e più processi condividono le
+stesse pagine in memoria. I vecchi ``.pkl`` restano leggibili come ripiego.
+"""
+import json
+import logging
+import os
+import pickle
+import shutil
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from classifiers import BACKENDS
+from inference import build_inference_engine
+from projection import Projection
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+# Il formato 1 conteneva solo MLP, con i parametri del motore al primo livello
+SUPPORTED_FORMATS = (1, 2)
+CURRENT_FILE = "current"
+MANIFEST_FILE = "manifest.json"
+LABELS_FILE = "labels.json"
+REPORT_FILE = "evaluation.json"
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """Motore di inferenza, etichette e manifest di una stessa versione del modello."""
+
+    engine: Optional[Any] = None
+    classes: Tuple[str, ...] = ()
+    # Solo per pickle legacy il cui MLP non è riproducibile dal motore NumPy
+    classifier: Optional[Any] = None
+    manifest: Dict[str, Any] = field(default_factory=dict)
+    version: int = 0
+    # Applicata agli embedding prima della classificazione
+    projection: Optional[Projection] = None
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.classes) and (self.engine is not None or self.classifier is not None)
+
+
+def _write_json(path: Path, data: Any) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def current_artifact_path(artifact_dir: Path) -> Optional[Path]:
+    """Directory della versione attiva, se presente e completa."""
+    try:
+        name = (Path(artifact_dir) / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    path = Path(artifact_dir) / name
+    return path if (path / MANIFEST_FILE).exists() else None
+
+
+def _next_version_name(artifact_dir: Path) -> str:
+    numbers = [
+        int(path.name[1:])
+        for path in artifact_dir.glob("v*")
+        if path.is_dir() and path.name[1:].isdigit()
+    ]
+    return f"v{max(numbers, default=0) + 1:04d}"
+
+
+def save_artifact(
+    artifact_dir: Path,
+    engine: Any,
+    classes: List[str],
+    manifest: Dict[str, Any],
+    keep: int = 3,
+    projection: Optional[Projection] = None,
+    report: Optional[Dict[str, Any]] = None,
+) -> Path:
+    """Salva una nuova versione, la rende attiva e rimuove le più vecchie oltre ``keep``."""
+    artifact_dir = Path(artifact_dir)
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    name = _next_version_name(artifact_dir)
+    tmp_dir = artifact_dir / f".{name}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    arrays = engine.arrays()
+    for array_name, array in arrays.items():
+        np.save(tmp_dir / f"{array_name}.npy", np.ascontiguousarray(array))
+    if projection is not None:
+        for array_name, array in projection.arrays().items():
+            np.save(tmp_dir / f"projection_{array_name}.npy", np.ascontiguousarray(array))
+        manifest = {**manifest, "projection": {**manifest.get("projection", {}), **projection.params()}}
+    _write_json(tmp_dir / LABELS_FILE, [str(cls) for cls in classes])
+    _write_json(
+        tmp_dir / MANIFEST_FILE,
+        {
+            "format_version": FORMAT_VERSION,
+            "version": name,
+            "created_at": datetime.now().isoformat(),
+            "classifier": engine.backend,
+            "engine": engine.params(),
+            "arrays": sorted(arrays),
+            **manifest,
+        },
+    )
+    if report is not None:
+        _write_json(tmp_dir / REPORT_FILE, {"version": name, **report})
+    os.replace(tmp_dir, artifact_dir / name)
+
+    tmp_current = artifact_dir / f"{CURRENT_FILE}.tmp"
+    tmp_current.write_text(name, encoding="utf-8")
+    os.replace(tmp_current, artifact_dir / CURRENT_FILE)
+    logger.info("Artefatto del modello salvato: %s (%s)", artifact_dir / name, engine.backend)
+
+    versions = sorted(
+        path for path in artifact_dir.glob("v*") if path.is_dir() and path.name[1:].isdigit()
+    )
+    for old in versions[: max(0, len(versions) - max(1, keep))]:
+        if old.name != name:
+            shutil.rmtree(old, ignore_errors=True)
+    return artifact_dir / name
+
+
+def load_artifact(path: Path) -> ModelBundle:
+    """Carica una versione con gli array del motore in memory-map (sola lettura)."""
+    path = Path(path)
+    with open(path / MANIFEST_FILE, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    format_version = manifest.get("format_version")
+    if format_version not in SUPPORTED_FORMATS:
+        raise ValueError(f"Formato artefatto non supportato: {format_version}")
+    with open(path / LABELS_FILE, "r", encoding="utf-8") as f:
+        classes = tuple(json.load(f))
+    backend = manifest.get("classifier", "mlp")
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend di classificazione non supportato: {backend}")
+    if format_version == 1:
+        params = {key: manifest[key] for key in ("activation", "out_activation", "layers")}
+        names = [f"{kind}_{i}" for i in range(len(params["layers"])) for kind in ("coef", "intercept")]
+    else:
+        params = manifest["engine"]
+        names = manifest["arrays"]
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in names}
+    engine = BACKENDS[backend].engine_cls.from_arrays(arrays, params)
+    projection = None
+    if manifest.get("projection"):
+        projection = Projection.from_arrays(
+            {
+                name: np.load(path / f"projection_{name}.npy", mmap_mode="r")
+                for name in ("components", "mean")
+            },
+            manifest["projection"],
+        )
+    return ModelBundle(engine=engine, classes=classes, manifest=manifest, projection=projection)
+
+
+def load_current_artifact(artifact_dir: Path) -> Optional[ModelBundle]:
+    """Versione attiva, o None se non è mai stato salvato un artefatto."""
+    path = current_artifact_path(artifact_dir)
+    return load_artifact(path) if path is not None else None
+
+
+def load_report(artifact_dir: Path, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Report di valutazione di una versione (di default quella attiva), se presente."""
+    if version is None:
+        path = current_artifact_path(artifact_dir)
+    else:
+        path = Path(artifact_dir) / version
+    if path is None or not (path / REPORT_FILE).exists():
+        return None
+    with open(path / REPORT_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_pickle_bundle(classifier_path: Path, encoder_path: Path) -> ModelBundle:
+    """Ripiego per i modelli salvati in pickle dalle versioni precedenti."""
+    with open(classifier_path, "rb") as f:
+        classifier = pickle.load(f)
+    with open(encoder_path, "rb") as f:
+        label_encoder = pickle.load(f)
+    engine = build_inference_engine(classifier)
+    return ModelBundle(
+        engine=engine,
+        classes=tuple(str(cls) for cls in label_encoder.classes_),
+        classifier=classifier if engine is None else None,
+        manifest={"format": "pickle"},
+    )
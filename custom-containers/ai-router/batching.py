@@ -0,0 +1,108 @@
+"""Micro-batching delle richieste di inferenza concorrenti."""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class InferenceDispatcher:
+    """Raccoglie le richieste concorrenti in una breve finestra e le esegue in un unico batch.
+
+    Ogni chiamante riceve un ``Future`` risolto individualmente con il proprio
+    risultato; un errore nel batch viene propagato a tutti i chiamanti del batch.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        name: str = "inference-dispatcher",
+    ) -> None:
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any) -> Future:
+        """Accoda un elemento e ritorna il Future del suo risultato."""
+        future: Future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def close(self) -> None:
+        """Ferma il worker dopo aver servito le richieste già accodate."""
+        with self._lock:
+            if self._worker is not None:
+                self._queue.put(_STOP)
+                self._worker.join()
+                self._worker = None
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name=self.name, daemon=True
+                )
+                self._worker.start()
+
+    def _collect_batch(self) -> Tuple[List[Tuple[Any, Future]], bool]:
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    entry = self._queue.get(timeout=remaining)
+                else:
+                    entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch, False
+
+    def _run(self) -> None:
+        while True:
+            batch, stop = self._collect_batch()
+            if stop:
+                return
+            pending = [
+                (item, future)
+                for item, future in batch
+                if future.set_running_or_notify_cancel()
+            ]
+            if not pending:
+                continue
+            items = [item for item, _ in pending]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(
+                        f"Il batch ha prodotto {len(results)} risultati per {len(items)} elementi"
+                    )
+            except Exception as e:
+                logger.exception("Errore durante l'esecuzione del batch di inferenza")
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            logger.debug("Batch di inferenza eseguito con %s elementi", len(items))
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
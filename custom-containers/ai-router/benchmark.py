@@ -0,0 +1,601 @@
+"""
+Benchmark riproducibile del router, con i prompt di ``training_data.json`` come corpus.
+
+Esempio:
+    python benchmark.py --requests 200 --batch-sizes 1 8 16 32 --threads 1 2 4
+    python benchmark.py --compare models/benchmarks/benchmark-20260101-120000.json
+
+Misura:
+- avvio a freddo in un processo separato (import, caricamento modelli, prima predizione)
+- latenza p50/p95/p99 di una singola richiesta
+- throughput in blocco per dimensione del batch e numero di thread
+- costo di una predizione da cache (esatta, normalizzata) rispetto a un miss
+- latenza del miglioramento prompt contro un server Ollama simulato, completa
+  e in streaming (tempo al primo token)
+- picco di memoria residente (RSS) dopo ogni fase
+
+L'archivio degli embedding è disattivato durante le misure, così due
+esecuzioni sulla stessa configurazione sono confrontabili. Il risultato è un
+JSON in ``MODEL_DIR/benchmarks/`` (o ``--output``).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import replace
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:
+    from dotenv import load_dotenv
+    env_file = Path(__file__).resolve().parent / ".env"
+    if env_file.exists():
+        load_dotenv(env_file)
+except ImportError:
+    pass
+
+import numpy as np
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FIELDS = (
+    "EMBEDDING_MODEL",
+    "EMBEDDING_BACKEND",
+    "EMBEDDING_BATCH_SIZE",
+    "NORMALIZE_EMBEDDINGS",
+    "CPU_THREADS",
+    "CLASSIFIER_BACKEND",
+    "PROJECTION_METHOD",
+    "PROJECTION_DIM",
+    "INFERENCE_BATCHING",
+    "INFERENCE_BATCH_MAX_WAIT_MS",
+    "PREDICTION_CACHE_SIZE",
+    "PREDICTION_CACHE_NORMALIZE",
+    "OLLAMA_MODEL",
+)
+
+
+def peak_rss_mb() -> float:
+    """Picco di memoria residente del processo (ru_maxrss è in KB su Linux, byte su macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def latency_stats(seconds: Sequence[float]) -> Dict[str, float]:
+    """Percentili in millisecondi di una serie di durate."""
+    if not seconds:
+        return {"n": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "n": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def _timed(fn: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def load_corpus(config: Config, seed: int) -> List[str]:
+    """Prompt distinti del training, in ordine casuale ma riproducibile."""
+    from dataset import iter_training_examples
+
+    prompts = sorted(
+        {
+            prompt.strip()
+            for prompt, _ in iter_training_examples(config.TRAINING_DATA_PATH)
+            if isinstance(prompt, str) and prompt.strip()
+        }
+    )
+    random.Random(seed).shuffle(prompts)
+    return prompts
+
+
+class _StubOllamaHandler(BaseHTTPRequestHandler):
+    """Risponde come Ollama su /api/chat, /api/generate e /api/tags.
+
+    Il ritardo fisso simula l'elaborazione del prompt, ``token_delay`` la
+    generazione di ogni parola; con ``"stream": true`` le parole sono inviate
+    come NDJSON in chunked encoding, come fa Ollama. La prima richiesta paga
+    ``load_delay`` e lo riporta in ``load_duration``, come il caricamento del
+    modello; una ``/api/generate`` senza prompt carica soltanto.
+    """
+
+    server: "StubOllamaServer"
+    # Connessioni persistenti come il server reale, per misurare il keep-alive del client
+    protocol_version = "HTTP/1.1"
+    # Header e corpo sono scritti separatamente: senza TCP_NODELAY il delayed ACK aggiunge ~40 ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        return None
+
+    def _send_json(self, data: Dict[str, Any], status: int = 200) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": self.server.model}]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _send_stream(self, chunks: Sequence[Dict[str, Any]]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(self.server.token_delay)
+            line = json.dumps(chunk).encode("utf-8") + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        load_duration = 0
+        with self.server.load_lock:
+            if not self.server.loaded:
+                time.sleep(self.server.load_delay)
+                self.server.loaded = True
+                load_duration = int(self.server.load_delay * 1e9)
+        model = payload.get("model")
+        if self.path == "/api/generate" and not payload.get("prompt"):
+            self._send_json(
+                {"model": model, "response": "", "done": True, "load_duration": load_duration}
+            )
+            return
+        time.sleep(self.server.delay)
+        self.server.requests += 1
+        if self.path == "/api/chat":
+            prompt = payload["messages"][-1]["content"].splitlines()[-1]
+            text = f"Prompt migliorato: {prompt}"
+            wrap = lambda piece: {"message": {"role": "assistant", "content": piece}}
+        elif self.path == "/api/generate":
+            text = payload.get("prompt", "").splitlines()[-1]
+            wrap = lambda piece: {"response": piece}
+        else:
+            self._send_json({"error": "not found"}, 404)
+            return
+        words = text.split(" ")
+        pieces = [word + " " for word in words[:-1]] + [words[-1]]
+        done = {"done": True, "eval_count": len(pieces), "load_duration": load_duration}
+        self.server.simulated.append(
+            load_duration / 1e9 + self.server.delay + self.server.token_delay * (len(pieces) - 1)
+        )
+        if payload.get("stream", True):
+            chunks = [{"model": model, **wrap(piece), "done": False} for piece in pieces]
+            self._send_stream(chunks + [{"model": model, **wrap(""), **done}])
+        else:
+            time.sleep(self.server.token_delay * (len(pieces) - 1))
+            self._send_json({"model": model, **wrap(text), **done})
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    """Server Ollama simulato su una porta libera di localhost."""
+
+    daemon_threads = True
+
+    def __init__(
+        self, model: str, delay_ms: float = 50.0, token_ms: float = 0.0, load_ms: float = 0.0
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), _StubOllamaHandler)
+        self.model = model
+        self.delay = delay_ms / 1000.0
+        self.token_delay = token_ms / 1000.0
+        self.load_delay = load_ms / 1000.0
+        self.loaded = False
+        self.load_lock = threading.Lock()
+        # Ritardo simulato di ogni richiesta servita, per isolare l'overhead del client
+        self.simulated: List[float] = []
+        self.requests = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def _cold_start() -> Dict[str, Any]:
+    """Eseguito nel processo figlio: ogni fase parte da import non ancora caricati."""
+    timings: Dict[str, Any] = {}
+    start = time.perf_counter()
+    t = time.perf_counter()
+    from cache import ModelCache
+    from predictor import predict_models
+
+    timings["import_s"] = time.perf_counter() - t
+    config = replace(Config(), EMBEDDING_STORE_ENABLED=False)
+    model_cache = ModelCache(config)
+    timings["model_load_s"] = _timed(
+        lambda: model_cache.get_model_bundle(config.CLASSIFIER_PATH, config.ENCODER_PATH)
+    )
+    timings["embedding_load_s"] = _timed(
+        lambda: model_cache.get_embedding_model(
+            config.EMBEDDING_MODEL,
+            device=config.EMBEDDING_DEVICE,
+            backend=config.EMBEDDING_BACKEND,
+            cache_dir=config.ONNX_CACHE_DIR,
+            threads=config.CPU_THREADS,
+        )
+    )
+    timings["first_predict_s"] = _timed(
+        lambda: predict_models(["Benchmark avvio a freddo"], config, model_cache, use_cache=False)
+    )
+    timings["total_s"] = time.perf_counter() - start
+    result = {key: round(value, 4) for key, value in timings.items()}
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def bench_cold_start() -> Dict[str, Any]:
+    """Avvio a freddo misurato in un nuovo interprete."""
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--cold-start-child"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).resolve().parent,
+        env=os.environ.copy(),
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_s"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def bench_single(config: Config, prompts: Sequence[str], warmup: int = 5) -> Dict[str, Any]:
+    """Latenza di richieste singole sequenziali (percorso predict_model, cache vuota)."""
+    from cache import ModelCache
+    from predictor import predict_model
+
+    model_cache = ModelCache(config)
+    for prompt in prompts[:warmup]:
+        predict_model(prompt, config, model_cache)
+    model_cache.prediction_cache.clear()
+    timings = [_timed(lambda p=p: predict_model(p, config, model_cache)) for p in prompts]
+    return latency_stats(timings)
+
+
+def bench_cache(config: Config, prompts: Sequence[str]) -> Dict[str, Any]:
+    """Miss, hit esatto e hit normalizzato sugli stessi prompt."""
+    from cache import ModelCache
+    from predictor import predict_model
+
+    model_cache = ModelCache(config)
+    predict_model(prompts[0], config, model_cache)
+    model_cache.prediction_cache.clear()
+    miss = [_timed(lambda p=p: predict_model(p, config, model_cache)) for p in prompts]
+    exact = [_timed(lambda p=p: predict_model(p, config, model_cache)) for p in prompts]
+    variants = [f"  {p.upper()}  " for p in prompts]
+    normalized = [_timed(lambda p=p: predict_model(p, config, model_cache)) for p in variants]
+    result = {
+        "miss": latency_stats(miss),
+        "hit_exact": latency_stats(exact),
+        "hit_normalized": latency_stats(normalized),
+        "stats": {
+            key: value
+            for key, value in model_cache.prediction_cache.stats().items()
+            if isinstance(value, (int, float, str))
+        },
+    }
+    if result["hit_exact"]["p50_ms"] > 0:
+        result["miss_to_hit_ratio"] = round(
+            result["miss"]["p50_ms"] / result["hit_exact"]["p50_ms"], 1
+        )
+    return result
+
+
+def _set_threads(threads: int) -> None:
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+
+def bench_throughput(
+    config: Config,
+    prompts: Sequence[str],
+    batch_sizes: Sequence[int],
+    thread_counts: Sequence[int],
+) -> List[Dict[str, Any]]:
+    """Prompt al secondo con predict_models per ogni combinazione di batch e thread."""
+    from threadpoolctl import threadpool_limits
+
+    from cache import ModelCache
+    from predictor import predict_models
+
+    results = []
+    for threads in thread_counts:
+        # Nuovo ModelCache: i thread del backend ONNX si fissano al caricamento del modello
+        model_cache = ModelCache(replace(config, CPU_THREADS=threads))
+        with threadpool_limits(limits=threads):
+            for batch_size in batch_sizes:
+                run_config = replace(config, CPU_THREADS=threads, EMBEDDING_BATCH_SIZE=batch_size)
+                _set_threads(threads)
+                predict_models(list(prompts[:batch_size]), run_config, model_cache, use_cache=False)
+                elapsed = _timed(
+                    lambda: predict_models(list(prompts), run_config, model_cache, use_cache=False)
+                )
+                results.append(
+                    {
+                        "threads": threads,
+                        "batch_size": batch_size,
+                        "prompts": len(prompts),
+                        "seconds": round(elapsed, 4),
+                        "prompts_per_s": round(len(prompts) / elapsed, 1),
+                        "ms_per_batch": round(
+                            elapsed * 1000 / -(-len(prompts) // batch_size), 3
+                        ),
+                    }
+                )
+                logger.info(
+                    "Throughput threads=%s batch=%s: %.1f prompt/s",
+                    threads,
+                    batch_size,
+                    results[-1]["prompts_per_s"],
+                )
+    _set_threads(config.CPU_THREADS)
+    return results
+
+
+def bench_ollama(
+    config: Config,
+    prompts: Sequence[str],
+    delay_ms: float,
+    token_ms: float = 0.0,
+    load_ms: float = 0.0,
+) -> Dict[str, Any]:
+    """Miglioramento prompt contro il server simulato: overhead del client e primo token.
+
+    Con ``OLLAMA_PRELOAD`` il modello simulato viene caricato prima delle
+    misure, come all'avvio del router; altrimenti la prima richiesta paga
+    ``load_ms``.
+    """
+    from ollama_service import (
+        improve_prompt_with_ollama,
+        preload_model,
+        stream_improve_prompt_with_ollama,
+    )
+
+    with StubOllamaServer(config.OLLAMA_MODEL, delay_ms, token_ms, load_ms) as server:
+        stub_config = replace(config, OLLAMA_BASE_URL=server.url)
+        preload_s = None
+        if config.OLLAMA_PRELOAD:
+            start = time.perf_counter()
+            preload_model(stub_config)
+            preload_s = time.perf_counter() - start
+        timings, failures = [], 0
+        for prompt in prompts:
+            start = time.perf_counter()
+            result = improve_prompt_with_ollama(prompt, stub_config, target_model="stub")
+            timings.append(time.perf_counter() - start)
+            failures += not result["success"]
+        stats = latency_stats(timings)
+        overhead = latency_stats([t - d for t, d in zip(timings, server.simulated)])
+        stats["stub_delay_ms"] = delay_ms
+        stats["stub_token_ms"] = token_ms
+        stats["stub_load_ms"] = load_ms
+        stats["preload_s"] = preload_s
+        stats["overhead_p50_ms"] = overhead["p50_ms"]
+
+        first_partial, totals = [], []
+        for prompt in prompts:
+            start = time.perf_counter()
+            first = None
+            for result in stream_improve_prompt_with_ollama(prompt, stub_config, target_model="stub"):
+                if first is None and not result["done"]:
+                    first = time.perf_counter() - start
+            totals.append(time.perf_counter() - start)
+            first_partial.append(first if first is not None else totals[-1])
+            failures += not result["success"]
+        stats["stream"] = {
+            "first_partial": latency_stats(first_partial),
+            "total": latency_stats(totals),
+        }
+        stats["failures"] = failures
+        stats["server_requests"] = server.requests
+    return stats
+
+
+def _headline(report: Dict[str, Any]) -> Dict[str, float]:
+    """Metriche principali per il confronto tra due esecuzioni."""
+    headline: Dict[str, float] = {}
+    if "cold_start" in report:
+        headline["cold_start_total_s"] = report["cold_start"]["total_s"]
+    if "single" in report:
+        headline["single_p50_ms"] = report["single"]["p50_ms"]
+        headline["single_p99_ms"] = report["single"]["p99_ms"]
+    if report.get("throughput"):
+        headline["best_prompts_per_s"] = max(r["prompts_per_s"] for r in report["throughput"])
+    if "cache" in report:
+        headline["cache_hit_p50_ms"] = report["cache"]["hit_exact"]["p50_ms"]
+    if "ollama" in report:
+        headline["ollama_overhead_p50_ms"] = report["ollama"]["overhead_p50_ms"]
+        if "stream" in report["ollama"]:
+            stream = report["ollama"]["stream"]
+            headline["ollama_first_partial_p50_ms"] = stream["first_partial"]["p50_ms"]
+    headline["peak_rss_mb"] = report["peak_rss_mb"]
+    return headline
+
+
+def print_comparison(previous: Dict[str, Any], current: Dict[str, Any]) -> None:
+    before, after = _headline(previous), _headline(current)
+    print(f"{'metrica':<26} {'prima':>12} {'dopo':>12} {'diff':>9}")
+    for key in after:
+        if key not in before:
+            continue
+        delta = (after[key] - before[key]) / before[key] if before[key] else 0.0
+        print(f"{key:<26} {before[key]:>12.3f} {after[key]:>12.3f} {delta:>+9.1%}")
+
+
+def _parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark del router AI")
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Richieste singole misurate (default: 200)"
+    )
+    parser.add_argument(
+        "--throughput-prompts",
+        type=int,
+        default=512,
+        help="Prompt per ogni misura di throughput (default: 512)",
+    )
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 8, 16, 32, 64], help="Dimensioni batch"
+    )
+    parser.add_argument("--threads", type=int, nargs="+", default=None, help="Numero di thread")
+    parser.add_argument(
+        "--ollama-requests", type=int, default=20, help="Richieste al server simulato (0 = salta)"
+    )
+    parser.add_argument(
+        "--ollama-delay-ms", type=float, default=50.0, help="Ritardo del server simulato"
+    )
+    parser.add_argument(
+        "--ollama-token-ms", type=float, default=20.0, help="Ritardo per parola generata"
+    )
+    parser.add_argument(
+        "--ollama-load-ms",
+        type=float,
+        default=0.0,
+        help="Caricamento simulato del modello alla prima richiesta",
+    )
+    parser.add_argument("--skip-cold-start", action="store_true", help="Salta l'avvio a freddo")
+    parser.add_argument("--seed", type=int, default=0, help="Seme per l'ordine dei prompt")
+    parser.add_argument("-o", "--output", default=None, help="File JSON dei risultati")
+    parser.add_argument("--compare", default=None, help="JSON di un'esecuzione precedente")
+    parser.add_argument("--cold-start-child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] | None = None) -> int:
+    args = _parse_args(argv)
+    if args.cold_start_child:
+        logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+        print(json.dumps(_cold_start()))
+        return 0
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        stream=sys.stderr,
+    )
+    # Le singole predizioni non devono finire nel log misurato
+    logging.getLogger("predictor").setLevel(logging.WARNING)
+    logging.getLogger("ollama_service").setLevel(logging.WARNING)
+    config = replace(Config(), EMBEDDING_STORE_ENABLED=False)
+    thread_counts = args.threads or sorted({1, config.CPU_THREADS})
+
+    report: Dict[str, Any] = {
+        "timestamp": datetime.now().isoformat(),
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {key: getattr(config, key) for key in CONFIG_FIELDS},
+        "args": {
+            key: value for key, value in vars(args).items() if key not in ("cold_start_child",)
+        },
+    }
+
+    from cache import ModelCache
+    from training import should_retrain, train_model
+
+    if should_retrain(config):
+        logger.info("Modello assente o non aggiornato: addestramento prima del benchmark")
+        start = time.perf_counter()
+        success, message = train_model(config, ModelCache(config))
+        if not success:
+            logger.error("Addestramento fallito: %s", message)
+            return 1
+        report["training_s"] = round(time.perf_counter() - start, 3)
+
+    if not args.skip_cold_start:
+        logger.info("Avvio a freddo...")
+        report["cold_start"] = bench_cold_start()
+
+    corpus = load_corpus(config, args.seed)
+    logger.info("Corpus: %s prompt distinti da %s", len(corpus), config.TRAINING_DATA_PATH)
+    phases_rss: Dict[str, float] = {}
+
+    logger.info("Latenza delle richieste singole...")
+    report["single"] = bench_single(config, corpus[: args.requests])
+    phases_rss["single"] = peak_rss_mb()
+
+    logger.info("Cache hit / miss...")
+    report["cache"] = bench_cache(config, corpus[args.requests : 2 * args.requests] or corpus)
+    phases_rss["cache"] = peak_rss_mb()
+
+    logger.info("Throughput in blocco...")
+    throughput_prompts = (corpus * (1 + args.throughput_prompts // max(1, len(corpus))))[
+        : args.throughput_prompts
+    ]
+    report["throughput"] = bench_throughput(
+        config, throughput_prompts, args.batch_sizes, thread_counts
+    )
+    phases_rss["throughput"] = peak_rss_mb()
+
+    if args.ollama_requests > 0:
+        logger.info("Miglioramento prompt con Ollama simulato...")
+        report["ollama"] = bench_ollama(
+            config,
+            corpus[: args.ollama_requests],
+            args.ollama_delay_ms,
+            args.ollama_token_ms,
+            args.ollama_load_ms,
+        )
+        phases_rss["ollama"] = peak_rss_mb()
+
+    report["peak_rss_by_phase_mb"] = phases_rss
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    output = Path(args.output) if args.output else (
+        config.MODEL_DIR / "benchmarks" / f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    logger.info("Risultati scritti in %s", output)
+
+    for key, value in _headline(report).items():
+        print(f"{key:<26} {value:>12.3f}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
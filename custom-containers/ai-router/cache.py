@@ -1,121 +1,441 @@
 """Cache per i modelli del Router AI."""
 import hashlib
-import pickle
 import logging
+import sys
 import time
 from collections import OrderedDict
+from dataclasses import replace
+from itertools import islice
 from threading import Lock
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
-from sentence_transformers import SentenceTransformer
-from sklearn.neural_network import MLPClassifier
-from sklearn.preprocessing import LabelEncoder
+from artifacts import ModelBundle, load_current_artifact, load_pickle_bundle
+from batching import InferenceDispatcher
+from config import Config
+from embedding_backends import load_embedding_model
+from embedding_store import EmbeddingStore
+from optimization_cache import OptimizationCache
 
 logger = logging.getLogger(__name__)
 
 
+_TRAILING_PUNCTUATION = ".!?;:,… "
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Forma canonica del prompt: minuscolo, spazi compattati, senza punteggiatura finale."""
+    return " ".join(prompt.lower().split()).rstrip(_TRAILING_PUNCTUATION)
+
+
+def _entry_size(result: dict) -> int:
+    """Stima economica dell'occupazione in byte di una predizione in cache."""
+    size = sys.getsizeof(result)
+    for key, value in result.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+
+class _CacheShard:
+    """Porzione della cache protetta dal proprio lock."""
+
+    __slots__ = ("entries", "lock", "bytes", "operations")
+
+    def __init__(self) -> None:
+        self.entries: OrderedDict[str, tuple] = OrderedDict()
+        self.lock = Lock()
+        self.bytes = 0
+        self.operations = 0
+
+
 class PredictionCache:
-    """Cache LRU per predizioni con TTL."""
+    """Cache LRU per predizioni con TTL, thread-safe e suddivisa in shard.
+
+    Le chiavi sono calcolate sul prompt normalizzato (se attivo), così i prompt
+    che differiscono solo per maiuscole, spazi o punteggiatura finale condividono
+    la stessa voce.
+    Le voci portano la versione del modello che le ha prodotte: dopo un cambio
+    di modello quelle superate vengono scartate alla lettura o dagli sweep.
+    Ogni shard ha un proprio lock, una quota di voci e di memoria; le voci
+    scadute vengono rimosse alla lettura e con sweep periodici sulle scritture.
+    """
 
-    def __init__(self, max_size: int = 1000, ttl: int = 3600):
-        self.max_size = max_size
+    SWEEP_INTERVAL = 64
+    SWEEP_BATCH = 32
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        ttl: int = 3600,
+        normalize: bool = True,
+        shards: int = 8,
+        max_bytes: int = 0,
+    ):
+        self.max_size = max(1, max_size)
         self.ttl = ttl
-        self.cache: OrderedDict[str, tuple] = OrderedDict()
+        self.normalize = normalize
+        self._shards = [_CacheShard() for _ in range(max(1, min(shards, self.max_size)))]
+        self._shard_size = max(1, self.max_size // len(self._shards))
+        self._shard_bytes = max_bytes // len(self._shards) if max_bytes > 0 else 0
+        self._stats_lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.model_version = 0
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self._shards)
 
     def _get_key(self, prompt: str) -> str:
         """Genera una chiave hash dal prompt."""
         return hashlib.sha256(prompt.encode()).hexdigest()
 
+    def _lookup_key(self, prompt: str) -> str:
+        return self._get_key(normalize_prompt(prompt) if self.normalize else prompt)
+
+    def _shard_for(self, key: str) -> _CacheShard:
+        return self._shards[int(key[:8], 16) % len(self._shards)]
+
+    def _count(
+        self,
+        hits: int = 0,
+        misses: int = 0,
+        evictions: int = 0,
+        expirations: int = 0,
+        invalidations: int = 0,
+    ) -> None:
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+            self.expirations += expirations
+            self.invalidations += invalidations
+
+    def _remove(self, shard: _CacheShard, key: str) -> None:
+        _, _, _, size, _ = shard.entries.pop(key)
+        shard.bytes -= size
+
+    def _sweep(self, shard: _CacheShard, now: float) -> int:
+        """Rimuove le voci scadute o superate tra le meno usate di recente (col lock dello shard)."""
+        expired = [
+            key
+            for key, (_, timestamp, _, _, version) in islice(
+                shard.entries.items(), self.SWEEP_BATCH
+            )
+            if now - timestamp >= self.ttl or version != self.model_version
+        ]
+        for key in expired:
+            self._remove(shard, key)
+        return len(expired)
+
+    def get_with_tier(self, prompt: str) -> Tuple[Optional[dict], Optional[str]]:
+        """Recupera una predizione e il livello che l'ha servita ("exact" o "normalized")."""
+        key = self._lookup_key(prompt)
+        shard = self._shard_for(key)
+        expired = stale = False
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is not None:
+                result, timestamp, exact_key, _, version = entry
+                stale = version != self.model_version
+                expired = time.time() - timestamp >= self.ttl
+                if stale or expired:
+                    self._remove(shard, key)
+                    entry = None
+                else:
+                    shard.entries.move_to_end(key)
+        if entry is None:
+            self._count(misses=1, expirations=int(expired and not stale), invalidations=int(stale))
+            return None, None
+        self._count(hits=1)
+        tier = "exact" if exact_key == self._get_key(prompt) else "normalized"
+        logger.debug("Cache hit per prompt (%s)", tier)
+        return result, tier
+
     def get(self, prompt: str) -> Optional[dict]:
         """Recupera una predizione dalla cache."""
-        key = self._get_key(prompt)
-        if key in self.cache:
-            result, timestamp = self.cache[key]
-            if time.time() - timestamp < self.ttl:
-                self.cache.move_to_end(key)
-                logger.debug("Cache hit per prompt")
-                return result
-            del self.cache[key]
-        return None
+        return self.get_with_tier(prompt)[0]
+
+    def set(self, prompt: str, result: dict, version: Optional[int] = None) -> None:
+        """Salva una predizione in cache (scartata se calcolata con un modello superato)."""
+        if version is not None and version != self.model_version:
+            return
+        key = self._lookup_key(prompt)
+        shard = self._shard_for(key)
+        size = _entry_size(result)
+        now = time.time()
+        evicted = expired = 0
+        with shard.lock:
+            if key in shard.entries:
+                self._remove(shard, key)
+            shard.entries[key] = (result, now, self._get_key(prompt), size, self.model_version)
+            shard.bytes += size
+            shard.operations += 1
+            if shard.operations % self.SWEEP_INTERVAL == 0:
+                expired = self._sweep(shard, now)
+            while len(shard.entries) > 1 and (
+                len(shard.entries) > self._shard_size
+                or (self._shard_bytes and shard.bytes > self._shard_bytes)
+            ):
+                oldest_key = next(iter(shard.entries))
+                self._remove(shard, oldest_key)
+                evicted += 1
+        if evicted or expired:
+            self._count(evictions=evicted, expirations=expired)
+
+    def stats(self) -> Dict[str, Any]:
+        """Contatori di hit, miss, evizioni e scadenze con occupazione corrente."""
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+            evictions, expirations = self.evictions, self.expirations
+            invalidations = self.invalidations
+        total = hits + misses
+        return {
+            "entries": len(self),
+            "max_size": self.max_size,
+            "bytes": sum(shard.bytes for shard in self._shards),
+            "shards": len(self._shards),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": f"{(hits / total * 100) if total else 0.0:.1f}%",
+            "evictions": evictions,
+            "expirations": expirations,
+            "invalidations": invalidations,
+            "model_version": self.model_version,
+        }
 
-    def set(self, prompt: str, result: dict) -> None:
-        """Salva una predizione in cache."""
-        key = self._get_key(prompt)
-        if key in self.cache:
-            self.cache.move_to_end(key)
-        self.cache[key] = (result, time.time())
-        if len(self.cache) > self.max_size:
-            self.cache.popitem(last=False)
+    def set_model_version(self, version: int) -> None:
+        """Invalida per versione le predizioni dei modelli precedenti, senza svuotare la cache."""
+        self.model_version = version
 
     def clear(self) -> None:
         """Cancella la cache."""
-        self.cache.clear()
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.bytes = 0
+
+
+def _build_prediction_cache(config: Optional[Config]) -> PredictionCache:
+    if config is None:
+        return PredictionCache()
+    return PredictionCache(
+        max_size=config.PREDICTION_CACHE_SIZE,
+        ttl=config.PREDICTION_CACHE_TTL,
+        normalize=config.PREDICTION_CACHE_NORMALIZE,
+        shards=config.PREDICTION_CACHE_SHARDS,
+        max_bytes=config.PREDICTION_CACHE_MAX_MB * 1024 * 1024,
+    )
+
+
+def _build_optimization_cache(config: Optional[Config]) -> Optional[OptimizationCache]:
+    if config is None or not config.OPTIMIZATION_CACHE_ENABLED:
+        return None
+    return OptimizationCache(
+        max_size=config.OPTIMIZATION_CACHE_SIZE,
+        ttl=config.OPTIMIZATION_CACHE_TTL,
+        db_path=config.OPTIMIZATION_CACHE_PATH if config.OPTIMIZATION_CACHE_PERSIST else None,
+        max_rows=config.OPTIMIZATION_CACHE_MAX_ROWS,
+    )
 
 
 class ModelCache:
-    """Cache per i modelli caricati per evitare caricamenti ridondanti."""
+    """Cache per i modelli caricati per evitare caricamenti ridondanti.
+
+    Motore di inferenza ed etichette sono pubblicati insieme in un ModelBundle
+    immutabile: la sostituzione è un singolo assegnamento, e chi ha già letto
+    il bundle completa la richiesta sul modello precedente.
+    """
 
-    def __init__(self):
-        self._embedding_model: Optional[SentenceTransformer] = None
+    def __init__(self, config: Optional[Config] = None):
+        # SentenceTransformer o encoder ONNX: importati solo al primo caricamento
+        self._embedding_model: Optional[Any] = None
         self._embedding_model_name: Optional[str] = None
         self._embedding_device: Optional[str] = None
-        self._classifier: Optional[MLPClassifier] = None
-        self._label_encoder: Optional[LabelEncoder] = None
+        self._embedding_backend: Optional[str] = None
+        self._loaded_embedding_backend: Optional[str] = None
+        self._bundle = ModelBundle()
+        self._artifact_dir: Optional[Path] = config.ARTIFACT_DIR if config else None
+        self._config = config
         self._lock = Lock()
-        self.prediction_cache = PredictionCache()
+        # Lock separato: il caricamento del modello di embedding (secondi) non blocca il classificatore
+        self._embedding_lock = Lock()
+        self._inference_dispatcher: Optional[InferenceDispatcher] = None
+        self._embedding_store: Optional[EmbeddingStore] = None
+        self._optimization_cache: Optional[OptimizationCache] = None
+        self.prediction_cache = _build_prediction_cache(config)
+
+    @property
+    def optimization_cache(self) -> Optional[OptimizationCache]:
+        """Cache delle ottimizzazioni, creata al primo uso.
+
+        Con la persistenza attiva apre un database SQLite in ``MODEL_DIR``: i
+        processi che non generano con Ollama (tuning, benchmark, riaddestramento)
+        non lo aprono.
+        """
+        cache = self._optimization_cache
+        if cache is None and self._config is not None and self._config.OPTIMIZATION_CACHE_ENABLED:
+            with self._lock:
+                cache = self._optimization_cache
+                if cache is None:
+                    cache = self._optimization_cache = _build_optimization_cache(self._config)
+        return cache
 
     def get_embedding_model(
-        self, model_name: str, device: str = "cpu"
-    ) -> SentenceTransformer:
+        self,
+        model_name: str,
+        device: str = "cpu",
+        backend: str = "torch",
+        cache_dir: Optional[Path] = None,
+        threads: int = 0,
+    ) -> Any:
         must_reload = (
             self._embedding_model is None
             or self._embedding_model_name != model_name
             or self._embedding_device != device
+            or self._embedding_backend != backend
         )
         if must_reload:
-            with self._lock:
+            with self._embedding_lock:
                 must_reload = (
                     self._embedding_model is None
                     or self._embedding_model_name != model_name
                     or self._embedding_device != device
+                    or self._embedding_backend != backend
                 )
                 if must_reload:
                     logger.info(
-                        "Caricamento modello di embedding: %s (device=%s)",
+                        "Caricamento modello di embedding: %s (device=%s, backend=%s)",
                         model_name,
                         device,
+                        backend,
                     )
-                    self._embedding_model = SentenceTransformer(model_name, device=device)
+                    loaded_backend = backend
+                    try:
+                        model = load_embedding_model(
+                            model_name,
+                            device=device,
+                            backend=backend,
+                            cache_dir=cache_dir,
+                            threads=threads,
+                        )
+                    except Exception:
+                        if backend == "torch":
+                            raise
+                        logger.exception(
+                            "Backend di embedding %s non disponibile, uso torch", backend
+                        )
+                        model = load_embedding_model(model_name, device=device)
+                        loaded_backend = "torch"
+                    self._embedding_model = model
                     self._embedding_model_name = model_name
                     self._embedding_device = device
+                    self._embedding_backend = backend
+                    self._loaded_embedding_backend = loaded_backend
         return self._embedding_model
 
-    def get_classifier(self, path: Path) -> Optional[MLPClassifier]:
-        if self._classifier is None and path.exists():
+    @property
+    def embedding_backend(self) -> Optional[str]:
+        """Backend del modello di embedding caricato: torch se quello richiesto non era usabile."""
+        return self._loaded_embedding_backend
+
+    def get_embedding_store(
+        self,
+        directory: Path,
+        model_name: str,
+        dimension: int,
+        dtype: str = "float32",
+        max_rows: int = 100_000,
+    ) -> Optional[EmbeddingStore]:
+        store = self._embedding_store
+        if store is None or store.directory != Path(directory):
             with self._lock:
-                if self._classifier is None and path.exists():
-                    logger.info("Caricamento classificatore da: %s", path)
-                    with open(path, "rb") as f:
-                        self._classifier = pickle.load(f)
-        return self._classifier
-
-    def get_label_encoder(self, path: Path) -> Optional[LabelEncoder]:
-        if self._label_encoder is None and path.exists():
+                store = self._embedding_store
+                if store is None or store.directory != Path(directory):
+                    try:
+                        store = EmbeddingStore(
+                            directory, model_name, dimension, dtype=dtype, max_rows=max_rows
+                        )
+                    except (OSError, ValueError):
+                        logger.exception("Archivio embedding non disponibile in %s", directory)
+                        return None
+                    self._embedding_store = store
+        return store
+
+    def get_model_bundle(self, classifier_path: Path, encoder_path: Path) -> ModelBundle:
+        """Istantanea coerente del modello attivo, caricato al primo accesso.
+
+        Si usa l'artefatto corrente in ``ARTIFACT_DIR``; in sua assenza i
+        pickle legacy ``classifier_path`` / ``encoder_path``.
+        """
+        if not self._bundle.ready:
             with self._lock:
-                if self._label_encoder is None and path.exists():
-                    logger.info("Caricamento label encoder da: %s", path)
-                    with open(path, "rb") as f:
-                        self._label_encoder = pickle.load(f)
-        return self._label_encoder
+                if not self._bundle.ready:
+                    bundle = self._load_bundle(classifier_path, encoder_path)
+                    if bundle is not None:
+                        self._bundle = replace(bundle, version=self._bundle.version)
+        return self._bundle
+
+    def _load_bundle(self, classifier_path: Path, encoder_path: Path) -> Optional[ModelBundle]:
+        if self._artifact_dir is not None:
+            try:
+                bundle = load_current_artifact(self._artifact_dir)
+            except (OSError, ValueError, KeyError):
+                logger.exception("Artefatto del modello non leggibile in %s", self._artifact_dir)
+                bundle = None
+            if bundle is not None:
+                logger.info("Modello caricato dall'artefatto %s", bundle.manifest.get("version"))
+                return bundle
+        if classifier_path.exists() and encoder_path.exists():
+            logger.info("Caricamento modello dai pickle legacy: %s", classifier_path)
+            return load_pickle_bundle(classifier_path, encoder_path)
+        return None
+
+    @property
+    def model_version(self) -> int:
+        return self._bundle.version
 
-    def set_classifier(self, classifier: MLPClassifier) -> None:
-        self._classifier = classifier
+    @property
+    def current_bundle(self) -> ModelBundle:
+        """Modello attivo, senza caricarlo né attendere un caricamento in corso."""
+        return self._bundle
 
-    def set_label_encoder(self, encoder: LabelEncoder) -> None:
-        self._label_encoder = encoder
+    def swap_model(self, bundle: ModelBundle) -> int:
+        """Pubblica atomicamente un nuovo modello; ritorna il numero di versione assegnato."""
+        with self._lock:
+            version = self._bundle.version + 1
+            self._bundle = replace(bundle, version=version)
+            # Nello stesso lock: chi legge il nuovo modello trova già la cache allineata
+            self.prediction_cache.set_model_version(version)
+        logger.info("Modello versione %s attivo (%s)", version, bundle.manifest.get("version"))
+        return version
+
+    def get_inference_dispatcher(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+    ) -> InferenceDispatcher:
+        if self._inference_dispatcher is None:
+            with self._lock:
+                if self._inference_dispatcher is None:
+                    logger.info(
+                        "Avvio dispatcher di inferenza (batch max=%s, attesa max=%.1fms)",
+                        max_batch_size,
+                        max_wait_ms,
+                    )
+                    self._inference_dispatcher = InferenceDispatcher(
+                        batch_fn,
+                        max_batch_size=max_batch_size,
+                        max_wait_ms=max_wait_ms,
+                    )
+        return self._inference_dispatcher
 
     def clear(self) -> None:
         self._embedding_model = None
-        self._classifier = None
-        self._label_encoder = None
+        with self._lock:
+            self._bundle = ModelBundle(version=self._bundle.version)
@@ -0,0 +1,388 @@
+"""Backend di classificazione selezionabili con ``CLASSIFIER_BACKEND``.
+
+Ogni backend si addestra sugli embedding e produce un motore NumPy con la
+stessa interfaccia di ``MLPInferenceEngine`` (``predict``, ``predict_proba``,
+``arrays``/``params`` per gli artefatti):
+
+- ``mlp``: percettrone multistrato (sklearn in addestramento)
+- ``logreg``: regressione logistica multinomiale, un solo prodotto matriciale
+- ``centroid``: centroide coseno per modello, softmax sulle similarità
+- ``knn``: k vicini più simili tra gli embedding di training, voto pesato
+
+Esempio di confronto tra i backend (accuratezza, latenza p50/p99, memoria):
+    python classifiers.py --test-size 0.2
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import Config
+from inference import MLPInferenceEngine, softmax_
+
+logger = logging.getLogger(__name__)
+
+PREDICT_BATCH_SIZE = 256
+LATENCY_SAMPLES = 500
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    X = np.array(X, dtype=np.float32, ndmin=2)
+    X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    return X
+
+
+class _Engine(ABC):
+    """Base comune dei motori NumPy: argmax e probabilità in un solo passaggio."""
+
+    backend = ""
+
+    @abstractmethod
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Probabilità per classe, una riga per esempio."""
+
+    def predict(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Ritorna ``(indici delle classi predette, probabilità)``."""
+        probabilities = self.predict_proba(X)
+        return probabilities.argmax(axis=1), probabilities
+
+    @abstractmethod
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Array del motore, salvati nell'artefatto."""
+
+    def params(self) -> Dict[str, Any]:
+        return {}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
+
+
+class LinearEngine(_Engine):
+    """Regressione logistica: ``softmax(X @ coef + intercept)``."""
+
+    backend = "logreg"
+
+    def __init__(self, coef: np.ndarray, intercept: np.ndarray) -> None:
+        self.coef = np.ascontiguousarray(coef, dtype=np.float32)
+        self.intercept = np.ascontiguousarray(intercept, dtype=np.float32)
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray], params: Mapping[str, Any]) -> "LinearEngine":
+        return cls(arrays["coef"], arrays["intercept"])
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"coef": self.coef, "intercept": self.intercept}
+
+    @property
+    def input_dim(self) -> int:
+        return self.coef.shape[0]
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        h = np.asarray(X, dtype=np.float32).reshape(-1, self.input_dim) @ self.coef
+        h += self.intercept
+        if h.shape[1] == 1:
+            # Caso binario: una sola colonna per la classe positiva
+            p = 1.0 / (1.0 + np.exp(-np.clip(h, -60.0, 60.0)))
+            return np.hstack([1.0 - p, p])
+        return softmax_(h)
+
+
+class CentroidEngine(_Engine):
+    """Similarità coseno con il centroide di ogni modello, convertita con softmax."""
+
+    backend = "centroid"
+
+    def __init__(self, centroids: np.ndarray, temperature: float = 0.05) -> None:
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.temperature = float(temperature)
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray], params: Mapping[str, Any]) -> "CentroidEngine":
+        return cls(arrays["centroids"], params.get("temperature", 0.05))
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    def params(self) -> Dict[str, Any]:
+        return {"temperature": self.temperature}
+
+    @property
+    def input_dim(self) -> int:
+        return self.centroids.shape[1]
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        scores = _normalize(X) @ self.centroids.T
+        scores /= self.temperature
+        return softmax_(scores)
+
+
+class KNNEngine(_Engine):
+    """Voto dei ``k`` embedding di training più simili, pesato per similarità coseno."""
+
+    backend = "knn"
+
+    def __init__(
+        self, embeddings: np.ndarray, labels: np.ndarray, n_classes: int, k: int = 10
+    ) -> None:
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.labels = np.ascontiguousarray(labels, dtype=np.int32)
+        self.n_classes = int(n_classes)
+        self.k = max(1, min(int(k), len(self.labels)))
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray], params: Mapping[str, Any]) -> "KNNEngine":
+        return cls(arrays["embeddings"], arrays["labels"], params["n_classes"], params["k"])
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"embeddings": self.embeddings, "labels": self.labels}
+
+    def params(self) -> Dict[str, Any]:
+        return {"n_classes": self.n_classes, "k": self.k}
+
+    @property
+    def input_dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        similarities = _normalize(X) @ self.embeddings.T
+        if self.k < similarities.shape[1]:
+            neighbors = np.argpartition(-similarities, self.k - 1, axis=1)[:, : self.k]
+        else:
+            neighbors = np.broadcast_to(np.arange(similarities.shape[1]), similarities.shape)
+        weights = np.maximum(np.take_along_axis(similarities, neighbors, axis=1), 0.0)
+        # Vicini tutti con similarità <= 0: voto uniforme
+        weights[weights.sum(axis=1) == 0] = 1.0
+        probabilities = np.zeros((len(similarities), self.n_classes), dtype=np.float32)
+        rows = np.repeat(np.arange(len(similarities)), neighbors.shape[1])
+        np.add.at(probabilities, (rows, self.labels[neighbors].ravel()), weights.ravel())
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return probabilities
+
+
+def _fit_mlp(
+    X: np.ndarray, y: np.ndarray, n_classes: int, config: Config, params: Optional[Dict[str, Any]]
+) -> Tuple[MLPInferenceEngine, Dict[str, Any]]:
+    from sklearn.neural_network import MLPClassifier
+
+    if params is None:
+        params = {
+            "hidden_layer_sizes": config.MLP_HIDDEN_LAYERS,
+            "max_iter": config.MLP_MAX_ITER,
+            "random_state": config.MLP_RANDOM_STATE,
+        }
+    classifier = MLPClassifier(**params).fit(X, y)
+    info: Dict[str, Any] = {
+        "params": params,
+        "loss": round(float(classifier.loss_), 6),
+        "n_iter": int(classifier.n_iter_),
+    }
+    if getattr(classifier, "best_validation_score_", None) is not None:
+        info["best_validation_score"] = round(float(classifier.best_validation_score_), 5)
+    return MLPInferenceEngine.from_sklearn(classifier), info
+
+
+def _fit_logreg(
+    X: np.ndarray, y: np.ndarray, n_classes: int, config: Config, params: Optional[Dict[str, Any]]
+) -> Tuple[LinearEngine, Dict[str, Any]]:
+    from sklearn.linear_model import LogisticRegression
+
+    params = params or {"C": config.LOGREG_C, "max_iter": 1000}
+    classifier = LogisticRegression(**params).fit(X, y)
+    info = {"params": params, "n_iter": int(np.max(classifier.n_iter_))}
+    return LinearEngine(classifier.coef_.T, classifier.intercept_), info
+
+
+def _fit_centroid(
+    X: np.ndarray, y: np.ndarray, n_classes: int, config: Config, params: Optional[Dict[str, Any]]
+) -> Tuple[CentroidEngine, Dict[str, Any]]:
+    params = params or {"temperature": config.CENTROID_TEMPERATURE}
+    centroids = np.zeros((n_classes, X.shape[1]), dtype=np.float32)
+    for start in range(0, len(X), PREDICT_BATCH_SIZE * 16):
+        end = start + PREDICT_BATCH_SIZE * 16
+        np.add.at(centroids, y[start:end], _normalize(X[start:end]))
+    return CentroidEngine(_normalize(centroids), params["temperature"]), {"params": params}
+
+
+def _fit_knn(
+    X: np.ndarray, y: np.ndarray, n_classes: int, config: Config, params: Optional[Dict[str, Any]]
+) -> Tuple[KNNEngine, Dict[str, Any]]:
+    params = params or {"k": config.KNN_NEIGHBORS}
+    engine = KNNEngine(_normalize(X), y, n_classes, params["k"])
+    return engine, {"params": params}
+
+
+@dataclass(frozen=True)
+class ClassifierBackend:
+    """Backend registrato: motore NumPy e funzione di addestramento."""
+
+    name: str
+    engine_cls: Any
+    fit: Callable[..., Tuple[Any, Dict[str, Any]]]
+
+
+BACKENDS: Dict[str, ClassifierBackend] = {
+    backend.name: backend
+    for backend in (
+        ClassifierBackend("mlp", MLPInferenceEngine, _fit_mlp),
+        ClassifierBackend("logreg", LinearEngine, _fit_logreg),
+        ClassifierBackend("centroid", CentroidEngine, _fit_centroid),
+        ClassifierBackend("knn", KNNEngine, _fit_knn),
+    )
+}
+
+
+def get_backend(name: str) -> ClassifierBackend:
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Backend di classificazione non supportato: {name}") from None
+
+
+def train_classifier(
+    backend: str,
+    X: np.ndarray,
+    y: np.ndarray,
+    n_classes: int,
+    config: Config,
+    params: Optional[Dict[str, Any]] = None,
+) -> Tuple[Any, Dict[str, Any]]:
+    """Addestra il backend indicato e ritorna ``(motore NumPy, informazioni di training)``."""
+    start = time.perf_counter()
+    engine, info = get_backend(backend).fit(X, y, n_classes, config, params)
+    info["fit_time_s"] = round(time.perf_counter() - start, 3)
+    return engine, info
+
+
+def predict_batched(engine: Any, X: np.ndarray, batch_size: int = PREDICT_BATCH_SIZE) -> np.ndarray:
+    """Classi predette a blocchi (il kNN confronta ogni blocco con tutto il training)."""
+    predictions = [
+        engine.predict(X[start : start + batch_size])[0] for start in range(0, len(X), batch_size)
+    ]
+    return np.concatenate(predictions) if predictions else np.empty(0, dtype=np.int64)
+
+
+def measure_latency(engine: Any, X: np.ndarray, samples: int = LATENCY_SAMPLES) -> Dict[str, float]:
+    """Percentili della latenza (ms) di una singola predizione, come nelle richieste online."""
+    rows = np.random.default_rng(0).integers(0, len(X), size=samples)
+    timings = np.empty(len(rows))
+    for i, row in enumerate(rows):
+        sample = np.ascontiguousarray(X[row : row + 1], dtype=np.float32)
+        start = time.perf_counter()
+        engine.predict(sample)
+        timings[i] = time.perf_counter() - start
+    return {
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 4),
+        "p99_ms": round(float(np.percentile(timings, 99)) * 1000, 4),
+    }
+
+
+def compare_backends(
+    X: np.ndarray,
+    y: np.ndarray,
+    n_classes: int,
+    config: Config,
+    backends: Sequence[str] = tuple(BACKENDS),
+    test_size: float = 0.2,
+    mlp_params: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Addestra ogni backend sulla stessa divisione stratificata e ne misura costi e qualità."""
+    from sklearn.metrics import accuracy_score, f1_score
+    from sklearn.model_selection import train_test_split
+
+    train_idx, test_idx = train_test_split(
+        np.arange(len(y)), test_size=test_size, stratify=y, random_state=config.MLP_RANDOM_STATE
+    )
+    X_train, y_train = np.asarray(X[np.sort(train_idx)]), y[np.sort(train_idx)]
+    X_test, y_test = np.asarray(X[np.sort(test_idx)]), y[np.sort(test_idx)]
+    results = []
+    for name in backends:
+        logger.info("Confronto classificatori: %s", name)
+        engine, info = train_classifier(
+            name, X_train, y_train, n_classes, config, mlp_params if name == "mlp" else None
+        )
+        predicted = predict_batched(engine, X_test)
+        results.append(
+            {
+                "backend": name,
+                "accuracy": round(float(accuracy_score(y_test, predicted)), 5),
+                "f1_macro": round(float(f1_score(y_test, predicted, average="macro")), 5),
+                **measure_latency(engine, X_test),
+                "memory_kb": round(engine.nbytes / 1024, 1),
+                "fit_time_s": info["fit_time_s"],
+            }
+        )
+    return results
+
+
+def _parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Confronta i backend di classificazione su una divisione stratificata"
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=tuple(BACKENDS),
+        default=list(BACKENDS),
+        help="Backend da confrontare (default: tutti)",
+    )
+    parser.add_argument(
+        "--test-size", type=float, default=0.2, help="Quota di esempi di test (default: 0.2)"
+    )
+    parser.add_argument(
+        "-o", "--output", default=None, help="File JSON del confronto (default: MODEL_DIR)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] | None = None) -> int:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        stream=sys.stderr,
+    )
+    args = _parse_args(argv)
+    config = Config()
+
+    from cache import ModelCache
+    from training import encode_training_examples, mlp_params, scan_training_data, validate_summary
+
+    summary = scan_training_data(config.TRAINING_DATA_PATH)
+    if not validate_summary(summary):
+        return 1
+    training_set = encode_training_examples(config, ModelCache(config), summary.n_examples)
+    try:
+        classes, y = np.unique(np.asarray(training_set.models), return_inverse=True)
+        results = compare_backends(
+            training_set.X,
+            y,
+            len(classes),
+            config,
+            backends=args.backends,
+            test_size=args.test_size,
+            mlp_params=mlp_params(config),
+        )
+    finally:
+        training_set.embeddings_tmp_path.unlink(missing_ok=True)
+
+    print(f"{'backend':<10} {'accuracy':>9} {'f1':>7} {'p50 ms':>8} {'p99 ms':>8} {'mem KB':>10}")
+    for r in results:
+        print(
+            f"{r['backend']:<10} {r['accuracy']:>9.4f} {r['f1_macro']:>7.4f} "
+            f"{r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['memory_kb']:>10.1f}"
+        )
+    output = args.output or config.MODEL_DIR / "classifier_comparison.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"n_examples": summary.n_examples, "results": results}, f, indent=2)
+    logger.info("Confronto scritto in %s", output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -47,24 +47,71 @@ class Config:
     ENCODER_PATH: Path = None
 
     TRAINING_DATA_PATH: Path = Path(os.getenv("TRAINING_DATA_PATH", "training_data.json"))
+    ARTIFACT_DIR: Path = None
+    ARTIFACT_KEEP: int = _parse_int(os.getenv("ARTIFACT_KEEP"), 3)
+    TRAINING_EMBEDDINGS_PATH: Path = None
+    # Esempi letti e codificati per blocco durante l'addestramento
+    TRAINING_CHUNK_SIZE: int = _parse_int(os.getenv("TRAINING_CHUNK_SIZE"), 1024)
 
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
     EMBEDDING_DEVICE: str = os.getenv("EMBEDDING_DEVICE", "cpu")
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch").strip().lower()
+    ONNX_CACHE_DIR: Path = None
     EMBEDDING_BATCH_SIZE: int = _parse_int(os.getenv("EMBEDDING_BATCH_SIZE"), 16)
     NORMALIZE_EMBEDDINGS: bool = _parse_bool(
         os.getenv("NORMALIZE_EMBEDDINGS"), True
     )
+    EMBEDDING_STORE_ENABLED: bool = _parse_bool(
+        os.getenv("EMBEDDING_STORE_ENABLED"), True
+    )
+    EMBEDDING_STORE_DIR: Path = None
+    EMBEDDING_STORE_DTYPE: str = os.getenv("EMBEDDING_STORE_DTYPE", "float32").strip().lower()
+    EMBEDDING_STORE_MAX_ROWS: int = _parse_int(
+        os.getenv("EMBEDDING_STORE_MAX_ROWS"), 100_000
+    )
+    INFERENCE_BATCHING: bool = _parse_bool(os.getenv("INFERENCE_BATCHING"), True)
+    INFERENCE_BATCH_MAX_SIZE: int = _parse_int(
+        os.getenv("INFERENCE_BATCH_MAX_SIZE"), 0
+    )
+    INFERENCE_BATCH_MAX_WAIT_MS: float = _parse_float(
+        os.getenv("INFERENCE_BATCH_MAX_WAIT_MS"), 5.0
+    )
     MLP_HIDDEN_LAYERS: Tuple[int, ...] = _parse_int_tuple(
         os.getenv("MLP_HIDDEN_LAYERS"), (100, 50)
     )
     MLP_MAX_ITER: int = _parse_int(os.getenv("MLP_MAX_ITER"), 500)
     MLP_RANDOM_STATE: int = _parse_int(os.getenv("MLP_RANDOM_STATE"), 42)
+    # Classificatore: mlp | logreg | centroid | knn (confronto con classifiers.py)
+    CLASSIFIER_BACKEND: str = os.getenv("CLASSIFIER_BACKEND", "mlp").strip().lower()
+    LOGREG_C: float = _parse_float(os.getenv("LOGREG_C"), 1.0)
+    CENTROID_TEMPERATURE: float = _parse_float(os.getenv("CENTROID_TEMPERATURE"), 0.05)
+    KNN_NEIGHBORS: int = _parse_int(os.getenv("KNN_NEIGHBORS"), 10)
+    # Riduzione degli embedding prima della classificazione: none | pca | random
+    PROJECTION_METHOD: str = os.getenv("PROJECTION_METHOD", "none").strip().lower()
+    PROJECTION_DIM: int = _parse_int(os.getenv("PROJECTION_DIM"), 64)
+    # Confronto con il classificatore senza proiezione: un addestramento in più
+    PROJECTION_EVALUATE: bool = _parse_bool(os.getenv("PROJECTION_EVALUATE"), False)
+    # Quota di esempi esclusi dal training per il report di valutazione (0 = disattivato)
+    EVAL_HOLDOUT_FRACTION: float = _parse_float(os.getenv("EVAL_HOLDOUT_FRACTION"), 0.2)
+    # Dopo la valutazione riaddestra su tutti gli esempi, holdout compreso
+    EVAL_REFIT_FULL: bool = _parse_bool(os.getenv("EVAL_REFIT_FULL"), True)
+    # Usa gli iperparametri scelti da tuning.py (se applicati con --apply)
+    MLP_USE_TUNED_PARAMS: bool = _parse_bool(os.getenv("MLP_USE_TUNED_PARAMS"), True)
+    TUNING_REPORT_PATH: Path = None
 
     CONFIDENCE_THRESHOLD: float = _parse_float(
         os.getenv("CONFIDENCE_THRESHOLD"), 0.5
     )
     TOP_N_PREDICTIONS: int = _parse_int(os.getenv("TOP_N_PREDICTIONS"), 3)
 
+    PREDICTION_CACHE_SIZE: int = _parse_int(os.getenv("PREDICTION_CACHE_SIZE"), 1000)
+    PREDICTION_CACHE_TTL: int = _parse_int(os.getenv("PREDICTION_CACHE_TTL"), 3600)
+    PREDICTION_CACHE_SHARDS: int = _parse_int(os.getenv("PREDICTION_CACHE_SHARDS"), 8)
+    PREDICTION_CACHE_MAX_MB: int = _parse_int(os.getenv("PREDICTION_CACHE_MAX_MB"), 16)
+    PREDICTION_CACHE_NORMALIZE: bool = _parse_bool(
+        os.getenv("PREDICTION_CACHE_NORMALIZE"), True
+    )
+
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
     OLLAMA_MODEL: str = os.getenv("OLLAMA_MODEL", "gemma3:270m")
     OLLAMA_TIMEOUT: int = _parse_int(os.getenv("OLLAMA_TIMEOUT"), 60)
@@ -73,15 +120,71 @@ class Config:
     )
     OLLAMA_TOP_P: float = _parse_float(os.getenv("OLLAMA_TOP_P"), 0.9)
     OLLAMA_NUM_PREDICT: int = _parse_int(os.getenv("OLLAMA_NUM_PREDICT"), 450)
+    # Client HTTP condiviso: connessioni nel pool, retry con backoff esponenziale
+    OLLAMA_POOL_SIZE: int = _parse_int(os.getenv("OLLAMA_POOL_SIZE"), 4)
+    OLLAMA_RETRIES: int = _parse_int(os.getenv("OLLAMA_RETRIES"), 2)
+    OLLAMA_RETRY_BACKOFF: float = _parse_float(os.getenv("OLLAMA_RETRY_BACKOFF"), 0.5)
+    OLLAMA_HTTP_KEEPALIVE: bool = _parse_bool(os.getenv("OLLAMA_HTTP_KEEPALIVE"), True)
+    # Generazioni contemporanee verso Ollama; le altre attendono in coda
+    OLLAMA_MAX_IN_FLIGHT: int = _parse_int(os.getenv("OLLAMA_MAX_IN_FLIGHT"), 1)
+    OLLAMA_QUEUE_SIZE: int = _parse_int(os.getenv("OLLAMA_QUEUE_SIZE"), 8)
+    OLLAMA_QUEUE_TIMEOUT: float = _parse_float(os.getenv("OLLAMA_QUEUE_TIMEOUT"), 30.0)
+    # Controllo periodico di Ollama e circuit breaker sulle generazioni
+    OLLAMA_HEALTH_INTERVAL: float = _parse_float(os.getenv("OLLAMA_HEALTH_INTERVAL"), 15.0)
+    OLLAMA_BREAKER_THRESHOLD: int = _parse_int(os.getenv("OLLAMA_BREAKER_THRESHOLD"), 3)
+    OLLAMA_BREAKER_RESET: float = _parse_float(os.getenv("OLLAMA_BREAKER_RESET"), 30.0)
+    # Residenza del modello in Ollama: keep_alive inviato con ogni richiesta,
+    # precaricamento all'avvio e rinnovo periodico nelle ore di attività
+    OLLAMA_KEEP_ALIVE: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m").strip()
+    OLLAMA_PRELOAD: bool = _parse_bool(os.getenv("OLLAMA_PRELOAD"), True)
+    OLLAMA_KEEPALIVE_REFRESH: float = _parse_float(os.getenv("OLLAMA_KEEPALIVE_REFRESH"), 300.0)
+    # Ore [inizio, fine) e giorni (0 = lunedì) in cui il modello resta caricato
+    OLLAMA_ACTIVE_HOURS: Tuple[int, ...] = _parse_int_tuple(
+        os.getenv("OLLAMA_ACTIVE_HOURS"), (8, 20)
+    )
+    OLLAMA_ACTIVE_DAYS: Tuple[int, ...] = _parse_int_tuple(
+        os.getenv("OLLAMA_ACTIVE_DAYS"), (0, 1, 2, 3, 4)
+    )
+    # Risposta NDJSON token per token nell'interfaccia Gradio
+    OLLAMA_STREAM: bool = _parse_bool(os.getenv("OLLAMA_STREAM"), True)
+    # Cache dei prompt ottimizzati: LRU in memoria + SQLite opzionale
+    OPTIMIZATION_CACHE_ENABLED: bool = _parse_bool(
+        os.getenv("OPTIMIZATION_CACHE_ENABLED"), True
+    )
+    OPTIMIZATION_CACHE_SIZE: int = _parse_int(os.getenv("OPTIMIZATION_CACHE_SIZE"), 256)
+    OPTIMIZATION_CACHE_TTL: int = _parse_int(os.getenv("OPTIMIZATION_CACHE_TTL"), 86400)
+    OPTIMIZATION_CACHE_PERSIST: bool = _parse_bool(
+        os.getenv("OPTIMIZATION_CACHE_PERSIST"), True
+    )
+    OPTIMIZATION_CACHE_PATH: Path = None
+    OPTIMIZATION_CACHE_MAX_ROWS: int = _parse_int(
+        os.getenv("OPTIMIZATION_CACHE_MAX_ROWS"), 10_000
+    )
 
     GRADIO_SERVER_NAME: str = os.getenv("GRADIO_SERVER_NAME", "0.0.0.0")
     GRADIO_SERVER_PORT: int = _parse_int(os.getenv("GRADIO_SERVER_PORT"), 7860)
     GRADIO_SHARE: bool = _parse_bool(os.getenv("GRADIO_SHARE"), False)
+    # Coda di Gradio (necessaria per gli handler in streaming); il limite di
+    # concorrenza vale solo per l'ottimizzazione, il routing non ne ha
+    GRADIO_CONCURRENCY_LIMIT: int = _parse_int(os.getenv("GRADIO_CONCURRENCY_LIMIT"), 1)
+    GRADIO_QUEUE_SIZE: int = _parse_int(os.getenv("GRADIO_QUEUE_SIZE"), 16)
+
+    SERVE_MODE: str = os.getenv("SERVE_MODE", "gradio").strip().lower()
+    API_HOST: str = os.getenv("API_HOST", "0.0.0.0")
+    API_PORT: int = _parse_int(os.getenv("API_PORT"), 8000)
+    API_EXECUTOR_WORKERS: int = _parse_int(os.getenv("API_EXECUTOR_WORKERS"), 4)
+    API_MAX_PENDING: int = _parse_int(os.getenv("API_MAX_PENDING"), 64)
+    API_MAX_BATCH_SIZE: int = _parse_int(os.getenv("API_MAX_BATCH_SIZE"), 1024)
 
     CPU_THREADS: int = _parse_int(os.getenv("CPU_THREADS"), 2)
     RETRAIN_ON_DATA_CHANGE: bool = _parse_bool(
         os.getenv("RETRAIN_ON_DATA_CHANGE"), False
     )
+    RETRAIN_WATCH_ENABLED: bool = _parse_bool(os.getenv("RETRAIN_WATCH_ENABLED"), False)
+    RETRAIN_WATCH_INTERVAL: float = _parse_float(os.getenv("RETRAIN_WATCH_INTERVAL"), 30.0)
+
+    # Predizione di prova prima di dichiarare il servizio pronto
+    STARTUP_WARMUP: bool = _parse_bool(os.getenv("STARTUP_WARMUP"), True)
 
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
 
@@ -92,12 +195,87 @@ class Config:
             self.CLASSIFIER_PATH = self.MODEL_DIR / "mlp_classifier.pkl"
         if self.ENCODER_PATH is None:
             self.ENCODER_PATH = self.MODEL_DIR / "label_encoder.pkl"
+        if self.ARTIFACT_DIR is None:
+            self.ARTIFACT_DIR = Path(
+                os.getenv("ARTIFACT_DIR", str(self.MODEL_DIR / "artifacts"))
+            )
+        if self.TRAINING_EMBEDDINGS_PATH is None:
+            self.TRAINING_EMBEDDINGS_PATH = self.MODEL_DIR / "training_embeddings.npz"
+        if self.TUNING_REPORT_PATH is None:
+            self.TUNING_REPORT_PATH = self.MODEL_DIR / "tuning_report.json"
+        if self.ONNX_CACHE_DIR is None:
+            self.ONNX_CACHE_DIR = Path(
+                os.getenv("ONNX_CACHE_DIR", str(self.MODEL_DIR / "onnx"))
+            )
+        if self.OPTIMIZATION_CACHE_PATH is None:
+            self.OPTIMIZATION_CACHE_PATH = Path(
+                os.getenv(
+                    "OPTIMIZATION_CACHE_PATH", str(self.MODEL_DIR / "optimizations.sqlite3")
+                )
+            )
+        if self.EMBEDDING_STORE_DIR is None:
+            self.EMBEDDING_STORE_DIR = Path(
+                os.getenv("EMBEDDING_STORE_DIR", str(self.MODEL_DIR / "embeddings"))
+            )
         # Validazione dei parametri
         self.CONFIDENCE_THRESHOLD = min(max(self.CONFIDENCE_THRESHOLD, 0.0), 1.0)
         self.TOP_N_PREDICTIONS = max(1, self.TOP_N_PREDICTIONS)
+        self.PREDICTION_CACHE_SIZE = max(1, self.PREDICTION_CACHE_SIZE)
+        self.PREDICTION_CACHE_TTL = max(1, self.PREDICTION_CACHE_TTL)
+        self.PREDICTION_CACHE_SHARDS = max(1, self.PREDICTION_CACHE_SHARDS)
+        self.PREDICTION_CACHE_MAX_MB = max(0, self.PREDICTION_CACHE_MAX_MB)
         self.OLLAMA_TIMEOUT = max(1, self.OLLAMA_TIMEOUT)
         self.OLLAMA_TEMPERATURE = min(max(self.OLLAMA_TEMPERATURE, 0.0), 1.0)
         self.OLLAMA_TOP_P = min(max(self.OLLAMA_TOP_P, 0.0), 1.0)
         self.OLLAMA_NUM_PREDICT = max(64, self.OLLAMA_NUM_PREDICT)
+        self.OLLAMA_POOL_SIZE = max(1, self.OLLAMA_POOL_SIZE)
+        self.OLLAMA_RETRIES = max(0, self.OLLAMA_RETRIES)
+        self.OLLAMA_RETRY_BACKOFF = max(0.0, self.OLLAMA_RETRY_BACKOFF)
+        self.OLLAMA_MAX_IN_FLIGHT = max(1, self.OLLAMA_MAX_IN_FLIGHT)
+        self.OLLAMA_QUEUE_SIZE = max(0, self.OLLAMA_QUEUE_SIZE)
+        self.OLLAMA_QUEUE_TIMEOUT = max(0.0, self.OLLAMA_QUEUE_TIMEOUT)
+        self.OLLAMA_HEALTH_INTERVAL = max(1.0, self.OLLAMA_HEALTH_INTERVAL)
+        self.OLLAMA_BREAKER_THRESHOLD = max(1, self.OLLAMA_BREAKER_THRESHOLD)
+        self.OLLAMA_BREAKER_RESET = max(1.0, self.OLLAMA_BREAKER_RESET)
+        if not self.OLLAMA_KEEP_ALIVE:
+            self.OLLAMA_KEEP_ALIVE = "30m"
+        self.OLLAMA_KEEPALIVE_REFRESH = max(0.0, self.OLLAMA_KEEPALIVE_REFRESH)
+        if len(self.OLLAMA_ACTIVE_HOURS) != 2 or not (
+            0 <= self.OLLAMA_ACTIVE_HOURS[0] < self.OLLAMA_ACTIVE_HOURS[1] <= 24
+        ):
+            self.OLLAMA_ACTIVE_HOURS = (8, 20)
+        self.OLLAMA_ACTIVE_DAYS = tuple(
+            sorted({day for day in self.OLLAMA_ACTIVE_DAYS if 0 <= day <= 6})
+        ) or (0, 1, 2, 3, 4)
+        self.OPTIMIZATION_CACHE_SIZE = max(1, self.OPTIMIZATION_CACHE_SIZE)
+        self.OPTIMIZATION_CACHE_TTL = max(1, self.OPTIMIZATION_CACHE_TTL)
+        self.OPTIMIZATION_CACHE_MAX_ROWS = max(1, self.OPTIMIZATION_CACHE_MAX_ROWS)
+        self.GRADIO_CONCURRENCY_LIMIT = max(1, self.GRADIO_CONCURRENCY_LIMIT)
+        self.GRADIO_QUEUE_SIZE = max(1, self.GRADIO_QUEUE_SIZE)
         self.CPU_THREADS = max(1, self.CPU_THREADS)
+        if self.SERVE_MODE not in ("gradio", "api", "both"):
+            self.SERVE_MODE = "gradio"
+        self.API_EXECUTOR_WORKERS = max(1, self.API_EXECUTOR_WORKERS)
+        self.API_MAX_PENDING = max(1, self.API_MAX_PENDING)
+        self.API_MAX_BATCH_SIZE = max(1, self.API_MAX_BATCH_SIZE)
         self.EMBEDDING_BATCH_SIZE = max(1, self.EMBEDDING_BATCH_SIZE)
+        if self.EMBEDDING_BACKEND not in ("torch", "onnx", "onnx-int8"):
+            self.EMBEDDING_BACKEND = "torch"
+        if self.EMBEDDING_STORE_DTYPE not in ("float32", "float16"):
+            self.EMBEDDING_STORE_DTYPE = "float32"
+        self.EMBEDDING_STORE_MAX_ROWS = max(1, self.EMBEDDING_STORE_MAX_ROWS)
+        if self.INFERENCE_BATCH_MAX_SIZE <= 0:
+            self.INFERENCE_BATCH_MAX_SIZE = self.EMBEDDING_BATCH_SIZE
+        self.INFERENCE_BATCH_MAX_WAIT_MS = max(0.0, self.INFERENCE_BATCH_MAX_WAIT_MS)
+        self.RETRAIN_WATCH_INTERVAL = max(1.0, self.RETRAIN_WATCH_INTERVAL)
+        self.ARTIFACT_KEEP = max(1, self.ARTIFACT_KEEP)
+        self.TRAINING_CHUNK_SIZE = max(1, self.TRAINING_CHUNK_SIZE)
+        if self.CLASSIFIER_BACKEND not in ("mlp", "logreg", "centroid", "knn"):
+            self.CLASSIFIER_BACKEND = "mlp"
+        self.LOGREG_C = max(1e-6, self.LOGREG_C)
+        self.CENTROID_TEMPERATURE = max(1e-3, self.CENTROID_TEMPERATURE)
+        self.KNN_NEIGHBORS = max(1, self.KNN_NEIGHBORS)
+        if self.PROJECTION_METHOD not in ("none", "pca", "random"):
+            self.PROJECTION_METHOD = "none"
+        self.PROJECTION_DIM = max(2, self.PROJECTION_DIM)
+        self.EVAL_HOLDOUT_FRACTION = min(max(self.EVAL_HOLDOUT_FRACTION, 0.0), 0.5)
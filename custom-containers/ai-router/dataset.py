@@ -0,0 +1,180 @@
+"""Lettura in streaming dei dati di addestramento.
+
+Formati supportati:
+- JSON annidato (storico): ``[{"modello": "...", "prompts": ["...", ...]}, ...]``
+- JSONL piatto, un esempio per riga: ``{"modello": "...", "prompt": "..."}``
+
+Il JSON annidato viene decodificato un elemento alla volta, senza caricare
+l'intero file; con il JSONL la memoria dipende solo dalla riga corrente,
+quindi è il formato consigliato per dataset molto grandi.
+"""
+import hashlib
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, Tuple
+
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+READ_SIZE = 1 << 16
+
+
+def fingerprint_example(prompt: str, model: str) -> str:
+    """Impronta SHA-256 della coppia (prompt, modello)."""
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def detect_format(path: Path) -> str:
+    """``"jsonl"`` per estensione o se il file inizia con un oggetto, altrimenti ``"json"``."""
+    path = Path(path)
+    if path.suffix.lower() in JSONL_SUFFIXES:
+        return "jsonl"
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.read(1024)
+            if not chunk:
+                return "json"
+            stripped = chunk.lstrip()
+            if stripped:
+                return "jsonl" if stripped[0] == "{" else "json"
+
+
+def _iter_json_array(stream: IO[str]) -> Iterator[Any]:
+    """Decodifica uno alla volta gli elementi di un array JSON di primo livello."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    read_size = READ_SIZE
+    state = "start"
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                raise json.JSONDecodeError("File di training troncato", buffer, pos)
+            chunk = stream.read(read_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        char = buffer[pos]
+        if state == "start":
+            if char != "[":
+                raise ValueError("Il file di training deve contenere una lista di oggetti")
+            pos += 1
+            state = "first"
+        elif state == "separator":
+            if char == "]":
+                return
+            if char != ",":
+                raise json.JSONDecodeError("Atteso ',' o ']'", buffer, pos)
+            pos += 1
+            state = "item"
+        elif state == "first" and char == "]":
+            return
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Elemento non ancora completo nel buffer: si legge di più
+                chunk = stream.read(read_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                read_size *= 2
+                continue
+            read_size = READ_SIZE
+            yield item
+            pos = end
+            state = "separator"
+            # Si scarta la parte già decodificata per non far crescere il buffer
+            if pos > READ_SIZE:
+                buffer, pos = buffer[pos:], 0
+
+
+def _iter_nested(path: Path) -> Iterator[Tuple[Any, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for item in _iter_json_array(f):
+            if not isinstance(item, dict):
+                raise ValueError("Ogni elemento del training deve essere un oggetto JSON")
+            if "modello" not in item or "prompts" not in item:
+                raise KeyError("Ogni elemento deve contenere le chiavi 'modello' e 'prompts'")
+            if not isinstance(item["prompts"], list):
+                raise ValueError("Il campo 'prompts' deve essere una lista")
+            for prompt in item["prompts"]:
+                yield prompt, item["modello"]
+
+
+def _iter_jsonl(path: Path) -> Iterator[Tuple[Any, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Riga {number}: JSON non valido ({e})") from e
+            if not isinstance(item, dict):
+                raise ValueError(f"Riga {number}: ogni riga deve essere un oggetto JSON")
+            if "modello" not in item or "prompt" not in item:
+                raise KeyError(f"Riga {number}: servono le chiavi 'modello' e 'prompt'")
+            yield item["prompt"], item["modello"]
+
+
+def iter_training_examples(path: Path) -> Iterator[Tuple[Any, Any]]:
+    """Coppie ``(prompt, modello)`` nell'ordine del file, lette in streaming."""
+    if detect_format(path) == "jsonl":
+        return _iter_jsonl(Path(path))
+    return _iter_nested(Path(path))
+
+
+def iter_training_chunks(path: Path, chunk_size: int) -> Iterator[Tuple[List[Any], List[Any]]]:
+    """Blocchi ``(prompts, modelli)`` di al più ``chunk_size`` esempi."""
+    prompts: List[Any] = []
+    models: List[Any] = []
+    for prompt, model in iter_training_examples(path):
+        prompts.append(prompt)
+        models.append(model)
+        if len(prompts) >= chunk_size:
+            yield prompts, models
+            prompts, models = [], []
+    if prompts:
+        yield prompts, models
+
+
+@dataclass
+class DatasetSummary:
+    """Risultato di una scansione completa: conteggi, esempi non validi e impronta."""
+
+    n_examples: int = 0
+    invalid_prompts: int = 0
+    invalid_models: int = 0
+    class_counts: Dict[str, int] = field(default_factory=dict)
+    fingerprint: str = ""
+
+
+def scan_training_data(path: Path) -> DatasetSummary:
+    """Una passata in streaming per contare e validare gli esempi e calcolarne l'impronta."""
+    summary = DatasetSummary()
+    counts: Counter = Counter()
+    digests: List[bytes] = []
+    for prompt, model in iter_training_examples(path):
+        summary.n_examples += 1
+        if not prompt or not isinstance(prompt, str):
+            summary.invalid_prompts += 1
+            continue
+        if not model or not isinstance(model, str):
+            summary.invalid_models += 1
+            continue
+        counts[model] += 1
+        digests.append(bytes.fromhex(fingerprint_example(prompt, model)))
+    # Impronte ordinate: il risultato non dipende dall'ordine degli esempi (l'ordine
+    # dei digest coincide con quello della loro forma esadecimale)
+    digests.sort()
+    digest = hashlib.sha256()
+    for fingerprint in digests:
+        digest.update(fingerprint.hex().encode("ascii"))
+    summary.class_counts = dict(counts)
+    summary.fingerprint = digest.hexdigest()
+    return summary
@@ -0,0 +1,295 @@
+"""Backend di embedding alternativi a PyTorch (ONNX Runtime, ONNX int8).
+
+Il grafo ONNX viene esportato una sola volta dal modello SentenceTransformer
+e salvato in ``ONNX_CACHE_DIR``; gli avvii successivi richiedono solo
+``onnxruntime`` e il tokenizer, senza caricare torch.
+
+Verifica di parità contro torch:
+    python embedding_backends.py
+"""
+import inspect
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import Any, List, Sequence, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_BACKENDS = ("torch", "onnx", "onnx-int8")
+EXPORT_METADATA = "export.json"
+FP32_FILENAME = "model.onnx"
+INT8_FILENAME = "model-int8.onnx"
+PARITY_MIN_COSINE = 0.99
+PARITY_SENTENCES = (
+    "Scrivi una funzione Python che calcoli i numeri di Fibonacci",
+    "Spiega il calcolo quantistico in termini semplici",
+    "Crea un piano marketing per un nuovo prodotto tecnologico",
+    "Analizza il concetto di Dasein in Heidegger",
+    "Debug this code: print('Hello World')",
+    "How do I optimize my database performance?",
+)
+
+
+def onnx_export_dir(cache_dir: Path, model_name: str) -> Path:
+    """Directory in cui viene salvato l'export ONNX di ``model_name``."""
+    return Path(cache_dir) / model_name.replace("/", "__")
+
+
+def _l2_normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    np.maximum(norms, 1e-12, out=norms)
+    return x / norms
+
+
+class OnnxEmbeddingModel:
+    """Encoder ONNX Runtime con la stessa interfaccia ``encode`` di SentenceTransformer."""
+
+    def __init__(self, export_dir: Path, quantized: bool = False, threads: int = 0) -> None:
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.export_dir = Path(export_dir)
+        with open(self.export_dir / EXPORT_METADATA, "r", encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        model_path = self.export_dir / (INT8_FILENAME if quantized else FP32_FILENAME)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            str(model_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.export_dir))
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.pooling = self.metadata.get("pooling", "mean")
+        self.normalize = bool(self.metadata.get("normalize", False))
+        self.max_seq_length = int(self.metadata.get("max_seq_length", 256))
+        self.dimension = int(self.metadata["dimension"])
+        self.quantized = quantized
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _pool(self, token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[..., None].astype(np.float32)
+        if self.pooling == "max":
+            masked = np.where(mask > 0, token_embeddings, -1e9)
+            return masked.max(axis=1)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.maximum(mask.sum(axis=1), 1e-9)
+        return summed / counts
+
+    def encode(
+        self,
+        sentences: Union[str, Sequence[str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        **kwargs: Any,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts: List[str] = [sentences] if single else list(sentences)
+        output = np.empty((len(texts), self.dimension), dtype=np.float32)
+        # Ordina per lunghezza per ridurre il padding all'interno dei batch
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        batch_size = max(1, batch_size)
+        for start in range(0, len(texts), batch_size):
+            indices = order[start : start + batch_size]
+            tokens = self.tokenizer(
+                [texts[i] for i in indices],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {name: tokens[name].astype(np.int64) for name in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            pooled = self._pool(token_embeddings, tokens["attention_mask"])
+            if self.normalize or normalize_embeddings:
+                pooled = _l2_normalize(pooled)
+            output[indices] = pooled
+        return output[0] if single else output
+
+
+def _pooling_mode(sentence_model: Any) -> str:
+    for module in sentence_model:
+        if type(module).__name__ != "Pooling":
+            continue
+        # Le versioni recenti espongono "pooling_mode", le precedenti i flag booleani
+        settings = module.get_config_dict()
+        mode = str(settings.get("pooling_mode", ""))
+        if mode == "cls" or settings.get("pooling_mode_cls_token"):
+            return "cls"
+        if mode == "max" or settings.get("pooling_mode_max_tokens"):
+            return "max"
+        return "mean"
+    return "mean"
+
+
+def export_onnx_model(model_name: str, export_dir: Path, quantize: bool = True) -> Path:
+    """Esporta ``model_name`` in ONNX (e opzionalmente in int8) dentro ``export_dir``."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    logger.info("Export ONNX del modello di embedding %s in %s", model_name, export_dir)
+
+    sentence_model = SentenceTransformer(model_name, device="cpu")
+    transformer = sentence_model[0]
+    tokenizer = transformer.tokenizer
+    dummy = tokenizer(["export onnx"], return_tensors="pt")
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in dummy
+    ]
+
+    class _TokenEmbeddings(torch.nn.Module):
+        def __init__(self, model: Any) -> None:
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs: Any) -> Any:
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs["dynamo"] = False
+    fp32_path = export_dir / FP32_FILENAME
+    with torch.no_grad():
+        torch.onnx.export(
+            _TokenEmbeddings(transformer.auto_model).eval(),
+            tuple(dummy[name] for name in input_names),
+            str(fp32_path),
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            **export_kwargs,
+        )
+    tokenizer.save_pretrained(str(export_dir))
+
+    metadata = {
+        "model_name": model_name,
+        "pooling": _pooling_mode(sentence_model),
+        "normalize": any(type(m).__name__ == "Normalize" for m in sentence_model),
+        "max_seq_length": int(sentence_model.max_seq_length or 256),
+        "dimension": int(sentence_model.get_sentence_embedding_dimension()),
+        "input_names": input_names,
+    }
+    with open(export_dir / EXPORT_METADATA, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(
+            str(fp32_path), str(export_dir / INT8_FILENAME), weight_type=QuantType.QInt8
+        )
+
+    parity = {}
+    for quantized in (False, True) if quantize else (False,):
+        candidate = OnnxEmbeddingModel(export_dir, quantized=quantized)
+        min_cosine = check_embedding_parity(sentence_model, candidate)
+        parity["onnx-int8" if quantized else "onnx"] = min_cosine
+        log = logger.info if min_cosine >= PARITY_MIN_COSINE else logger.warning
+        log(
+            "Parità embedding %s vs torch: coseno minimo %.4f",
+            "onnx-int8" if quantized else "onnx",
+            min_cosine,
+        )
+    metadata["parity_min_cosine"] = parity
+    with open(export_dir / EXPORT_METADATA, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    return export_dir
+
+
+def check_embedding_parity(
+    reference_model: Any,
+    candidate_model: Any,
+    sentences: Sequence[str] = PARITY_SENTENCES,
+) -> float:
+    """Coseno minimo tra gli embedding del modello di riferimento e del candidato."""
+    reference = reference_model.encode(
+        list(sentences), convert_to_numpy=True, normalize_embeddings=True
+    )
+    candidate = candidate_model.encode(
+        list(sentences), convert_to_numpy=True, normalize_embeddings=True
+    )
+    return float((_l2_normalize(reference) * _l2_normalize(candidate)).sum(axis=1).min())
+
+
+def _check_export_parity(export_dir: Path, backend: str) -> None:
+    """Solleva RuntimeError se all'export il backend è risultato sotto ``PARITY_MIN_COSINE``."""
+    with open(export_dir / EXPORT_METADATA, "r", encoding="utf-8") as f:
+        min_cosine = json.load(f).get("parity_min_cosine", {}).get(backend)
+    if min_cosine is not None and min_cosine < PARITY_MIN_COSINE:
+        raise RuntimeError(
+            f"Embedding {backend} troppo diversi da torch: coseno minimo {min_cosine:.4f} "
+            f"< {PARITY_MIN_COSINE}"
+        )
+
+
+def load_embedding_model(
+    model_name: str,
+    device: str = "cpu",
+    backend: str = "torch",
+    cache_dir: Path | None = None,
+    threads: int = 0,
+    check_parity: bool = True,
+) -> Any:
+    """Carica il modello di embedding con il backend richiesto, esportandolo se serve.
+
+    Con ``check_parity`` un backend ONNX la cui parità con torch, misurata
+    all'export, è sotto ``PARITY_MIN_COSINE`` solleva RuntimeError: il
+    chiamante ripiega su torch.
+    """
+    if backend in ("onnx", "onnx-int8"):
+        if cache_dir is None:
+            raise ValueError("cache_dir è obbligatorio per i backend ONNX")
+        quantized = backend == "onnx-int8"
+        export_dir = onnx_export_dir(cache_dir, model_name)
+        model_file = export_dir / (INT8_FILENAME if quantized else FP32_FILENAME)
+        if not model_file.exists() or not (export_dir / EXPORT_METADATA).exists():
+            export_onnx_model(model_name, export_dir, quantize=quantized)
+        if check_parity:
+            _check_export_parity(export_dir, backend)
+        return OnnxEmbeddingModel(export_dir, quantized=quantized, threads=threads)
+
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device=device)
+    if threads > 0:
+        import torch
+
+        # Sul Pi i thread intra-op di default (uno per core) competono con il server
+        torch.set_num_threads(threads)
+    return model
+
+
+if __name__ == "__main__":
+    from config import Config
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    conf = Config()
+    reference = load_embedding_model(conf.EMBEDDING_MODEL, backend="torch")
+    worst = 1.0
+    for name in ("onnx", "onnx-int8"):
+        candidate = load_embedding_model(
+            conf.EMBEDDING_MODEL, backend=name, cache_dir=conf.ONNX_CACHE_DIR, check_parity=False
+        )
+        min_cosine = check_embedding_parity(reference, candidate)
+        worst = min(worst, min_cosine)
+        print(f"{name}: coseno minimo vs torch {min_cosine:.4f}")
+    sys.exit(0 if worst >= PARITY_MIN_COSINE else 1)
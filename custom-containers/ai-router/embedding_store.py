@@ -0,0 +1,308 @@
+"""Archivio persistente degli embedding su file memory-mapped.
+
+Ogni modello di embedding ha una propria directory con:
+- ``vectors.bin``: matrice ``capacity x dimension`` (float32 o float16)
+- ``keys.bin``: SHA-256 del prompt per ogni riga (32 byte, zero = riga libera)
+- ``meta.json``: modello, dimensione e dtype, scritto solo alla creazione
+
+Le righe sono solo in append: un processo che trova righe scritte da un
+altro processo le indicizza alla successiva scrittura. Il numero di righe
+si ricava da ``keys.bin`` (prima chiave nulla), così un inserimento non
+riscrive altri file oltre alle righe nuove.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - piattaforme senza flock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 32
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def prompt_key(prompt: str) -> bytes:
+    """Chiave SHA-256 del prompt."""
+    return hashlib.sha256(prompt.encode("utf-8")).digest()
+
+
+def store_namespace(model_name: str, backend: str, normalized: bool) -> str:
+    """Nome della directory dell'archivio per un modello di embedding."""
+    slug = model_name.replace("/", "__")
+    return f"{slug}__{backend}__{'norm' if normalized else 'raw'}"
+
+
+class EmbeddingStore:
+    """Embedding persistenti indicizzati per SHA-256 del prompt, condivisibili tra processi."""
+
+    def __init__(
+        self,
+        directory: Path,
+        model_name: str,
+        dimension: int,
+        dtype: str = "float32",
+        max_rows: int = 100_000,
+        initial_capacity: int = 1024,
+    ) -> None:
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"dtype non supportato: {dtype}")
+        self.directory = Path(directory)
+        self.model_name = model_name
+        self.dimension = int(dimension)
+        self.dtype = np.dtype(dtype)
+        self.max_rows = max(1, max_rows)
+        self._vectors_path = self.directory / "vectors.bin"
+        self._keys_path = self.directory / "keys.bin"
+        self._meta_path = self.directory / "meta.json"
+        self._lock_path = self.directory / ".lock"
+        self._lock = threading.Lock()
+        self._index: Dict[bytes, int] = {}
+        self._count = 0
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._full_logged = False
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._file_lock():
+            self._open(initial_capacity)
+
+    def __len__(self) -> int:
+        return self._count
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open(self, initial_capacity: int) -> None:
+        meta = self._read_meta()
+        compatible = (
+            meta is not None
+            and meta.get("dimension") == self.dimension
+            and meta.get("dtype") == self.dtype.name
+            and self._vectors_path.exists()
+            and self._keys_path.exists()
+        )
+        if not compatible:
+            if meta is not None:
+                logger.warning(
+                    "Archivio embedding in %s incompatibile, viene ricreato", self.directory
+                )
+            for path in (self._vectors_path, self._keys_path):
+                path.unlink(missing_ok=True)
+            self._resize_files(max(1, initial_capacity))
+            self._write_meta()
+        self._map()
+        self._sync_index(start=0)
+        logger.info(
+            "Archivio embedding %s: %s righe (%s)", self.directory, self._count, self.dtype.name
+        )
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_meta(self) -> None:
+        tmp_path = self._meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "model_name": self.model_name,
+                    "dimension": self.dimension,
+                    "dtype": self.dtype.name,
+                },
+                f,
+            )
+        os.replace(tmp_path, self._meta_path)
+
+    def _resize_files(self, capacity: int) -> None:
+        row_bytes = self.dimension * self.dtype.itemsize
+        for path, size in ((self._vectors_path, row_bytes), (self._keys_path, KEY_SIZE)):
+            with open(path, "ab") as f:
+                f.truncate(capacity * size)
+
+    def _map(self) -> None:
+        self._vectors = None
+        self._keys = None
+        capacity = os.path.getsize(self._keys_path) // KEY_SIZE
+        self._capacity = capacity
+        self._keys = np.memmap(self._keys_path, dtype=np.uint8, mode="r+", shape=(capacity, KEY_SIZE))
+        self._vectors = np.memmap(
+            self._vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dimension)
+        )
+
+    def _sync_index(self, start: int) -> None:
+        """Indicizza le righe scritte (anche da altri processi) a partire da ``start``."""
+        if os.path.getsize(self._keys_path) // KEY_SIZE != self._capacity:
+            self._map()
+        row = start
+        while row < self._capacity and self._keys[row].any():
+            self._index.setdefault(self._keys[row].tobytes(), row)
+            row += 1
+        self._count = row
+
+    def get(self, prompts: Sequence[str]) -> Tuple[np.ndarray, List[int]]:
+        """Ritorna la matrice degli embedding trovati e le posizioni dei prompt mancanti."""
+        output = np.zeros((len(prompts), self.dimension), dtype=np.float32)
+        with self._lock:
+            rows = [self._index.get(prompt_key(prompt)) for prompt in prompts]
+            hits = [(i, row) for i, row in enumerate(rows) if row is not None]
+            if hits:
+                positions, hit_rows = zip(*hits)
+                output[list(positions)] = self._vectors[list(hit_rows)]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        return output, missing
+
+    def put(self, prompts: Sequence[str], embeddings: np.ndarray) -> int:
+        """Aggiunge gli embedding dei prompt non ancora presenti; ritorna le righe scritte."""
+        if len(prompts) == 0:
+            return 0
+        with self._lock, self._file_lock():
+            self._sync_index(start=self._count)
+            new_rows = []
+            seen = set()
+            for prompt, embedding in zip(prompts, embeddings):
+                key = prompt_key(prompt)
+                if key in self._index or key in seen:
+                    continue
+                seen.add(key)
+                new_rows.append((key, embedding))
+            available = self.max_rows - self._count
+            if len(new_rows) > available:
+                if not self._full_logged:
+                    logger.warning(
+                        "Archivio embedding pieno (%s righe): nuovi embedding non salvati",
+                        self.max_rows,
+                    )
+                    self._full_logged = True
+                new_rows = new_rows[: max(0, available)]
+            if not new_rows:
+                return 0
+            needed = self._count + len(new_rows)
+            if needed > self._capacity:
+                self._vectors.flush()
+                self._keys.flush()
+                self._resize_files(min(self.max_rows, max(needed, self._capacity * 2)))
+                self._map()
+            start = self._count
+            for offset, (key, embedding) in enumerate(new_rows):
+                self._vectors[start + offset] = embedding
+            # Le chiavi vengono scritte dopo i vettori: una riga con chiave è sempre completa
+            for offset, (key, _) in enumerate(new_rows):
+                self._keys[start + offset] = np.frombuffer(key, dtype=np.uint8)
+                self._index[key] = start + offset
+            self._count = needed
+            return len(new_rows)
+
+    def flush(self) -> None:
+        """Forza la scrittura su disco delle pagine modificate."""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._keys.flush()
+
+
+def encode_with_store(
+    embedding_model: Any,
+    prompts: Sequence[str],
+    store: Optional[EmbeddingStore],
+    batch_size: int,
+    normalize: bool,
+) -> Tuple[np.ndarray, int]:
+    """Encoda solo i prompt assenti dall'archivio; ritorna ``(embedding, prompt encodati)``."""
+    prompts = list(prompts)
+    if store is None:
+        embeddings = embedding_model.encode(
+            prompts,
+            batch_size=batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=normalize,
+        )
+        return np.asarray(embeddings, dtype=np.float32), len(prompts)
+
+    embeddings, missing = store.get(prompts)
+    if missing:
+        encoded = embedding_model.encode(
+            [prompts[i] for i in missing],
+            batch_size=batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=normalize,
+        )
+        embeddings[missing] = encoded
+        try:
+            store.put([prompts[i] for i in missing], encoded)
+        except OSError:
+            logger.exception("Impossibile salvare gli embedding nell'archivio")
+    return embeddings, len(missing)
+
+
+def _configured_model(config: Any, model_cache: Any) -> Any:
+    return model_cache.get_embedding_model(
+        config.EMBEDDING_MODEL,
+        device=config.EMBEDDING_DEVICE,
+        backend=config.EMBEDDING_BACKEND,
+        cache_dir=config.ONNX_CACHE_DIR,
+        threads=config.CPU_THREADS,
+    )
+
+
+def embedding_namespace(config: Any, model_cache: Any) -> str:
+    """Namespace degli embedding del modello configurato, con il backend effettivamente caricato.
+
+    Se ``EMBEDDING_BACKEND`` ONNX non è utilizzabile il modello è torch, e
+    i suoi embedding non devono finire tra quelli ONNX.
+    """
+    _configured_model(config, model_cache)
+    return store_namespace(
+        config.EMBEDDING_MODEL, model_cache.embedding_backend, config.NORMALIZE_EMBEDDINGS
+    )
+
+
+def encode_prompts(
+    prompts: Sequence[str], config: Any, model_cache: Any, use_store: bool = True
+) -> Tuple[np.ndarray, int]:
+    """Embedding dei prompt secondo la configurazione, consultando l'archivio se attivo.
+
+    Con ``use_store`` False il modello di embedding viene sempre eseguito.
+    """
+    embedding_model = _configured_model(config, model_cache)
+    store = None
+    if use_store and config.EMBEDDING_STORE_ENABLED:
+        store = model_cache.get_embedding_store(
+            config.EMBEDDING_STORE_DIR / embedding_namespace(config, model_cache),
+            config.EMBEDDING_MODEL,
+            embedding_model.get_sentence_embedding_dimension(),
+            dtype=config.EMBEDDING_STORE_DTYPE,
+            max_rows=config.EMBEDDING_STORE_MAX_ROWS,
+        )
+    return encode_with_store(
+        embedding_model,
+        prompts,
+        store,
+        batch_size=config.EMBEDDING_BATCH_SIZE,
+        normalize=config.NORMALIZE_EMBEDDINGS,
+    )
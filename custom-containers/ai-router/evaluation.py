@@ -0,0 +1,163 @@
+"""Valutazione del classificatore su una quota di esempi esclusi dall'addestramento.
+
+Il report prodotto in ``train_model`` contiene accuratezza e macro-F1,
+precisione/richiamo per modello, matrice di confusione, calibrazione della
+confidenza (diagramma di affidabilità, ECE, Brier), copertura e accuratezza
+per soglia di confidenza e latenza di predizione misurata sul holdout. Viene
+salvato come ``evaluation.json`` nella directory dell'artefatto ed esposto
+da ``GET /report``.
+"""
+import logging
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from classifiers import PREDICT_BATCH_SIZE, measure_latency
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_BINS = 10
+THRESHOLDS = (0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+
+
+class _Pipeline:
+    """Proiezione (se presente) e classificatore, come nel percorso di predizione."""
+
+    def __init__(self, engine: Any, projection: Optional[Any] = None) -> None:
+        self.engine = engine
+        self.projection = projection
+
+    def predict(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.projection is not None:
+            X = self.projection.transform(X)
+        return self.engine.predict(X)
+
+
+def holdout_split(
+    y: np.ndarray, fraction: float, seed: int = 42
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Indici ``(train, holdout)`` stratificati; i modelli con un solo esempio restano nel train."""
+    if fraction <= 0:
+        return None
+    from sklearn.model_selection import train_test_split
+
+    counts = np.bincount(y)
+    eligible = np.flatnonzero(counts[y] >= 2)
+    n_classes = len(np.unique(y[eligible]))
+    n_holdout = int(round(len(eligible) * fraction))
+    if n_classes < 2 or n_holdout < n_classes or len(eligible) - n_holdout < n_classes:
+        logger.warning("Esempi insufficienti per un holdout stratificato: valutazione saltata")
+        return None
+    train_idx, holdout_idx = train_test_split(
+        eligible, test_size=n_holdout, stratify=y[eligible], random_state=seed
+    )
+    single = np.flatnonzero(counts[y] < 2)
+    return np.sort(np.concatenate([train_idx, single])), np.sort(holdout_idx)
+
+
+def calibration(
+    confidence: np.ndarray, correct: np.ndarray, bins: int = CALIBRATION_BINS
+) -> Dict[str, Any]:
+    """Diagramma di affidabilità ed errore di calibrazione atteso (ECE)."""
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    which = np.clip(np.digitize(confidence, edges[1:-1]), 0, bins - 1)
+    reliability = []
+    ece = 0.0
+    for b in range(bins):
+        mask = which == b
+        count = int(mask.sum())
+        if not count:
+            continue
+        mean_confidence = float(confidence[mask].mean())
+        accuracy = float(correct[mask].mean())
+        ece += count / len(confidence) * abs(mean_confidence - accuracy)
+        reliability.append(
+            {
+                "bin": [round(float(edges[b]), 2), round(float(edges[b + 1]), 2)],
+                "count": count,
+                "mean_confidence": round(mean_confidence, 4),
+                "accuracy": round(accuracy, 4),
+            }
+        )
+    return {"ece": round(ece, 5), "reliability": reliability}
+
+
+def threshold_table(
+    confidence: np.ndarray, correct: np.ndarray, thresholds: Sequence[float] = THRESHOLDS
+) -> list:
+    """Per ogni soglia: quota di predizioni sopra soglia e loro accuratezza."""
+    table = []
+    for threshold in thresholds:
+        mask = confidence >= threshold
+        table.append(
+            {
+                "threshold": threshold,
+                "coverage": round(float(mask.mean()), 4),
+                "accuracy": round(float(correct[mask].mean()), 4) if mask.any() else None,
+            }
+        )
+    return table
+
+
+def evaluate_holdout(
+    engine: Any,
+    X_holdout: np.ndarray,
+    y_holdout: np.ndarray,
+    classes: Sequence[str],
+    projection: Optional[Any] = None,
+) -> Dict[str, Any]:
+    """Report di qualità e latenza sugli embedding (non proiettati) del holdout."""
+    from sklearn.metrics import confusion_matrix, precision_recall_fscore_support
+
+    pipeline = _Pipeline(engine, projection)
+    X_holdout = np.ascontiguousarray(X_holdout, dtype=np.float32)
+    n = len(y_holdout)
+    predicted = np.empty(n, dtype=np.int64)
+    confidence = np.empty(n, dtype=np.float32)
+    batch_seconds = 0.0
+    squared_error = 0.0
+    for i in range(0, n, PREDICT_BATCH_SIZE):
+        batch = slice(i, i + PREDICT_BATCH_SIZE)
+        start = time.perf_counter()
+        best, probabilities = pipeline.predict(X_holdout[batch])
+        batch_seconds += time.perf_counter() - start
+        predicted[batch] = best
+        confidence[batch] = probabilities.max(axis=1)
+        # Brier multiclasse: distanza quadratica dal vettore one-hot della classe vera
+        probabilities[np.arange(len(best)), y_holdout[batch]] -= 1.0
+        squared_error += float(np.square(probabilities).sum())
+    correct = predicted == y_holdout
+    labels = np.arange(len(classes))
+    precision, recall, f1, support = precision_recall_fscore_support(
+        y_holdout, predicted, labels=labels, zero_division=0
+    )
+    return {
+        "n_holdout": n,
+        "accuracy": round(float(correct.mean()), 5),
+        "f1_macro": round(float(f1[support > 0].mean()), 5) if (support > 0).any() else 0.0,
+        "per_class": {
+            str(cls): {
+                "precision": round(float(precision[i]), 4),
+                "recall": round(float(recall[i]), 4),
+                "f1": round(float(f1[i]), 4),
+                "support": int(support[i]),
+            }
+            for i, cls in enumerate(classes)
+        },
+        "confusion_matrix": {
+            "labels": [str(cls) for cls in classes],
+            "matrix": confusion_matrix(y_holdout, predicted, labels=labels).tolist(),
+        },
+        "calibration": {
+            **calibration(confidence, correct),
+            "brier": round(squared_error / n, 5),
+            "mean_confidence": round(float(confidence.mean()), 4),
+        },
+        "thresholds": threshold_table(confidence, correct),
+        "latency": {
+            "batch_total_ms": round(batch_seconds * 1000, 3),
+            "batch_per_example_us": round(batch_seconds * 1e6 / n, 2),
+            **measure_latency(pipeline, X_holdout),
+        },
+    }
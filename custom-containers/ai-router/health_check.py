@@ -1,6 +1,12 @@
 #!/usr/bin/env python
-"""Health check per il servizio AI Router (Gradio + Ollama)."""
+"""Health check per il servizio AI Router (Gradio o API REST + Ollama).
+
+Con l'API attiva lo stato di Ollama è quello già rilevato dal monitor del
+servizio (``/healthz``); con la sola interfaccia Gradio Ollama viene
+interrogato direttamente.
+"""
 import sys
+from typing import Optional, Tuple
 
 from config import Config
 from ollama_service import check_ollama_health
@@ -16,9 +22,31 @@ def check_gradio_health(config: Config) -> bool:
         return False
 
 
+def check_api_health(host: str, port: int) -> Tuple[bool, Optional[bool]]:
+    """``(API pronta, Ollama disponibile secondo il servizio)``."""
+    try:
+        import requests
+        host = "127.0.0.1" if host == "0.0.0.0" else host
+        r = requests.get(f"http://{host}:{port}/healthz", timeout=5)
+        if r.status_code != 200:
+            return False, None
+        return True, r.json().get("ollama", {}).get("available")
+    except Exception:
+        return False, None
+
+
 if __name__ == "__main__":
     conf = Config()
-    gradio_ok = check_gradio_health(conf)
-    print(f"Gradio: {'✓' if gradio_ok else '✗'}")
-    print(f"Ollama: {'✓' if check_ollama_health(conf) else '✗'}")
+    ollama_ok: Optional[bool] = None
+    if conf.SERVE_MODE == "api":
+        gradio_ok, ollama_ok = check_api_health(conf.API_HOST, conf.API_PORT)
+        print(f"API: {'✓' if gradio_ok else '✗'}")
+    else:
+        gradio_ok = check_gradio_health(conf)
+        print(f"Gradio: {'✓' if gradio_ok else '✗'}")
+        if conf.SERVE_MODE == "both":
+            _, ollama_ok = check_api_health(conf.GRADIO_SERVER_NAME, conf.GRADIO_SERVER_PORT)
+    if ollama_ok is None:
+        ollama_ok = check_ollama_health(conf)
+    print(f"Ollama: {'✓' if ollama_ok else '✗'}")
     sys.exit(0 if gradio_ok else 1)
@@ -0,0 +1,183 @@
+"""Motore di inferenza NumPy per il classificatore MLP del Router AI."""
+import logging
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PARITY_TOLERANCE = 1e-4
+
+
+def _relu(x: np.ndarray) -> None:
+    np.maximum(x, 0, out=x)
+
+
+def _tanh(x: np.ndarray) -> None:
+    np.tanh(x, out=x)
+
+
+def _logistic(x: np.ndarray) -> None:
+    np.clip(x, -60.0, 60.0, out=x)
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1.0
+    np.reciprocal(x, out=x)
+
+
+def _identity(x: np.ndarray) -> None:
+    return None
+
+
+def softmax_(x: np.ndarray) -> np.ndarray:
+    """Softmax per riga, calcolata sul posto."""
+    x -= x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+ACTIVATIONS = {
+    "relu": _relu,
+    "tanh": _tanh,
+    "logistic": _logistic,
+    "identity": _identity,
+}
+
+
+class MLPInferenceEngine:
+    """Forward pass float32 di un MLP addestrato: probabilità e argmax in un solo passaggio.
+
+    I pesi vengono estratti una sola volta e mantenuti come array contigui,
+    evitando la validazione di sklearn e il doppio forward pass di
+    ``predict`` + ``predict_proba``.
+    """
+
+    backend = "mlp"
+
+    def __init__(
+        self,
+        coefs: Sequence[np.ndarray],
+        intercepts: Sequence[np.ndarray],
+        activation: str = "relu",
+        out_activation: str = "softmax",
+    ) -> None:
+        if len(coefs) != len(intercepts) or not coefs:
+            raise ValueError("Pesi e bias del MLP non coerenti")
+        if activation not in ACTIVATIONS:
+            raise ValueError(f"Attivazione non supportata: {activation}")
+        if out_activation not in ("softmax", "logistic"):
+            raise ValueError(f"Attivazione di output non supportata: {out_activation}")
+        self.coefs: List[np.ndarray] = [
+            np.ascontiguousarray(c, dtype=np.float32) for c in coefs
+        ]
+        self.intercepts: List[np.ndarray] = [
+            np.ascontiguousarray(b, dtype=np.float32) for b in intercepts
+        ]
+        self.activation = activation
+        self.out_activation = out_activation
+        self._hidden_fn = ACTIVATIONS[activation]
+
+    @classmethod
+    def from_sklearn(cls, classifier: Any) -> "MLPInferenceEngine":
+        """Costruisce il motore a partire da un ``MLPClassifier`` addestrato."""
+        return cls(
+            classifier.coefs_,
+            classifier.intercepts_,
+            activation=classifier.activation,
+            out_activation=classifier.out_activation_,
+        )
+
+    @classmethod
+    def from_arrays(
+        cls, arrays: Mapping[str, np.ndarray], params: Mapping[str, Any]
+    ) -> "MLPInferenceEngine":
+        """Ricostruisce il motore dagli array salvati in un artefatto."""
+        n_layers = len(params["layers"])
+        return cls(
+            [arrays[f"coef_{i}"] for i in range(n_layers)],
+            [arrays[f"intercept_{i}"] for i in range(n_layers)],
+            activation=params["activation"],
+            out_activation=params["out_activation"],
+        )
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {}
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            arrays[f"coef_{i}"] = coef
+            arrays[f"intercept_{i}"] = intercept
+        return arrays
+
+    def params(self) -> Dict[str, Any]:
+        return {
+            "activation": self.activation,
+            "out_activation": self.out_activation,
+            "layers": [list(coef.shape) for coef in self.coefs],
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
+
+    @property
+    def input_dim(self) -> int:
+        return self.coefs[0].shape[0]
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Probabilità per classe (una riga per esempio)."""
+        h = np.asarray(X, dtype=np.float32)
+        if h.ndim == 1:
+            h = h.reshape(1, -1)
+        last = len(self.coefs) - 1
+        for i, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            h = h @ coef
+            h += intercept
+            if i < last:
+                self._hidden_fn(h)
+
+        if self.out_activation == "logistic":
+            # Caso binario: sklearn produce una sola colonna per la classe positiva
+            _logistic(h)
+            return np.hstack([1.0 - h, h])
+        return softmax_(h)
+
+    def predict(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Ritorna ``(indici delle classi predette, probabilità)`` con un solo forward pass."""
+        probabilities = self.predict_proba(X)
+        return probabilities.argmax(axis=1), probabilities
+
+
+def check_parity(
+    engine: MLPInferenceEngine,
+    classifier: Any,
+    X: np.ndarray,
+    atol: float = PARITY_TOLERANCE,
+) -> Tuple[bool, float]:
+    """Confronta le probabilità del motore con quelle di sklearn sugli stessi input."""
+    expected = classifier.predict_proba(X)
+    actual = engine.predict_proba(X)
+    max_diff = float(np.abs(expected - actual).max()) if len(expected) else 0.0
+    return max_diff <= atol, max_diff
+
+
+def build_inference_engine(classifier: Any, probe_size: int = 8) -> MLPInferenceEngine | None:
+    """Crea il motore NumPy se il classificatore è un MLP e supera il controllo di parità."""
+    if classifier is None or not hasattr(classifier, "coefs_"):
+        return None
+    try:
+        engine = MLPInferenceEngine.from_sklearn(classifier)
+        probe = np.random.default_rng(0).standard_normal(
+            (probe_size, engine.input_dim)
+        ).astype(np.float32)
+        probe /= np.linalg.norm(probe, axis=1, keepdims=True)
+        ok, max_diff = check_parity(engine, classifier, probe)
+    except Exception:
+        logger.exception("Impossibile costruire il motore di inferenza NumPy")
+        return None
+    if not ok:
+        logger.warning(
+            "Motore NumPy non allineato a sklearn (diff max %.2e): uso sklearn", max_diff
+        )
+        return None
+    logger.info("Motore di inferenza NumPy pronto (diff max vs sklearn %.2e)", max_diff)
+    return engine
@@ -1,12 +1,110 @@
 """Raccolta metriche e timer per il sistema AI Router."""
 import logging
+import math
 import time
+from bisect import bisect_left
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Dict
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Limiti superiori (secondi) dei bucket di latenza, da 0.5ms a 60s
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf,
+)
+WINDOW_MINUTES: Tuple[int, ...] = (1, 5, 15)
+QUANTILES: Tuple[float, ...] = (0.5, 0.95, 0.99)
+# Statistiche delle cache registrate che crescono sempre: contatori Prometheus
+CACHE_COUNTERS = frozenset(
+    ("hits", "misses", "memory_hits", "disk_hits", "evictions", "expirations", "invalidations")
+)
+
+
+class LatencyHistogram:
+    """Istogramma di latenza a bucket fissi con finestre mobili di 1/5/15 minuti.
+
+    Oltre ai contatori cumulativi mantiene un anello di slot da un minuto,
+    così i percentili delle finestre si calcolano sommando gli ultimi slot.
+    Non è thread-safe: la sincronizzazione è a carico di MetricsCollector.
+    """
+
+    def __init__(
+        self,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.buckets = tuple(buckets)
+        self._clock = clock
+        self.counts: List[int] = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._slot_count = max(WINDOW_MINUTES)
+        self._slots: List[List[int]] = [[0] * len(self.buckets) for _ in range(self._slot_count)]
+        self._slot_minutes: List[int] = [-1] * self._slot_count
+
+    def _minute(self) -> int:
+        return int(self._clock() // 60)
+
+    def observe(self, seconds: float) -> None:
+        index = min(bisect_left(self.buckets, seconds), len(self.buckets) - 1)
+        minute = self._minute()
+        slot = minute % self._slot_count
+        if self._slot_minutes[slot] != minute:
+            self._slots[slot] = [0] * len(self.buckets)
+            self._slot_minutes[slot] = minute
+        self._slots[slot][index] += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def window_counts(self, minutes: int) -> List[int]:
+        """Conteggi per bucket negli ultimi ``minutes`` minuti."""
+        now = self._minute()
+        totals = [0] * len(self.buckets)
+        for slot, minute in enumerate(self._slot_minutes):
+            if minute >= 0 and now - minute < minutes:
+                for i, value in enumerate(self._slots[slot]):
+                    totals[i] += value
+        return totals
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> float:
+        """Stima del quantile ``q`` per interpolazione lineare all'interno del bucket."""
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for i, value in enumerate(counts):
+            if value and cumulative + value >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i]
+                if math.isinf(upper):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / value
+            cumulative += value
+        return self.buckets[-2]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Conteggio, media e percentili (ms) complessivi e per finestra."""
+        windows = {}
+        for minutes in WINDOW_MINUTES:
+            counts = self.window_counts(minutes)
+            windows[f"{minutes}m"] = {
+                "count": sum(counts),
+                **{f"p{int(q * 100)}_ms": round(self.quantile(q, counts) * 1000, 3) for q in QUANTILES},
+            }
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            **{f"p{int(q * 100)}_ms": round(self.quantile(q) * 1000, 3) for q in QUANTILES},
+            "windows": windows,
+        }
+
 
 @dataclass
 class PredictionMetrics:
@@ -15,6 +113,8 @@ class PredictionMetrics:
     total_predictions: int = 0
     cache_hits: int = 0
     cache_misses: int = 0
+    exact_cache_hits: int = 0
+    normalized_cache_hits: int = 0
     avg_inference_time: float = 0.0
     total_inference_time: float = 0.0
     errors: int = 0
@@ -33,6 +133,8 @@ class PredictionMetrics:
             "cache_hits": self.cache_hits,
             "cache_misses": self.cache_misses,
             "cache_hit_rate": f"{self.cache_hit_rate:.1f}%",
+            "exact_cache_hits": self.exact_cache_hits,
+            "normalized_cache_hits": self.normalized_cache_hits,
             "avg_inference_time_ms": f"{self.avg_inference_time * 1000:.2f}",
             "errors": self.errors,
             "low_confidence_predictions": self.low_confidence_predictions,
@@ -45,6 +147,35 @@ class MetricsCollector:
 
     def __init__(self) -> None:
         self.predictions = PredictionMetrics()
+        self._lock = Lock()
+        self._cache_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._gauge_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self.stages: Dict[str, LatencyHistogram] = {}
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        """Registra la durata di una fase (validation, cache_lookup, encode, classify, ollama...)."""
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        """Misura con perf_counter la durata del blocco e la registra nella fase indicata."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - start)
+
+    def register_cache(self, name: str, stats_fn: Callable[[], Dict[str, Any]]) -> None:
+        """Registra una cache le cui statistiche vengono incluse nelle metriche."""
+        self._cache_sources[name] = stats_fn
+
+    def register_gauges(self, name: str, stats_fn: Callable[[], Dict[str, Any]]) -> None:
+        """Registra un componente i cui valori istantanei (code, slot) sono esportati come gauge."""
+        self._gauge_sources[name] = stats_fn
 
     def record_prediction(
         self,
@@ -53,12 +184,31 @@ class MetricsCollector:
         had_error: bool = False,
         confidence: float = 0.0,
         threshold: float = 0.5,
+        cache_tier: Optional[str] = None,
+    ) -> None:
+        """Registra una predizione (cache_tier: "exact" o "normalized")."""
+        with self._lock:
+            self._record_prediction(
+                inference_time, is_cache_hit, had_error, confidence, threshold, cache_tier
+            )
+
+    def _record_prediction(
+        self,
+        inference_time: float,
+        is_cache_hit: bool,
+        had_error: bool,
+        confidence: float,
+        threshold: float,
+        cache_tier: Optional[str],
     ) -> None:
-        """Registra una predizione."""
         self.predictions.total_predictions += 1
 
         if is_cache_hit:
             self.predictions.cache_hits += 1
+            if cache_tier == "normalized":
+                self.predictions.normalized_cache_hits += 1
+            else:
+                self.predictions.exact_cache_hits += 1
         else:
             self.predictions.cache_misses += 1
             self.predictions.total_inference_time += inference_time
@@ -76,7 +226,82 @@ class MetricsCollector:
 
     def get_metrics(self) -> Dict[str, Any]:
         """Ritorna tutte le metriche come dizionario."""
-        return self.predictions.to_dict()
+        with self._lock:
+            metrics = self.predictions.to_dict()
+            metrics["latency"] = {
+                stage: histogram.snapshot() for stage, histogram in self.stages.items()
+            }
+        if self._cache_sources:
+            metrics["caches"] = {name: fn() for name, fn in self._cache_sources.items()}
+        for name, fn in self._gauge_sources.items():
+            metrics[name] = fn()
+        return metrics
+
+    def to_prometheus(self, prefix: str = "ai_router") -> str:
+        """Esporta contatori e istogrammi di latenza nel formato testuale di Prometheus.
+
+        Le cache registrate compaiono come ``<prefix>_<cache>_cache_<statistica>``:
+        hit, miss ed evizioni come contatori (``_total``), occupazione come gauge.
+        """
+        lines: List[str] = []
+        with self._lock:
+            p = self.predictions
+            counters = (
+                ("predictions_total", "Predizioni totali", p.total_predictions),
+                ("cache_hits_total", "Predizioni servite dalla cache", p.cache_hits),
+                ("cache_misses_total", "Predizioni calcolate", p.cache_misses),
+                ("prediction_errors_total", "Errori di predizione", p.errors),
+                ("low_confidence_predictions_total", "Predizioni sotto soglia", p.low_confidence_predictions),
+            )
+            for name, help_text, value in counters:
+                lines += [
+                    f"# HELP {prefix}_{name} {help_text}",
+                    f"# TYPE {prefix}_{name} counter",
+                    f"{prefix}_{name} {value}",
+                ]
+
+            name = f"{prefix}_stage_latency_seconds"
+            lines += [
+                f"# HELP {name} Latenza per fase",
+                f"# TYPE {name} histogram",
+            ]
+            windows: List[str] = []
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for upper, value in zip(histogram.buckets, histogram.counts):
+                    cumulative += value
+                    le = "+Inf" if math.isinf(upper) else repr(upper)
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+                for minutes in WINDOW_MINUTES:
+                    counts = histogram.window_counts(minutes)
+                    for q in QUANTILES:
+                        windows.append(
+                            f'{prefix}_stage_latency_window_seconds{{stage="{stage}",'
+                            f'window="{minutes}m",quantile="{q}"}} '
+                            f"{histogram.quantile(q, counts):.6f}"
+                        )
+            if windows:
+                lines += [
+                    f"# HELP {prefix}_stage_latency_window_seconds Percentili per finestra mobile",
+                    f"# TYPE {prefix}_stage_latency_window_seconds gauge",
+                    *windows,
+                ]
+        for cache, fn in self._cache_sources.items():
+            for key, value in fn().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"{prefix}_{cache}_cache_{key}"
+                    if key in CACHE_COUNTERS:
+                        lines += [f"# TYPE {name}_total counter", f"{name}_total {value}"]
+                    else:
+                        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        for source, fn in self._gauge_sources.items():
+            for key, value in fn().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"{prefix}_{source}_{key}"
+                    lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
 
     def log_metrics(self) -> None:
         """Scrive le metriche nei log."""
@@ -85,11 +310,13 @@ class MetricsCollector:
 
     def reset(self) -> None:
         """Resetta tutte le metriche."""
-        self.predictions = PredictionMetrics()
+        with self._lock:
+            self.predictions = PredictionMetrics()
+            self.stages = {}
 
 
 class Timer:
-    """Context manager per misurare il tempo di esecuzione."""
+    """Context manager per misurare il tempo di esecuzione (orologio monotono ad alta risoluzione)."""
 
     def __init__(self, name: str = "") -> None:
         self.name = name
@@ -97,13 +324,13 @@ class Timer:
         self.elapsed: float = 0.0
 
     def __enter__(self) -> "Timer":
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
         return self
 
     def __exit__(self, *args: Any) -> None:
         if self.start_time is None:
             return
-        self.elapsed = time.time() - self.start_time
+        self.elapsed = time.perf_counter() - self.start_time
         if self.name:
             logger.debug("%s completato in %.2fms", self.name, self.elapsed * 1000)
 
@@ -0,0 +1,380 @@
+"""Stato di salute di Ollama: controllo periodico in background e circuit breaker.
+
+Il monitor interroga ``/api/tags`` ogni ``OLLAMA_HEALTH_INTERVAL`` secondi e
+conserva disponibilità e modelli installati: interfaccia, API e health check
+leggono questo stato invece di fare una chiamata bloccante.
+
+Il circuit breaker decide se tentare una generazione:
+- ``closed``: richieste normali; dopo ``OLLAMA_BREAKER_THRESHOLD`` errori di
+  connessione, timeout o 5xx consecutivi passa a ``open``
+- ``open``: le richieste falliscono subito, senza attendere il timeout; dopo
+  ``OLLAMA_BREAKER_RESET`` secondi passa a ``half_open``
+- ``half_open``: passa una sola richiesta di prova; se riesce il circuito si
+  chiude, altrimenti si riapre
+
+Un controllo del monitor fallito conta come un errore di generazione; uno
+riuscito porta al più un circuito aperto in ``half_open``: solo una
+generazione riuscita lo richiude, perché ``/api/tags`` può rispondere
+subito anche quando le generazioni vanno in timeout per sovraccarico.
+
+``ModelResidency`` tiene il modello caricato in memoria da Ollama nelle ore
+di attività, così la prima ottimizzazione dopo una pausa non paga il
+caricamento.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker a tre stati per le chiamate verso Ollama."""
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started: Optional[float] = None
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(self._clock())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._trial_started = None
+        return self._state
+
+    def retry_after(self) -> float:
+        """Secondi mancanti al prossimo tentativo consentito (0 se il circuito non è aperto)."""
+        with self._lock:
+            if self._current_state(self._clock()) != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def allow(self) -> bool:
+        """True se la richiesta può partire; in half_open ne passa una alla volta."""
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True
+            # Una prova senza esito (es. rifiutata dalla coda) non blocca il circuito per sempre
+            if state == HALF_OPEN and (
+                self._trial_started is None or now - self._trial_started >= self.reset_timeout
+            ):
+                self._trial_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Ollama di nuovo raggiungibile: circuito chiuso")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = self._clock()
+            self._failures += 1
+            state = self._current_state(now)
+            if state == HALF_OPEN or (state == CLOSED and self._failures >= self.failure_threshold):
+                self._open(now)
+
+    def record_probe_success(self) -> None:
+        """Controllo di salute riuscito: un circuito aperto passa subito a ``half_open``."""
+        with self._lock:
+            if self._current_state(self._clock()) == OPEN:
+                self._state = HALF_OPEN
+                self._trial_started = None
+
+    def _open(self, now: float) -> None:
+        if self._state == CLOSED:
+            self.opened += 1
+            logger.warning("Ollama non disponibile: circuito aperto")
+        self._state = OPEN
+        self._opened_at = now
+        self._trial_started = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self._current_state(self._clock())
+            return {
+                "state": state,
+                "open": int(state == OPEN),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class OllamaHealthMonitor:
+    """Controllo periodico di ``/api/tags`` con lo stato più recente sempre disponibile.
+
+    ``client`` è l'``OllamaClient`` condiviso (serve solo ``get``); l'esito
+    di ogni controllo aggiorna ``breaker``.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model: str,
+        interval: float = 15.0,
+        breaker: Optional[CircuitBreaker] = None,
+        timeout: float = 5.0,
+    ) -> None:
+        self.client = client
+        self.model = model
+        self.interval = interval
+        self.breaker = breaker
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.available: Optional[bool] = None
+        self.models: List[str] = []
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.latency: Optional[float] = None
+
+    @property
+    def model_installed(self) -> bool:
+        return self.model in self.models
+
+    def check(self) -> bool:
+        """Interroga Ollama una volta, aggiorna lo stato e il circuit breaker."""
+        start = time.perf_counter()
+        models: List[str] = []
+        error: Optional[str] = None
+        try:
+            response = self.client.get("/api/tags", timeout=self.timeout)
+            available = response.status_code == 200
+            if available:
+                models = [m.get("name", "") for m in response.json().get("models", [])]
+            else:
+                error = f"HTTP {response.status_code}"
+        except Exception as e:
+            available = False
+            error = type(e).__name__
+        latency = time.perf_counter() - start
+        with self._lock:
+            was_available, was_installed = self.available, self.model_installed
+            self.available, self.models, self.error = available, models, error
+            self.checked_at, self.latency = time.time(), latency
+        if self.breaker is not None:
+            if available:
+                self.breaker.record_probe_success()
+            else:
+                self.breaker.record_failure()
+        # Log solo ai cambi di stato: il controllo gira ogni pochi secondi
+        if available != was_available:
+            if available:
+                logger.info("Ollama disponibile su %s", self.client.base_url)
+            else:
+                logger.warning("Ollama non raggiungibile su %s (%s)", self.client.base_url, error)
+        if available and (was_available is not True or was_installed != self.model_installed):
+            if self.model_installed:
+                logger.info("Modello %s è installato", self.model)
+            else:
+                logger.warning(
+                    "Modello %s non trovato. Esegui: ollama pull %s", self.model, self.model
+                )
+        return available
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Ultimo stato noto, senza chiamate di rete."""
+        with self._lock:
+            state = {
+                "available": self.available,
+                "model": self.model,
+                "model_installed": self.model_installed,
+                "models": list(self.models),
+                "error": self.error,
+                "checked_at": self.checked_at,
+                "check_latency_ms": (
+                    round(self.latency * 1000, 1) if self.latency is not None else None
+                ),
+            }
+        if self.breaker is not None:
+            state["circuit"] = self.breaker.stats()["state"]
+        return state
+
+    def start(self) -> None:
+        """Avvia il controllo periodico in un thread daemon (idempotente)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._watch, name="ollama-health", daemon=True)
+        self._thread.start()
+        logger.info("Controllo di Ollama ogni %.0fs", self.interval)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Errore nel controllo di Ollama")
+
+
+class ModelResidency:
+    """Precaricamento del modello e rinnovo del suo ``keep_alive`` in Ollama.
+
+    ``load(warm)`` invia la richiesta di caricamento (con ``warm`` genera
+    anche un token) e ritorna i secondi di caricamento, o None se fallisce.
+    All'avvio il modello viene precaricato, riprovando a ogni giro finché
+    non riesce; poi, nelle ``hours`` [inizio, fine) dei giorni ``days``
+    (0 = lunedì), ogni ``interval`` secondi senza generazioni il caricamento
+    viene ripetuto per rinnovare il ``keep_alive``. Fuori orario il modello
+    scade normalmente e Ollama libera la memoria. Con ``busy()`` vero (una
+    generazione in corso) precaricamento e rinnovo vengono rimandati: la
+    generazione stessa tiene il modello in memoria.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[bool], Optional[float]],
+        interval: float = 300.0,
+        hours: Tuple[int, int] = (8, 20),
+        days: Sequence[int] = (0, 1, 2, 3, 4),
+        breaker: Optional[CircuitBreaker] = None,
+        busy: Optional[Callable[[], bool]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.load = load
+        self.busy = busy
+        self.interval = interval
+        self.hours = tuple(hours)
+        self.days = frozenset(days)
+        self.breaker = breaker
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_used: Optional[float] = None
+        self._preload_pending = False
+        self.preloads = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_load: Optional[float] = None
+
+    def touch(self) -> None:
+        """Segna una generazione riuscita: ha già rinnovato il ``keep_alive``."""
+        with self._lock:
+            self._last_used = self._clock()
+
+    def in_active_hours(self, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.now()
+        return now.weekday() in self.days and self.hours[0] <= now.hour < self.hours[1]
+
+    def _is_busy(self) -> bool:
+        if self.busy is None or not self.busy():
+            return False
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def _load(self, warm: bool) -> bool:
+        load_seconds = self.load(warm)
+        with self._lock:
+            if load_seconds is None:
+                self.failures += 1
+                return False
+            self.last_load = load_seconds
+            self._last_used = self._clock()
+        return True
+
+    def preload(self) -> bool:
+        """Carica il modello con una generazione di prova; False se Ollama non risponde."""
+        if self._is_busy():
+            # Resta in sospeso: si riprova al giro successivo
+            return False
+        loaded = self._load(warm=True)
+        with self._lock:
+            self._preload_pending = not loaded
+            if loaded:
+                self.preloads += 1
+        return loaded
+
+    def refresh(self, now: Optional[datetime] = None) -> bool:
+        """Rinnova il ``keep_alive`` se in orario e senza generazioni da ``interval`` secondi."""
+        if not self.in_active_hours(now):
+            return False
+        if self.breaker is not None and self.breaker.state != CLOSED:
+            return False
+        with self._lock:
+            idle = self._last_used is None or self._clock() - self._last_used >= self.interval
+        if not idle or self._is_busy():
+            return False
+        refreshed = self._load(warm=False)
+        if refreshed:
+            with self._lock:
+                self.refreshes += 1
+        return refreshed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "preloads": self.preloads,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "skipped": self.skipped,
+                "last_load_seconds": self.last_load,
+                "active_hours": int(self.in_active_hours()),
+            }
+
+    def start(self, preload: bool = True) -> None:
+        """Avvia precaricamento e rinnovo in un thread daemon (idempotente)."""
+        if self._thread is not None or not (preload or self.interval > 0):
+            return
+        self._preload_pending = preload
+        self._thread = threading.Thread(target=self._run, name="ollama-residency", daemon=True)
+        self._thread.start()
+        if self.interval > 0:
+            logger.info(
+                "Modello mantenuto in memoria dalle %d alle %d, rinnovo ogni %.0fs",
+                self.hours[0], self.hours[1], self.interval,
+            )
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        wait = 0.0
+        while not self._stop.wait(wait):
+            try:
+                if self._preload_pending:
+                    self.preload()
+                elif self.interval > 0:
+                    self.refresh()
+                else:
+                    return
+            except Exception:
+                logger.exception("Errore nel mantenimento del modello Ollama")
+            # Finché il precaricamento non riesce si riprova più spesso
+            wait = min(15.0, self.interval or 15.0) if self._preload_pending else self.interval
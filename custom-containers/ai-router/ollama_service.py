@@ -1,22 +1,39 @@
 """Servizio Ollama per miglioramento prompt e validazione."""
+import json
 import logging
 import re
+import threading
 import time
-from typing import Any, Dict, Optional
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from cache import normalize_prompt
 from config import Config
+from ollama_health import CircuitBreaker, ModelResidency, OllamaHealthMonitor
+from optimization_cache import OptimizationCache, optimization_key
 
 logger = logging.getLogger(__name__)
 
-PREFIX_PATTERNS = (
-    r"^\s*ecco il prompt migliorato:\s*",
-    r"^\s*prompt migliorato:\s*",
-    r"^\s*ecco:\s*",
-    r"^\s*here is the improved prompt:\s*",
-    r"^\s*improved prompt:\s*",
+# Iniettato al bootstrap (router_main / api.py) per le metriche di latenza
+metrics_collector = None
+
+PREFIX_PHRASES = (
+    "ecco il prompt migliorato:",
+    "prompt migliorato:",
+    "ecco:",
+    "here is the improved prompt:",
+    "improved prompt:",
 )
+PREFIX_PATTERNS = tuple(rf"^\s*{re.escape(phrase)}\s*" for phrase in PREFIX_PHRASES)
+
+# load_duration oltre questa soglia (secondi): il modello non era in memoria
+COLD_LOAD_THRESHOLD = 0.5
+# Chiave dello scheduler per precaricamento e rinnovo del keep_alive
+PRELOAD_KEY = "__preload__"
 
 
 def validate_prompt(prompt: str) -> tuple[bool, str]:
@@ -79,10 +96,372 @@ def _cleanup_improved_prompt(text: str) -> str:
     return cleaned.strip()
 
 
+def _cleanup_partial_prompt(text: str) -> str:
+    """Pulizia di un testo ancora in generazione, da mostrare durante lo streaming.
+
+    Rimuove solo ciò che rimuoverebbe anche ``_cleanup_improved_prompt`` e
+    trattiene il testo finché potrebbe essere l'inizio di un prefisso o della
+    riga di apertura di un blocco di codice, così nulla di ciò che compare a
+    schermo sparisce all'arrivo dei token successivi.
+    """
+    cleaned = (text or "").lstrip()
+    for pattern in PREFIX_PATTERNS:
+        cleaned = re.sub(pattern, "", cleaned, flags=re.IGNORECASE)
+    lowered = cleaned.lower()
+    if any(phrase.startswith(lowered) for phrase in PREFIX_PHRASES):
+        return ""
+    cleaned = cleaned.lstrip("\"' \t\n")
+    if cleaned.startswith("```"):
+        if "\n" not in cleaned:
+            return ""
+        cleaned = cleaned.split("\n", 1)[1]
+    return cleaned.rstrip("\"'` \t\n")
+
+
+class OllamaBusyError(RuntimeError):
+    """Nessuno slot di generazione disponibile: coda piena o attesa troppo lunga."""
+
+
+class _Flight:
+    """Generazione in corso condivisa tra richieste identiche.
+
+    Il leader pubblica ogni elemento prodotto; gli altri li leggono tutti, dal
+    primo, e terminano con l'elemento finale.
+    """
+
+    def __init__(self) -> None:
+        self.items: List[Dict[str, Any]] = []
+        self.done = False
+        self._cond = threading.Condition()
+
+    def publish(self, item: Dict[str, Any]) -> None:
+        with self._cond:
+            self.items.append(item)
+            self._cond.notify_all()
+
+    def finish(self, item: Optional[Dict[str, Any]] = None) -> None:
+        with self._cond:
+            if self.done:
+                return
+            if item is not None:
+                self.items.append(item)
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self) -> Iterator[Dict[str, Any]]:
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.items) and not self.done:
+                    self._cond.wait()
+                items, done = self.items[index:], self.done
+            index += len(items)
+            yield from items
+            if done:
+                return
+
+
+class GenerationScheduler:
+    """Controllo di ammissione per le generazioni verso un'istanza Ollama.
+
+    Al più ``max_in_flight`` generazioni in corso; le altre attendono in una
+    coda FIFO di ``max_queue`` posti, per non più di ``queue_timeout``
+    secondi, e oltre vengono rifiutate subito. Richieste identiche
+    concorrenti (stessa chiave) condividono una sola generazione e non
+    occupano posti in coda.
+    """
+
+    def __init__(self, max_in_flight: int = 1, max_queue: int = 8, queue_timeout: float = 30.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters: Deque[threading.Event] = deque()
+        self._flights: Dict[str, _Flight] = {}
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.coalesced = 0
+        self.max_queue_depth = 0
+
+    def _acquire(self) -> None:
+        start = time.perf_counter()
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                self.admitted += 1
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise OllamaBusyError(
+                    f"Ollama occupato ({len(self._waiters)} richieste in attesa), riprovare"
+                )
+            event = threading.Event()
+            self._waiters.append(event)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        event.wait(self.queue_timeout)
+        with self._lock:
+            # Lo slot è ceduto da _release sotto lock: qui l'esito è definitivo
+            if not event.is_set():
+                self._waiters.remove(event)
+                self.timed_out += 1
+                raise OllamaBusyError(
+                    f"Ollama occupato: nessuno slot libero entro {self.queue_timeout:g} s"
+                )
+            self.admitted += 1
+        if metrics_collector:
+            metrics_collector.record_stage("ollama_queue_wait", time.perf_counter() - start)
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                # Slot passato direttamente al primo in coda: l'ordine resta FIFO
+                self._waiters.popleft().set()
+            else:
+                self._in_flight -= 1
+
+    def stream(
+        self,
+        key: str,
+        producer: Callable[[], Iterator[Dict[str, Any]]],
+        failure: Callable[[str], Dict[str, Any]],
+    ) -> Iterator[Dict[str, Any]]:
+        """Elementi di ``producer`` eseguito con uno slot, o di una generazione identica in corso.
+
+        ``failure(messaggio)`` costruisce l'elemento finale quando la
+        richiesta viene rifiutata o la generazione condivisa si interrompe.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            yield from flight.follow()
+            return
+        try:
+            try:
+                self._acquire()
+            except OllamaBusyError as e:
+                rejection = {**failure(str(e)), "busy": True}
+                flight.finish(rejection)
+                yield rejection
+                return
+            try:
+                for item in producer():
+                    flight.publish(item)
+                    yield item
+                flight.finish()
+            finally:
+                self._release()
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.finish(failure("Generazione condivisa interrotta"))
+
+    def call(
+        self,
+        key: str,
+        fn: Callable[[], Dict[str, Any]],
+        failure: Callable[[str], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Come ``stream`` per una generazione non in streaming: ritorna l'elemento finale."""
+        result: Dict[str, Any] = {}
+        for result in self.stream(key, lambda: iter([fn()]), failure):
+            pass
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters),
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "coalesced": self.coalesced,
+            }
+
+
+class OllamaClient:
+    """Sessione HTTP condivisa verso Ollama: pool di connessioni keep-alive e retry.
+
+    Ricorda inoltre se il server espone ``/api/chat``: dopo il primo 404 di
+    endpoint mancante le richieste vanno direttamente a ``/api/generate``.
+    Le generazioni passano dallo ``scheduler`` dell'istanza e dal suo
+    circuit ``breaker``; ``monitor`` ne controlla periodicamente la salute e
+    ``residency`` tiene ``OLLAMA_MODEL`` caricato nelle ore di attività.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.base_url = config.OLLAMA_BASE_URL.rstrip("/")
+        # Retry solo su errori di connessione e risposte 502/503/504: una
+        # generazione andata in timeout non viene ripetuta
+        retry = Retry(
+            total=config.OLLAMA_RETRIES,
+            connect=config.OLLAMA_RETRIES,
+            read=0,
+            status=config.OLLAMA_RETRIES,
+            backoff_factor=config.OLLAMA_RETRY_BACKOFF,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=config.OLLAMA_POOL_SIZE, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if not config.OLLAMA_HTTP_KEEPALIVE:
+            self.session.headers["Connection"] = "close"
+        self.chat_supported: Optional[bool] = None
+        self.scheduler = GenerationScheduler(
+            config.OLLAMA_MAX_IN_FLIGHT, config.OLLAMA_QUEUE_SIZE, config.OLLAMA_QUEUE_TIMEOUT
+        )
+        self.breaker = CircuitBreaker(config.OLLAMA_BREAKER_THRESHOLD, config.OLLAMA_BREAKER_RESET)
+        self.monitor = OllamaHealthMonitor(
+            self,
+            config.OLLAMA_MODEL,
+            interval=config.OLLAMA_HEALTH_INTERVAL,
+            breaker=self.breaker,
+            timeout=min(5.0, config.OLLAMA_HEALTH_INTERVAL),
+        )
+        self.residency = ModelResidency(
+            lambda warm: preload_model(config, warm),
+            busy=lambda: self.scheduler.stats()["in_flight"] > 0,
+            interval=config.OLLAMA_KEEPALIVE_REFRESH,
+            hours=config.OLLAMA_ACTIVE_HOURS,
+            days=config.OLLAMA_ACTIVE_DAYS,
+            breaker=self.breaker,
+        )
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.session.get(f"{self.base_url}{path}", **kwargs)
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.session.post(f"{self.base_url}{path}", **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_clients: Dict[Tuple[Any, ...], OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(config: Config) -> OllamaClient:
+    """Client condiviso per l'URL e i parametri di pool della configurazione."""
+    key = (
+        config.OLLAMA_BASE_URL.rstrip("/"),
+        config.OLLAMA_POOL_SIZE,
+        config.OLLAMA_RETRIES,
+        config.OLLAMA_RETRY_BACKOFF,
+        config.OLLAMA_HTTP_KEEPALIVE,
+        config.OLLAMA_MAX_IN_FLIGHT,
+        config.OLLAMA_QUEUE_SIZE,
+        config.OLLAMA_QUEUE_TIMEOUT,
+        config.OLLAMA_MODEL,
+        config.OLLAMA_HEALTH_INTERVAL,
+        config.OLLAMA_BREAKER_THRESHOLD,
+        config.OLLAMA_BREAKER_RESET,
+        config.OLLAMA_KEEP_ALIVE,
+        config.OLLAMA_KEEPALIVE_REFRESH,
+        config.OLLAMA_ACTIVE_HOURS,
+        config.OLLAMA_ACTIVE_DAYS,
+    )
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = OllamaClient(config)
+    return client
+
+
+def _is_missing_endpoint(response: requests.Response) -> bool:
+    """404 di endpoint inesistente (Ollama datato), non di modello non installato."""
+    if response.status_code != 404:
+        return False
+    try:
+        return "error" not in response.json()
+    except ValueError:
+        return True
+
+
+def _sampling_options(config: Config) -> Dict[str, Any]:
+    return {
+        "temperature": config.OLLAMA_TEMPERATURE,
+        "top_p": config.OLLAMA_TOP_P,
+        "num_predict": config.OLLAMA_NUM_PREDICT,
+    }
+
+
+def _cache_key(
+    prompt: str, system_instruction: str, target_model: Optional[str], config: Config
+) -> str:
+    return optimization_key(
+        normalize_prompt(prompt),
+        target_model,
+        config.OLLAMA_MODEL,
+        _sampling_options(config),
+        system_instruction,
+    )
+
+
+def _cached_result(
+    cache: Optional[OptimizationCache], key: str, prompt: str, start_time: float
+) -> Optional[Dict[str, Any]]:
+    """Risultato dalla cache delle ottimizzazioni, adattato al prompt corrente."""
+    if cache is None:
+        return None
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    elapsed_time = time.perf_counter() - start_time
+    if metrics_collector:
+        metrics_collector.record_stage("ollama_cache_hit", elapsed_time)
+    logger.info("Prompt migliorato dalla cache (%s)", cached["cache_tier"])
+    return {
+        "success": True,
+        "error": None,
+        "improved_prompt": cached["improved_prompt"],
+        "original_prompt": prompt,
+        "target_model": cached.get("target_model"),
+        "elapsed_time": elapsed_time,
+        "generation_time": cached.get("generation_time"),
+        "cached": True,
+        "cache_tier": cached["cache_tier"],
+    }
+
+
+def _store_result(
+    cache: Optional[OptimizationCache], key: str, result: Dict[str, Any]
+) -> None:
+    if cache is not None:
+        cache.set(
+            key,
+            {
+                "improved_prompt": result["improved_prompt"],
+                "target_model": result.get("target_model"),
+                "generation_time": result["elapsed_time"],
+            },
+        )
+
+
 def _request_prompt_optimization(
-    prompt: str, system_instruction: str, config: Config
+    prompt: str, system_instruction: str, config: Config, stream: bool = False
 ) -> requests.Response:
-    chat_url = f"{config.OLLAMA_BASE_URL}/api/chat"
+    """POST a ``/api/chat`` (o ``/api/generate`` su Ollama datati).
+
+    Con ``stream`` la risposta è NDJSON, letta riga per riga da ``_iter_chunks``.
+    """
     payload = {
         "model": config.OLLAMA_MODEL,
         "messages": [
@@ -95,19 +474,22 @@ def _request_prompt_optimization(
                 ),
             },
         ],
-        "stream": False,
-        "options": {
-            "temperature": config.OLLAMA_TEMPERATURE,
-            "top_p": config.OLLAMA_TOP_P,
-            "num_predict": config.OLLAMA_NUM_PREDICT,
-        },
+        "stream": stream,
+        "keep_alive": config.OLLAMA_KEEP_ALIVE,
+        "options": _sampling_options(config),
     }
-    response = requests.post(chat_url, json=payload, timeout=config.OLLAMA_TIMEOUT)
-    if response.status_code != 404:
-        return response
+    client = get_client(config)
+    if client.chat_supported is not False:
+        response = client.post(
+            "/api/chat", json=payload, timeout=config.OLLAMA_TIMEOUT, stream=stream
+        )
+        if not _is_missing_endpoint(response):
+            client.chat_supported = True
+            return response
+        response.close()
+        client.chat_supported = False
+        logger.warning("Endpoint /api/chat non disponibile, uso /api/generate d'ora in poi")
 
-    logger.warning("Endpoint /api/chat non disponibile, fallback a /api/generate")
-    generate_url = f"{config.OLLAMA_BASE_URL}/api/generate"
     generate_payload = {
         "model": config.OLLAMA_MODEL,
         "prompt": (
@@ -115,105 +497,409 @@ def _request_prompt_optimization(
             "Migliora questo prompt mantenendo il suo intento.\n\n"
             f"{prompt.strip()}"
         ),
-        "stream": False,
+        "stream": stream,
+        "keep_alive": config.OLLAMA_KEEP_ALIVE,
         "options": payload["options"],
     }
-    return requests.post(
-        generate_url, json=generate_payload, timeout=config.OLLAMA_TIMEOUT
+    return client.post(
+        "/api/generate", json=generate_payload, timeout=config.OLLAMA_TIMEOUT, stream=stream
     )
 
 
 def check_ollama_health(config: Config) -> bool:
+    """Controlla subito Ollama e aggiorna lo stato del monitor (chiamata bloccante)."""
+    return get_client(config).monitor.check()
+
+
+def ollama_status(config: Config) -> Dict[str, Any]:
+    """Ultimo stato noto di Ollama, del circuit breaker e della residenza del modello.
+
+    Nessuna chiamata di rete.
+    """
+    client = get_client(config)
+    return {**client.monitor.snapshot(), "residency": client.residency.stats()}
+
+
+def start_health_monitor(config: Config) -> OllamaHealthMonitor:
+    monitor = get_client(config).monitor
+    monitor.start()
+    return monitor
+
+
+def start_model_residency(config: Config) -> ModelResidency:
+    """Precarica ``OLLAMA_MODEL`` in background e ne rinnova il ``keep_alive`` in orario."""
+    residency = get_client(config).residency
+    residency.start(preload=config.OLLAMA_PRELOAD)
+    return residency
+
+
+def preload_model(config: Config, warm: bool = True) -> Optional[float]:
+    """Carica ``OLLAMA_MODEL`` in Ollama e ne rinnova il ``keep_alive``.
+
+    Senza prompt Ollama si limita a caricare il modello (o, se già in
+    memoria, a spostarne la scadenza); con ``warm`` genera anche un token,
+    così la prima ottimizzazione trova tutto pronto. La richiesta passa
+    dallo scheduler con una chiave propria, quindi rispetta
+    ``OLLAMA_MAX_IN_FLIGHT`` come le generazioni degli utenti.
+    Ritorna i secondi di caricamento riportati da Ollama, None se fallisce.
+    """
+    payload: Dict[str, Any] = {
+        "model": config.OLLAMA_MODEL,
+        "stream": False,
+        "keep_alive": config.OLLAMA_KEEP_ALIVE,
+    }
+    if warm:
+        payload.update(prompt="Ciao", options={"num_predict": 1})
+    result = get_client(config).scheduler.call(
+        PRELOAD_KEY,
+        lambda: _preload(config, payload),
+        lambda message: {"success": False, "error": message},
+    )
+    if not result.get("success"):
+        logger.warning(
+            "Precaricamento di %s non riuscito: %s", config.OLLAMA_MODEL, result.get("error")
+        )
+        return None
+    load_seconds = result["load_seconds"]
+    if metrics_collector:
+        metrics_collector.record_stage("ollama_preload", result["elapsed_time"])
+        if load_seconds >= COLD_LOAD_THRESHOLD:
+            metrics_collector.record_stage("ollama_load", load_seconds)
+    if load_seconds >= COLD_LOAD_THRESHOLD:
+        logger.info(
+            "Modello %s caricato in memoria in %.2f s (keep_alive %s)",
+            config.OLLAMA_MODEL, load_seconds, config.OLLAMA_KEEP_ALIVE,
+        )
+    return load_seconds
+
+
+def _preload(config: Config, payload: Dict[str, Any]) -> Dict[str, Any]:
+    start_time = time.perf_counter()
     try:
-        response = requests.get(
-            f"{config.OLLAMA_BASE_URL}/api/tags", timeout=5
+        response = get_client(config).post(
+            "/api/generate", json=payload, timeout=config.OLLAMA_TIMEOUT
         )
-        if response.status_code == 200:
-            models = response.json().get("models", [])
-            names = [m.get("name", "") for m in models]
-            if config.OLLAMA_MODEL in names:
-                logger.info("Modello %s è installato", config.OLLAMA_MODEL)
-            else:
-                logger.warning(
-                    "Modello %s non trovato. Esegui: ollama pull %s",
-                    config.OLLAMA_MODEL, config.OLLAMA_MODEL,
-                )
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+        response.raise_for_status()
+        load_seconds = _load_seconds(response.json())
+    except Exception as e:
+        _record_outcome(config, e)
+        return {"success": False, "error": str(e)}
+    _record_outcome(config)
+    return {
+        "success": True,
+        "load_seconds": load_seconds,
+        "elapsed_time": time.perf_counter() - start_time,
+    }
+
+
+def _load_seconds(chunk: Dict[str, Any]) -> float:
+    """``load_duration`` (ns) di una risposta Ollama, in secondi."""
+    return (chunk.get("load_duration") or 0) / 1e9
+
+
+def _record_latency(config: Config, elapsed_time: float, load_seconds: float = 0.0) -> bool:
+    """Registra la durata di una generazione; True se ha pagato il caricamento del modello.
+
+    Le generazioni a freddo finiscono nella fase ``ollama_cold`` (e il solo
+    caricamento in ``ollama_load``) invece che in ``ollama``, che resta la
+    latenza a modello già in memoria.
+    """
+    cold = load_seconds >= COLD_LOAD_THRESHOLD
+    if cold:
+        logger.warning(
+            "Generazione a freddo: %.2f s di caricamento di %s su %.2f s",
+            load_seconds, config.OLLAMA_MODEL, elapsed_time,
+        )
+    if metrics_collector:
+        if cold:
+            metrics_collector.record_stage("ollama_cold", elapsed_time)
+            metrics_collector.record_stage("ollama_load", load_seconds)
+        else:
+            metrics_collector.record_stage("ollama", elapsed_time)
+    return cold
+
+
+def _is_outage(exc: Optional[Exception]) -> bool:
+    """Errore che indica Ollama irraggiungibile o in difficoltà (non un errore della richiesta)."""
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500
+    return False
+
+
+def _record_outcome(config: Config, exc: Optional[Exception] = None) -> None:
+    client = get_client(config)
+    if _is_outage(exc):
+        client.breaker.record_failure()
+    else:
+        client.breaker.record_success()
+        if exc is None:
+            client.residency.touch()
+
+
+def _circuit_open_failure(prompt: str, config: Config) -> Optional[Dict[str, Any]]:
+    """Risultato immediato se il circuito è aperto, altrimenti None."""
+    breaker = get_client(config).breaker
+    if breaker.allow():
+        return None
+    return {
+        **_failure(
+            prompt,
+            f"Ollama non disponibile, nuovo tentativo tra {max(1.0, breaker.retry_after()):.0f} s",
+        ),
+        "unavailable": True,
+    }
+
+
+def _failure(prompt: str, error: str, elapsed_time: float = 0) -> Dict[str, Any]:
+    return {
+        "success": False,
+        "error": error,
+        "improved_prompt": None,
+        "original_prompt": prompt,
+        "elapsed_time": elapsed_time,
+    }
+
+
+def _error_result(exc: Exception, prompt: str, config: Config) -> Dict[str, Any]:
+    """Risultato di errore per un'eccezione sollevata durante la richiesta a Ollama."""
+    if isinstance(exc, requests.exceptions.Timeout):
+        return _failure(prompt, f"Timeout Ollama dopo {config.OLLAMA_TIMEOUT} s", config.OLLAMA_TIMEOUT)
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return _failure(prompt, f"Impossibile connettersi a {config.OLLAMA_BASE_URL}")
+    if isinstance(exc, requests.exceptions.HTTPError):
+        return _failure(
+            prompt,
+            f"HTTP {exc.response.status_code}. Modello {config.OLLAMA_MODEL} installato?",
+        )
+    logger.exception("Errore Ollama")
+    return _failure(prompt, str(exc))
+
+
+def _for_prompt(item: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+    """Elemento di una generazione condivisa riferito al prompt di questa richiesta."""
+    if item.get("original_prompt", prompt) == prompt:
+        return item
+    return {**item, "original_prompt": prompt}
 
 
 def improve_prompt_with_ollama(
-    prompt: str, config: Config, target_model: Optional[str] = None
+    prompt: str,
+    config: Config,
+    target_model: Optional[str] = None,
+    cache: Optional[OptimizationCache] = None,
+) -> Dict[str, Any]:
+    """Prompt migliorato da Ollama, o dalla ``cache`` se già generato con gli stessi parametri.
+
+    La generazione passa dallo scheduler del client: con la coda piena il
+    risultato ha ``success`` False e ``busy`` True.
+    """
+    is_valid, error_msg = validate_prompt(prompt)
+    if not is_valid:
+        return _failure(prompt, error_msg)
+    logger.info("Miglioramento prompt tramite Ollama: %s...", prompt[:50])
+    system_instruction = _build_system_instruction(prompt, target_model)
+    key = _cache_key(prompt, system_instruction, target_model, config)
+    cached = _cached_result(cache, key, prompt, time.perf_counter())
+    if cached is not None:
+        return cached
+    unavailable = _circuit_open_failure(prompt, config)
+    if unavailable is not None:
+        return unavailable
+    result = get_client(config).scheduler.call(
+        key,
+        lambda: _generate(prompt, system_instruction, target_model, config, cache, key),
+        lambda message: _failure(prompt, message),
+    )
+    result = _for_prompt(result, prompt)
+    return {name: value for name, value in result.items() if name != "done"}
+
+
+def _generate(
+    prompt: str,
+    system_instruction: str,
+    target_model: Optional[str],
+    config: Config,
+    cache: Optional[OptimizationCache],
+    key: str,
 ) -> Dict[str, Any]:
     try:
-        is_valid, error_msg = validate_prompt(prompt)
-        if not is_valid:
-            return {
-                "success": False,
-                "error": error_msg,
-                "improved_prompt": None,
-                "original_prompt": prompt,
-                "elapsed_time": 0,
-            }
-        logger.info("Miglioramento prompt tramite Ollama: %s...", prompt[:50])
-        system_instruction = _build_system_instruction(prompt, target_model)
-        start_time = time.time()
-        response = _request_prompt_optimization(prompt, system_instruction, config)
-        elapsed_time = time.time() - start_time
-        response.raise_for_status()
-        result = response.json()
+        start_time = time.perf_counter()
+        load_seconds = 0.0
+        try:
+            response = _request_prompt_optimization(prompt, system_instruction, config)
+            response.raise_for_status()
+            result = response.json()
+            load_seconds = _load_seconds(result)
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            cold_start = _record_latency(config, elapsed_time, load_seconds)
+        _record_outcome(config)
         message = result.get("message") or {}
         improved_prompt = _cleanup_improved_prompt(
             message.get("content", "") or result.get("response", "")
         )
         if not improved_prompt:
-            return {
-                "success": False,
-                "error": "Il modello non ha generato un prompt migliorato",
-                "improved_prompt": None,
-                "original_prompt": prompt,
-                "elapsed_time": elapsed_time,
-            }
+            return _failure(
+                prompt, "Il modello non ha generato un prompt migliorato", elapsed_time
+            )
         logger.info("Prompt migliorato in %.2f s", elapsed_time)
-        return {
+        result = {
             "success": True,
             "error": None,
             "improved_prompt": improved_prompt,
             "original_prompt": prompt,
             "target_model": target_model,
             "elapsed_time": elapsed_time,
+            "cold_start": cold_start,
         }
-    except requests.exceptions.Timeout:
-        return {
-            "success": False,
-            "error": f"Timeout Ollama dopo {config.OLLAMA_TIMEOUT} s",
-            "improved_prompt": None,
-            "original_prompt": prompt,
-            "elapsed_time": config.OLLAMA_TIMEOUT,
-        }
-    except requests.exceptions.ConnectionError:
-        return {
-            "success": False,
-            "error": f"Impossibile connettersi a {config.OLLAMA_BASE_URL}",
-            "improved_prompt": None,
-            "original_prompt": prompt,
-            "elapsed_time": 0,
-        }
-    except requests.exceptions.HTTPError as e:
-        return {
-            "success": False,
-            "error": f"HTTP {e.response.status_code}. Modello {config.OLLAMA_MODEL} installato?",
-            "improved_prompt": None,
-            "original_prompt": prompt,
-            "elapsed_time": 0,
-        }
+        _store_result(cache, key, result)
+        return result
     except Exception as e:
-        logger.exception("Errore Ollama")
-        return {
-            "success": False,
-            "error": str(e),
-            "improved_prompt": None,
-            "original_prompt": prompt,
-            "elapsed_time": 0,
+        _record_outcome(config, e)
+        return _error_result(e, prompt, config)
+
+
+def _iter_chunks(response: requests.Response, deadline: float) -> Iterator[Dict[str, Any]]:
+    """Oggetti JSON di una risposta NDJSON di Ollama, uno per riga.
+
+    Il timeout di ``requests`` vale per ogni singola lettura: ``deadline``
+    limita anche la durata complessiva della generazione.
+    """
+    for line in response.iter_lines():
+        if time.perf_counter() > deadline:
+            raise requests.exceptions.Timeout("Generazione oltre il timeout complessivo")
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if chunk.get("error"):
+            raise RuntimeError(chunk["error"])
+        yield chunk
+
+
+def stream_improve_prompt_with_ollama(
+    prompt: str,
+    config: Config,
+    target_model: Optional[str] = None,
+    cache: Optional[OptimizationCache] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Come ``improve_prompt_with_ollama``, ma con i token man mano che arrivano.
+
+    Produce risultati parziali ``{"done": False, "partial_prompt": ...}``, già
+    ripuliti con ``_cleanup_partial_prompt``, e come ultimo elemento il
+    risultato completo (``"done": True``) con il testo ripulito da
+    ``_cleanup_improved_prompt``, il tempo al primo token (``ttft``) e i
+    token al secondo della generazione. Un risultato in ``cache`` viene
+    prodotto subito come unico elemento; una richiesta identica già in corso
+    viene seguita invece di avviarne un'altra, anche se non in streaming.
+    """
+    is_valid, error_msg = validate_prompt(prompt)
+    if not is_valid:
+        yield {**_failure(prompt, error_msg), "done": True}
+        return
+    logger.info("Miglioramento prompt in streaming tramite Ollama: %s...", prompt[:50])
+    system_instruction = _build_system_instruction(prompt, target_model)
+    key = _cache_key(prompt, system_instruction, target_model, config)
+    cached = _cached_result(cache, key, prompt, time.perf_counter())
+    if cached is not None:
+        yield {**cached, "done": True}
+        return
+    unavailable = _circuit_open_failure(prompt, config)
+    if unavailable is not None:
+        yield {**unavailable, "done": True}
+        return
+    for item in get_client(config).scheduler.stream(
+        key,
+        lambda: _generate_stream(prompt, system_instruction, target_model, config, cache, key),
+        lambda message: {**_failure(prompt, message), "done": True},
+    ):
+        # Seguendo una generazione non in streaming arriva solo il risultato
+        # finale, senza "done"
+        yield _for_prompt({**item, "done": item.get("done", True)}, prompt)
+
+
+def _generate_stream(
+    prompt: str,
+    system_instruction: str,
+    target_model: Optional[str],
+    config: Config,
+    cache: Optional[OptimizationCache],
+    key: str,
+) -> Iterator[Dict[str, Any]]:
+    start_time = time.perf_counter()
+    ttft: Optional[float] = None
+    tokens = 0
+    text = ""
+    shown = ""
+    final: Dict[str, Any] = {}
+    response: Optional[requests.Response] = None
+    try:
+        response = _request_prompt_optimization(prompt, system_instruction, config, stream=True)
+        response.raise_for_status()
+        for chunk in _iter_chunks(response, start_time + config.OLLAMA_TIMEOUT):
+            piece = (chunk.get("message") or {}).get("content", "") or chunk.get("response", "")
+            if piece:
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                tokens += 1
+                text += piece
+                partial = _cleanup_partial_prompt(text)
+                if partial != shown:
+                    shown = partial
+                    yield {
+                        "done": False,
+                        "partial_prompt": partial,
+                        "elapsed_time": time.perf_counter() - start_time,
+                    }
+            if chunk.get("done"):
+                final = chunk
+                break
+    except Exception as e:
+        _record_outcome(config, e)
+        yield {**_error_result(e, prompt, config), "done": True}
+        return
+    finally:
+        if response is not None:
+            response.close()
+        elapsed_time = time.perf_counter() - start_time
+        cold_start = _record_latency(config, elapsed_time, _load_seconds(final))
+
+    _record_outcome(config)
+    # eval_count/eval_duration (ns) dell'ultimo chunk misurano la sola
+    # generazione; in loro assenza si stima dai chunk ricevuti dopo il primo
+    eval_count = final.get("eval_count") or tokens
+    eval_seconds = (final.get("eval_duration") or 0) / 1e9
+    if not eval_seconds and ttft is not None:
+        eval_seconds = elapsed_time - ttft
+    tokens_per_second = eval_count / eval_seconds if eval_seconds > 0 else 0.0
+    # Il primo token di una generazione a freddo include il caricamento
+    if metrics_collector and ttft is not None and not cold_start:
+        metrics_collector.record_stage("ollama_ttft", ttft)
+        if tokens_per_second:
+            metrics_collector.record_stage("ollama_token", 1.0 / tokens_per_second)
+
+    improved_prompt = _cleanup_improved_prompt(text)
+    if not improved_prompt:
+        yield {
+            **_failure(prompt, "Il modello non ha generato un prompt migliorato", elapsed_time),
+            "done": True,
         }
+        return
+    logger.info(
+        "Prompt migliorato in %.2f s (primo token %.2f s, %.1f token/s)",
+        elapsed_time, ttft or 0.0, tokens_per_second,
+    )
+    result = {
+        "success": True,
+        "error": None,
+        "improved_prompt": improved_prompt,
+        "original_prompt": prompt,
+        "target_model": target_model,
+        "elapsed_time": elapsed_time,
+        "ttft": ttft,
+        "tokens_per_second": tokens_per_second,
+        "cold_start": cold_start,
+    }
+    _store_result(cache, key, result)
+    yield {**result, "done": True}
@@ -0,0 +1,221 @@
+"""Cache dei prompt ottimizzati da Ollama.
+
+La chiave combina prompt normalizzato, modello di destinazione suggerito dal
+router, modello Ollama, opzioni di campionamento e istruzioni di sistema:
+cambiando uno di questi la voce non viene più trovata. Due livelli:
+- LRU in memoria con TTL, per le ripetizioni ravvicinate
+- SQLite opzionale in ``MODEL_DIR``, condiviso tra processi e riavvii, con
+  TTL e numero massimo di righe
+
+Vengono salvate solo le generazioni riuscite.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS optimizations (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+)
+"""
+
+
+def optimization_key(
+    normalized_prompt: str,
+    target_model: Optional[str],
+    ollama_model: str,
+    options: Mapping[str, Any],
+    instruction: str = "",
+) -> str:
+    """SHA-256 di tutto ciò che determina la generazione."""
+    material = json.dumps(
+        [normalized_prompt, target_model, ollama_model, dict(options), instruction],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class _SQLiteTier:
+    """Livello persistente: una tabella con chiave, risultato JSON e timestamp."""
+
+    PRUNE_INTERVAL = 64
+
+    def __init__(self, path: Path, ttl: int, max_rows: int) -> None:
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_rows = max(1, max_rows)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(str(self.path), timeout=5.0, check_same_thread=False)
+        # WAL: letture concorrenti tra processi mentre un altro scrive
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS optimizations_accessed ON optimizations (accessed)"
+        )
+        self._conn.commit()
+        self._prune(time.time())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM optimizations").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Tuple[dict, float]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, created FROM optimizations WHERE key = ? AND created > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE optimizations SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, result: dict, created: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO optimizations (key, result, created, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result, ensure_ascii=False), created, created),
+            )
+            self._conn.commit()
+            self._writes += 1
+            prune = self._writes % self.PRUNE_INTERVAL == 0
+        if prune:
+            self._prune(time.time())
+
+    def _prune(self, now: float) -> None:
+        """Rimuove le righe scadute e, oltre ``max_rows``, le meno usate di recente."""
+        with self._lock:
+            self._conn.execute("DELETE FROM optimizations WHERE created <= ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM optimizations WHERE key IN ("
+                "SELECT key FROM optimizations ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM optimizations")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class OptimizationCache:
+    """LRU in memoria con TTL, davanti a un livello SQLite opzionale."""
+
+    def __init__(
+        self,
+        max_size: int = 256,
+        ttl: int = 86400,
+        db_path: Optional[Path] = None,
+        max_rows: int = 10_000,
+    ) -> None:
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[_SQLiteTier] = None
+        if db_path is not None:
+            try:
+                self._disk = _SQLiteTier(db_path, ttl, max_rows)
+            except (OSError, sqlite3.Error):
+                logger.exception(
+                    "Cache persistente delle ottimizzazioni non disponibile in %s", db_path
+                )
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _put_memory(self, key: str, result: dict, created: float) -> None:
+        with self._lock:
+            self._entries[key] = (result, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key: str) -> Optional[dict]:
+        """Risultato in cache e livello che l'ha servito (``cache_tier``), o None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return {**entry[0], "cache_tier": "memory"}
+            if entry is not None:
+                del self._entries[key]
+        stored = None
+        if self._disk is not None:
+            try:
+                stored = self._disk.get(key)
+            except sqlite3.Error:
+                logger.exception("Lettura dalla cache delle ottimizzazioni non riuscita")
+        if stored is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        result, created = stored
+        self._put_memory(key, result, created)
+        with self._lock:
+            self.disk_hits += 1
+        return {**result, "cache_tier": "disk"}
+
+    def set(self, key: str, result: dict) -> None:
+        now = time.time()
+        self._put_memory(key, result, now)
+        if self._disk is not None:
+            try:
+                self._disk.set(key, result, now)
+            except sqlite3.Error:
+                logger.exception("Scrittura nella cache delle ottimizzazioni non riuscita")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            memory_hits, disk_hits, misses = self.memory_hits, self.disk_hits, self.misses
+            evictions = self.evictions
+        total = memory_hits + disk_hits + misses
+        stats: Dict[str, Any] = {
+            "entries": len(self),
+            "max_size": self.max_size,
+            "memory_hits": memory_hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": f"{((memory_hits + disk_hits) / total * 100) if total else 0.0:.1f}%",
+            "evictions": evictions,
+        }
+        if self._disk is not None:
+            stats["disk_entries"] = len(self._disk)
+            stats["disk_max_rows"] = self._disk.max_rows
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._disk is not None:
+            self._disk.clear()
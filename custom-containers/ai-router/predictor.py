@@ -1,9 +1,12 @@
 """Predizione del modello AI per un dato prompt."""
 import logging
-from typing import Any, Dict
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List
 
+from batching import InferenceDispatcher
 from cache import ModelCache
 from config import Config
+from embedding_store import encode_prompts
 from ollama_service import validate_prompt
 from metrics import Timer
 
@@ -13,12 +16,72 @@ logger = logging.getLogger(__name__)
 metrics_collector = None
 
 
+def _stage(name: str) -> ContextManager[None]:
+    """Misura la durata di una fase se il collettore di metriche è attivo."""
+    return metrics_collector.time_stage(name) if metrics_collector else nullcontext()
+
+
+def _route_batch(
+    prompts: List[str],
+    config: Config,
+    model_cache: ModelCache,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """Esegue un solo encode e una sola classificazione per un batch di prompt validi.
+
+    L'intero batch usa la stessa istantanea del modello, anche se nel frattempo
+    un riaddestramento ne pubblica una nuova. Con ``use_cache`` False non viene
+    usato l'archivio degli embedding.
+    """
+    bundle = model_cache.get_model_bundle(config.CLASSIFIER_PATH, config.ENCODER_PATH)
+    if not bundle.ready:
+        raise RuntimeError("Modelli non trovati. Addestrare prima il modello.")
+
+    with _stage("encode"):
+        embeddings, _ = encode_prompts(prompts, config, model_cache, use_store=use_cache)
+    if bundle.projection is not None:
+        with _stage("project"):
+            embeddings = bundle.projection.transform(embeddings)
+    with _stage("classify"):
+        if bundle.engine is not None:
+            best_indices, probabilities = bundle.engine.predict(embeddings)
+        else:
+            probabilities = bundle.classifier.predict_proba(embeddings)
+            best_indices = probabilities.argmax(axis=1)
+    classes = bundle.classes
+
+    results = []
+    for best, row in zip(best_indices.tolist(), probabilities):
+        results.append(
+            {
+                "success": True,
+                "error": None,
+                "predicted_model": classes[best],
+                "confidence": float(row[best]),
+                "all_probabilities": {
+                    cls: float(prob) for cls, prob in zip(classes, row)
+                },
+                "model_version": bundle.version,
+            }
+        )
+    return results
+
+
+def _get_dispatcher(config: Config, model_cache: ModelCache) -> InferenceDispatcher:
+    return model_cache.get_inference_dispatcher(
+        lambda batch: _route_batch(batch, config, model_cache),
+        max_batch_size=config.INFERENCE_BATCH_MAX_SIZE,
+        max_wait_ms=config.INFERENCE_BATCH_MAX_WAIT_MS,
+    )
+
+
 def predict_model(
     prompt: str, config: Config, model_cache: ModelCache
 ) -> Dict[str, Any]:
     """Predice quale modello utilizzare per un dato prompt, con cache e metriche."""
     try:
-        is_valid, error_msg = validate_prompt(prompt)
+        with _stage("validation"):
+            is_valid, error_msg = validate_prompt(prompt)
         if not is_valid:
             logger.warning("Prompt non valido: %s", error_msg)
             return {
@@ -28,8 +91,9 @@ def predict_model(
                 "confidence": None,
             }
 
-        # Cache delle predizioni
-        cached_result = model_cache.prediction_cache.get(prompt)
+        # Cache delle predizioni (prompt esatto o normalizzato)
+        with _stage("cache_lookup"):
+            cached_result, cache_tier = model_cache.prediction_cache.get_with_tier(prompt)
         if cached_result:
             logger.info("Risultato da cache per il prompt: %s...", prompt[:50])
             if metrics_collector:
@@ -37,17 +101,11 @@ def predict_model(
                     0.0,
                     is_cache_hit=True,
                     confidence=cached_result.get("confidence", 0.0),
+                    cache_tier=cache_tier,
                 )
             return cached_result
 
-        embedding_model = model_cache.get_embedding_model(
-            config.EMBEDDING_MODEL,
-            device=config.EMBEDDING_DEVICE,
-        )
-        classifier = model_cache.get_classifier(config.CLASSIFIER_PATH)
-        label_encoder = model_cache.get_label_encoder(config.ENCODER_PATH)
-
-        if classifier is None or label_encoder is None:
+        if not model_cache.get_model_bundle(config.CLASSIFIER_PATH, config.ENCODER_PATH).ready:
             error_msg = "Modelli non trovati. Addestrare prima il modello."
             logger.error(error_msg)
             return {
@@ -59,43 +117,22 @@ def predict_model(
 
         with Timer("Predizione modello") as timer:
             logger.info("Predizione del modello per il prompt: %s...", prompt[:50])
-            prompt_embedding = embedding_model.encode(
-                [prompt],
-                batch_size=1,
-                show_progress_bar=False,
-                convert_to_numpy=True,
-                normalize_embeddings=config.NORMALIZE_EMBEDDINGS,
-            )
-
-            prediction = classifier.predict(prompt_embedding)
-            probabilities = classifier.predict_proba(prompt_embedding)[0]
-
-        predicted_model = label_encoder.inverse_transform(prediction)[0]
-        confidence = float(probabilities.max())
-
-        # Mappa tutte le probabilità
-        all_probabilities = {
-            str(cls): float(prob)
-            for cls, prob in zip(label_encoder.classes_, probabilities)
-        }
-
-        result = {
-            "success": True,
-            "error": None,
-            "predicted_model": predicted_model,
-            "confidence": confidence,
-            "all_probabilities": all_probabilities,
-        }
+            if config.INFERENCE_BATCHING:
+                # Le richieste concorrenti condividono un unico encode + classificazione
+                result = _get_dispatcher(config, model_cache).submit(prompt).result()
+            else:
+                result = _route_batch([prompt], config, model_cache)[0]
 
         if metrics_collector:
+            metrics_collector.record_stage("predict", timer.elapsed)
             metrics_collector.record_prediction(
                 timer.elapsed,
                 is_cache_hit=False,
-                confidence=confidence,
+                confidence=result["confidence"],
                 threshold=config.CONFIDENCE_THRESHOLD,
             )
 
-        model_cache.prediction_cache.set(prompt, result)
+        model_cache.prediction_cache.set(prompt, result, version=result.get("model_version"))
         return result
 
     except Exception as e:
@@ -111,6 +148,101 @@ def predict_model(
         }
 
 
+def predict_models(
+    prompts: List[str],
+    config: Config,
+    model_cache: ModelCache,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """Predice il modello per una lista di prompt, a blocchi di EMBEDDING_BATCH_SIZE.
+
+    I risultati mantengono l'ordine dei prompt in ingresso; i prompt non validi
+    ricevono un risultato di errore senza interrompere il resto del batch.
+    Con ``use_cache`` False ogni prompt passa da encode e classificazione,
+    senza cache delle predizioni né archivio degli embedding.
+    """
+    results: List[Dict[str, Any]] = [None] * len(prompts)
+    pending: List[int] = []
+    for index, prompt in enumerate(prompts):
+        is_valid, error_msg = validate_prompt(prompt)
+        if not is_valid:
+            results[index] = {
+                "success": False,
+                "error": error_msg,
+                "predicted_model": None,
+                "confidence": None,
+            }
+            continue
+        cached_result, cache_tier = (
+            model_cache.prediction_cache.get_with_tier(prompt) if use_cache else (None, None)
+        )
+        if cached_result:
+            results[index] = cached_result
+            if metrics_collector:
+                metrics_collector.record_prediction(
+                    0.0,
+                    is_cache_hit=True,
+                    confidence=cached_result.get("confidence", 0.0),
+                    cache_tier=cache_tier,
+                )
+            continue
+        pending.append(index)
+
+    if not pending:
+        return results
+
+    if not model_cache.get_model_bundle(config.CLASSIFIER_PATH, config.ENCODER_PATH).ready:
+        error_msg = "Modelli non trovati. Addestrare prima il modello."
+        logger.error(error_msg)
+        for index in pending:
+            results[index] = {
+                "success": False,
+                "error": error_msg,
+                "predicted_model": None,
+                "confidence": None,
+            }
+        return results
+
+    chunk_size = config.EMBEDDING_BATCH_SIZE
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start : start + chunk_size]
+        chunk_prompts = [prompts[index] for index in chunk]
+        try:
+            with Timer("Predizione batch") as timer:
+                chunk_results = _route_batch(
+                    chunk_prompts, config, model_cache, use_cache=use_cache
+                )
+        except Exception as e:
+            error_msg = f"Errore durante la predizione: {str(e)}"
+            logger.exception(error_msg)
+            for index in chunk:
+                results[index] = {
+                    "success": False,
+                    "error": error_msg,
+                    "predicted_model": None,
+                    "confidence": None,
+                }
+                if metrics_collector:
+                    metrics_collector.record_prediction(0.0, had_error=True)
+            continue
+
+        per_prompt_time = timer.elapsed / len(chunk)
+        for index, prompt, result in zip(chunk, chunk_prompts, chunk_results):
+            results[index] = result
+            if metrics_collector:
+                metrics_collector.record_prediction(
+                    per_prompt_time,
+                    is_cache_hit=False,
+                    confidence=result["confidence"],
+                    threshold=config.CONFIDENCE_THRESHOLD,
+                )
+            if use_cache:
+                model_cache.prediction_cache.set(
+                    prompt, result, version=result.get("model_version")
+                )
+    return results
+
+
 def format_prediction_output(result: Dict[str, Any], config: Config) -> str:
     """Formatta il risultato della predizione per la visualizzazione."""
     if not result["success"]:
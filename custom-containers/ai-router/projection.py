@@ -0,0 +1,169 @@
+"""Riduzione della dimensione degli embedding prima della classificazione.
+
+La proiezione viene appresa in ``train_model`` (``PROJECTION_METHOD``):
+- ``pca``: prime ``PROJECTION_DIM`` componenti principali, stimate su un
+  campione del training
+- ``random``: proiezione gaussiana casuale (Johnson-Lindenstrauss), che
+  conserva approssimativamente le similarità coseno senza addestramento
+
+Viene salvata nell'artefatto insieme al classificatore e applicata a ogni
+embedding prima della classificazione, che quindi lavora su vettori più
+piccoli.
+"""
+import logging
+from typing import Any, Dict, Mapping, Optional
+
+import numpy as np
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+FIT_SAMPLE = 20_000
+EVALUATION_SAMPLE = 20_000
+TRANSFORM_CHUNK = 4096
+
+
+class Projection:
+    """Proiezione lineare ``(X - mean) @ components``, con rinormalizzazione opzionale."""
+
+    def __init__(
+        self,
+        components: np.ndarray,
+        mean: np.ndarray,
+        method: str,
+        normalize: bool = True,
+        explained_variance: Optional[float] = None,
+    ) -> None:
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.mean = np.ascontiguousarray(mean, dtype=np.float32)
+        self.method = method
+        self.normalize = bool(normalize)
+        self.explained_variance = explained_variance
+        # mean @ components precalcolato: un solo prodotto matriciale per chiamata
+        self._offset = self.mean @ self.components
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray], params: Mapping[str, Any]) -> "Projection":
+        return cls(
+            arrays["components"],
+            arrays["mean"],
+            params["method"],
+            params["normalize"],
+            params.get("explained_variance"),
+        )
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"components": self.components, "mean": self.mean}
+
+    def params(self) -> Dict[str, Any]:
+        params = {
+            "method": self.method,
+            "normalize": self.normalize,
+            "input_dim": self.input_dim,
+            "output_dim": self.output_dim,
+        }
+        if self.explained_variance is not None:
+            params["explained_variance"] = self.explained_variance
+        return params
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def output_dim(self) -> int:
+        return self.components.shape[1]
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        projected = np.asarray(X, dtype=np.float32).reshape(-1, self.input_dim) @ self.components
+        projected -= self._offset
+        if self.normalize:
+            projected /= np.maximum(np.linalg.norm(projected, axis=1, keepdims=True), 1e-12)
+        return projected
+
+    def transform_batched(self, X: np.ndarray, chunk_size: int = TRANSFORM_CHUNK) -> np.ndarray:
+        """Proietta una matrice anche memory-mapped senza caricarla tutta in RAM."""
+        out = np.empty((len(X), self.output_dim), dtype=np.float32)
+        for start in range(0, len(X), chunk_size):
+            out[start : start + chunk_size] = self.transform(X[start : start + chunk_size])
+        return out
+
+
+def _sample_rows(n: int, size: int, seed: int) -> np.ndarray:
+    if n <= size:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(seed).choice(n, size, replace=False))
+
+
+def fit_projection(
+    method: str,
+    X: np.ndarray,
+    dim: int,
+    normalize: bool = True,
+    seed: int = 42,
+    rows: Optional[np.ndarray] = None,
+) -> Optional[Projection]:
+    """Apprende la proiezione sulle righe ``rows`` di ``X`` (tutte se None).
+
+    Ritorna None se disattivata o se non riduce la dimensione.
+    """
+    if method == "none":
+        return None
+    input_dim = X.shape[1]
+    dim = min(dim, input_dim)
+    if method == "pca":
+        from sklearn.decomposition import PCA
+
+        if rows is None:
+            rows = np.arange(len(X))
+        sample = np.asarray(X[rows[_sample_rows(len(rows), FIT_SAMPLE, seed)]], dtype=np.float32)
+        dim = min(dim, len(sample))
+        if dim >= input_dim:
+            logger.info("Proiezione PCA non applicata: %s >= %s dimensioni", dim, input_dim)
+            return None
+        pca = PCA(n_components=dim, svd_solver="randomized", random_state=seed).fit(sample)
+        explained = round(float(pca.explained_variance_ratio_.sum()), 5)
+        logger.info(
+            "PCA %s -> %s dimensioni, varianza spiegata %.1f%%", input_dim, dim, 100 * explained
+        )
+        return Projection(pca.components_.T, pca.mean_, "pca", normalize, explained)
+    if method == "random":
+        if dim >= input_dim:
+            return None
+        rng = np.random.default_rng(seed)
+        components = rng.standard_normal((input_dim, dim)).astype(np.float32) / np.sqrt(dim)
+        return Projection(components, np.zeros(input_dim, dtype=np.float32), "random", normalize)
+    raise ValueError(f"Metodo di proiezione non supportato: {method}")
+
+
+def evaluate_projection(
+    projected_accuracy: float,
+    X: np.ndarray,
+    y: np.ndarray,
+    train_rows: np.ndarray,
+    holdout_rows: np.ndarray,
+    n_classes: int,
+    backend: str,
+    config: Config,
+    params: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Accuratezza holdout con embedding proiettati e completi.
+
+    ``projected_accuracy`` è quella già misurata sull'holdout dal
+    classificatore con la proiezione: serve un solo addestramento in più,
+    sugli embedding completi di al più ``EVALUATION_SAMPLE`` righe di training.
+    """
+    from classifiers import predict_batched, train_classifier
+
+    rows = train_rows[_sample_rows(len(train_rows), EVALUATION_SAMPLE, config.MLP_RANDOM_STATE)]
+    engine, _ = train_classifier(
+        backend, np.asarray(X[rows], dtype=np.float32), y[rows], n_classes, config, params
+    )
+    predicted = predict_batched(engine, np.asarray(X[holdout_rows], dtype=np.float32))
+    full_accuracy = round(float(np.mean(predicted == y[holdout_rows])), 5)
+    return {
+        "holdout_accuracy_full": full_accuracy,
+        "holdout_accuracy_projected": projected_accuracy,
+        "accuracy_delta": round(projected_accuracy - full_accuracy, 5),
+    }
@@ -0,0 +1,167 @@
+"""Riaddestramento in background con sostituzione atomica del modello.
+
+L'addestramento gira in un processo separato (spawn), così encode e fit non
+sottraggono GIL e memoria ai thread che servono le richieste. Al termine il
+processo principale apre in memory-map l'artefatto salvato e lo pubblica
+con ``ModelCache.swap_model``: le richieste già in
+corso terminano sul modello precedente e le predizioni in cache dei modelli
+superati vengono invalidate per versione.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from cache import ModelCache
+from config import Config
+from artifacts import load_current_artifact
+from training import load_training_state, scan_training_data, train_model
+
+logger = logging.getLogger(__name__)
+
+# Iniettato da router_main.py al bootstrap
+metrics_collector = None
+
+
+def _train_in_subprocess(config: Config) -> Tuple[bool, str]:
+    """Eseguito nel processo figlio: addestra e salva su disco il nuovo artefatto."""
+    logging.basicConfig(
+        level=config.LOG_LEVEL,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    return train_model(config, ModelCache(config))
+
+
+class BackgroundTrainer:
+    """Riaddestra il modello quando cambiano i dati di training o su richiesta."""
+
+    def __init__(self, config: Config, model_cache: ModelCache) -> None:
+        self.config = config
+        self.model_cache = model_cache
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._worker: Optional[threading.Thread] = None
+        self._pending_reason: Optional[str] = None
+        self._data_stat: Optional[Tuple[float, int]] = self._stat_data()
+        state = load_training_state(config)
+        self._fingerprint: Optional[str] = state["dataset_fingerprint"] if state else None
+        self.last_success: Optional[bool] = None
+        self.last_message: Optional[str] = None
+        self.last_finished_at: Optional[str] = None
+        self.last_duration: Optional[float] = None
+
+    def _stat_data(self) -> Optional[Tuple[float, int]]:
+        try:
+            stat = self.config.TRAINING_DATA_PATH.stat()
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None
+
+    def start(self) -> None:
+        """Avvia il controllo periodico di TRAINING_DATA_PATH."""
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, name="retrain-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(
+            "Controllo dati di training ogni %.0fs: %s",
+            self.config.RETRAIN_WATCH_INTERVAL,
+            self.config.TRAINING_DATA_PATH,
+        )
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def trigger(self, reason: str = "richiesta manuale") -> bool:
+        """Avvia un riaddestramento; se uno è già in corso ne accoda uno solo. Ritorna True se avviato."""
+        with self._lock:
+            if self.running:
+                self._pending_reason = reason
+                logger.info("Riaddestramento già in corso, nuovo ciclo accodato (%s)", reason)
+                return False
+            self._worker = threading.Thread(
+                target=self._run, args=(reason,), name="retrain-worker", daemon=True
+            )
+            self._worker.start()
+            return True
+
+    def data_changed(self) -> bool:
+        """True se il contenuto dei dati di training differisce da quello dell'ultimo modello."""
+        data_stat = self._stat_data()
+        if data_stat is None or data_stat == self._data_stat:
+            return False
+        self._data_stat = data_stat
+        try:
+            summary = scan_training_data(self.config.TRAINING_DATA_PATH)
+        except (OSError, ValueError, KeyError):
+            # File in scrittura o non valido: si riprova al prossimo controllo
+            logger.warning("Dati di training non leggibili, controllo rimandato")
+            self._data_stat = None
+            return False
+        return summary.fingerprint != self._fingerprint
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.config.RETRAIN_WATCH_INTERVAL):
+            try:
+                if self.data_changed():
+                    self.trigger("dati di training modificati")
+            except Exception:
+                logger.exception("Errore nel controllo dei dati di training")
+
+    def _run(self, reason: str) -> None:
+        while True:
+            self._train_once(reason)
+            with self._lock:
+                reason, self._pending_reason = self._pending_reason, None
+                if reason is None or self._stop.is_set():
+                    self._worker = None
+                    return
+
+    def _train_once(self, reason: str) -> None:
+        logger.info("Riaddestramento in background avviato (%s)", reason)
+        start = time.perf_counter()
+        try:
+            context = multiprocessing.get_context("spawn")
+            # Un processo per ciclo: la memoria del modello di embedding viene restituita al termine
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                success, message = executor.submit(_train_in_subprocess, self.config).result()
+            if success:
+                version = self.model_cache.swap_model(
+                    load_current_artifact(self.config.ARTIFACT_DIR)
+                )
+                state = load_training_state(self.config)
+                self._fingerprint = state["dataset_fingerprint"] if state else None
+                message = f"{message} - versione {version}"
+        except Exception as e:
+            logger.exception("Riaddestramento in background fallito")
+            success, message = False, str(e)
+        self.last_duration = time.perf_counter() - start
+        self.last_success = success
+        self.last_message = message
+        self.last_finished_at = datetime.now().isoformat()
+        if metrics_collector:
+            metrics_collector.record_stage("retrain", self.last_duration)
+        if success:
+            logger.info("Riaddestramento completato in %.1fs: %s", self.last_duration, message)
+        else:
+            logger.error("Riaddestramento fallito: %s (modello attuale invariato)", message)
+
+    def status(self) -> Dict[str, Any]:
+        """Stato corrente per API e log."""
+        return {
+            "running": self.running,
+            "pending": self._pending_reason is not None,
+            "model_version": self.model_cache.model_version,
+            "last_success": self.last_success,
+            "last_message": self.last_message,
+            "last_finished_at": self.last_finished_at,
+            "last_duration_s": round(self.last_duration, 3) if self.last_duration else None,
+        }
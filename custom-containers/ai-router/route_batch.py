@@ -0,0 +1,152 @@
+"""
+Routing in blocco da riga di comando: legge un file JSONL e scrive il JSONL instradato.
+
+Esempio:
+    python route_batch.py prompts.jsonl -o routed.jsonl --field prompt
+
+Il file viene letto e scritto a blocchi, quindi la memoria resta limitata
+anche con decine di migliaia di prompt.
+"""
+import argparse
+import json
+import logging
+import sys
+from itertools import islice
+from pathlib import Path
+from typing import IO, Iterator, List, Tuple
+
+try:
+    from dotenv import load_dotenv
+    env_file = Path(__file__).resolve().parent / ".env"
+    if env_file.exists():
+        load_dotenv(env_file)
+except ImportError:
+    pass
+
+from cache import ModelCache
+from config import Config
+from predictor import predict_models
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    stream=sys.stderr,
+)
+logger = logging.getLogger(__name__)
+
+
+def _parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Instrada in blocco i prompt di un file JSONL"
+    )
+    parser.add_argument("input", help="File JSONL in ingresso ('-' per stdin)")
+    parser.add_argument(
+        "-o", "--output", default="-", help="File JSONL in uscita ('-' per stdout)"
+    )
+    parser.add_argument(
+        "--field", default="prompt", help="Campo che contiene il prompt (default: prompt)"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=512,
+        help="Righe lette e instradate per blocco (default: 512)",
+    )
+    parser.add_argument(
+        "--probabilities",
+        action="store_true",
+        help="Includi le probabilita' di tutti i modelli nell'output",
+    )
+    parser.add_argument(
+        "--use-cache",
+        action="store_true",
+        help="Consulta la cache delle predizioni (disattivata di default)",
+    )
+    return parser.parse_args(argv)
+
+
+def _read_chunks(stream: IO[str], chunk_size: int) -> Iterator[List[Tuple[int, str]]]:
+    numbered = ((number, line) for number, line in enumerate(stream, 1) if line.strip())
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _route_chunk(
+    chunk: List[Tuple[int, str]],
+    args: argparse.Namespace,
+    config: Config,
+    model_cache: ModelCache,
+) -> List[dict]:
+    records: List[dict] = []
+    prompts: List[str | None] = []
+    for number, line in chunk:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            records.append({"line": number, "error": f"JSON non valido: {e}"})
+            prompts.append(None)
+            continue
+        if not isinstance(record, dict):
+            records.append({"line": number, "error": "La riga deve essere un oggetto JSON"})
+            prompts.append(None)
+            continue
+        if args.field not in record:
+            record["error"] = f"Campo '{args.field}' mancante"
+            records.append(record)
+            prompts.append(None)
+            continue
+        records.append(record)
+        prompts.append(record[args.field])
+
+    routable = [i for i, prompt in enumerate(prompts) if prompt is not None]
+    results = predict_models(
+        [prompts[i] for i in routable], config, model_cache, use_cache=args.use_cache
+    )
+    for i, result in zip(routable, results):
+        record = records[i]
+        record["predicted_model"] = result["predicted_model"]
+        record["confidence"] = result["confidence"]
+        if args.probabilities and result.get("all_probabilities"):
+            record["all_probabilities"] = result["all_probabilities"]
+        if not result["success"]:
+            record["error"] = result["error"]
+    return records
+
+
+def main(argv: List[str] | None = None) -> int:
+    args = _parse_args(argv)
+    config = Config()
+    model_cache = ModelCache(config)
+
+    if not model_cache.get_model_bundle(config.CLASSIFIER_PATH, config.ENCODER_PATH).ready:
+        logger.error("Modelli non trovati. Addestrare prima il modello.")
+        return 1
+
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    target = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    routed = failed = 0
+    try:
+        for chunk in _read_chunks(source, max(1, args.chunk_size)):
+            for record in _route_chunk(chunk, args, config, model_cache):
+                if record.get("predicted_model") is None:
+                    failed += 1
+                else:
+                    routed += 1
+                target.write(json.dumps(record, ensure_ascii=False) + "\n")
+            target.flush()
+            logger.info("Prompt instradati: %s (errori: %s)", routed, failed)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+    logger.info("Completato: %s prompt instradati, %s errori", routed, failed)
+    return 0 if routed or not failed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
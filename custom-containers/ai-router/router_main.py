@@ -4,8 +4,11 @@ Unisce le migliori caratteristiche dei progetti originali.
 """
 import logging
 import sys
+import time
 from pathlib import Path
 
+_PROCESS_START = time.perf_counter()
+
 try:
     from dotenv import load_dotenv
     env_file = Path(__file__).resolve().parent / ".env"
@@ -14,11 +17,15 @@ try:
 except ImportError:
     pass
 
+import ollama_service
+import predictor
+import retrainer
 from cache import ModelCache
 from config import Config
-from ollama_service import check_ollama_health
+from metrics import MetricsCollector
+from retrainer import BackgroundTrainer
+from startup import StartupTimings, load_components, warm_up
 from training import should_retrain, train_model
-from ui import create_gradio_interface
 
 logging.basicConfig(
     level=logging.INFO,
@@ -29,16 +36,31 @@ logger = logging.getLogger(__name__)
 
 
 def main() -> None:
+    timings = StartupTimings(_PROCESS_START)
+    timings.record("import", time.perf_counter() - _PROCESS_START)
     logger.info("=" * 60)
     logger.info("Avvio del Sistema Router AI Unificato")
     logger.info("=" * 60)
 
     config = Config()
-    model_cache = ModelCache()
+    model_cache = ModelCache(config)
+    metrics_collector = MetricsCollector()
+    metrics_collector.register_cache("predictions", model_cache.prediction_cache.stats)
+    if model_cache.optimization_cache is not None:
+        metrics_collector.register_cache(
+            "optimizations", model_cache.optimization_cache.stats
+        )
+    ollama_client = ollama_service.get_client(config)
+    metrics_collector.register_gauges("ollama_scheduler", ollama_client.scheduler.stats)
+    metrics_collector.register_gauges("ollama_circuit", ollama_client.breaker.stats)
+    metrics_collector.register_gauges("ollama_residency", ollama_client.residency.stats)
+    ollama_service.metrics_collector = metrics_collector
+    retrainer.metrics_collector = metrics_collector
 
     if should_retrain(config):
         logger.info("Addestramento del modello in corso...")
-        success, message = train_model(config, model_cache)
+        with timings.stage("training"):
+            success, message = train_model(config, model_cache)
         if not success:
             logger.error(f"Addestramento fallito: {message}")
             logger.error(
@@ -46,14 +68,60 @@ def main() -> None:
             )
             return
         logger.info(message)
-    else:
-        model_cache.get_classifier(config.CLASSIFIER_PATH)
-        model_cache.get_label_encoder(config.ENCODER_PATH)
 
-    if check_ollama_health(config):
+    # Embedding, classificatore, Ollama e moduli del server in parallelo
+    modules = {"api": ("api",), "gradio": ("ui",), "both": ("ui", "api")}[config.SERVE_MODE]
+    model_ready, ollama_available = load_components(config, model_cache, timings, modules)
+    if not model_ready:
+        logger.error("Modello non disponibile dopo l'addestramento")
+        return
+    if ollama_available:
         logger.info("Ollama disponibile")
     else:
-        logger.warning("Ollama non disponibile - miglioramento prompt disabilitato")
+        logger.warning(
+            "Ollama non disponibile - miglioramento prompt sospeso, nuovo controllo ogni %.0fs",
+            config.OLLAMA_HEALTH_INTERVAL,
+        )
+    ollama_service.start_health_monitor(config)
+    ollama_service.start_model_residency(config)
+    if config.STARTUP_WARMUP:
+        warm_up(config, model_cache, timings)
+    # Iniettato dopo il warm-up: le predizioni di prova non entrano nelle metriche
+    predictor.metrics_collector = metrics_collector
+    metrics_collector.record_stage("startup", timings.total)
+    timings.log()
+
+    # Nuovi dati di training vengono adottati senza riavviare il servizio
+    trainer = BackgroundTrainer(config, model_cache)
+    if config.RETRAIN_WATCH_ENABLED:
+        trainer.start()
+
+    if config.SERVE_MODE == "api":
+        from api import create_api, serve
+
+        logger.info("Avvio della sola API REST")
+        logger.info("=" * 60)
+        app = create_api(config, model_cache, metrics_collector, trainer)
+        serve(app, config.API_HOST, config.API_PORT, config.LOG_LEVEL)
+        return
+
+    from ui import create_gradio_interface
+
+    interface = create_gradio_interface(config, model_cache)
+    if config.SERVE_MODE == "both":
+        import gradio as gr
+        from api import create_api, serve
+
+        # API REST e UI sullo stesso server: le route API hanno precedenza sul mount Gradio
+        logger.info("Avvio di API REST e interfaccia Gradio")
+        logger.info(
+            f"Accedi a http://{config.GRADIO_SERVER_NAME}:{config.GRADIO_SERVER_PORT}"
+        )
+        logger.info("=" * 60)
+        app = create_api(config, model_cache, metrics_collector, trainer)
+        app = gr.mount_gradio_app(app, interface, path="/")
+        serve(app, config.GRADIO_SERVER_NAME, config.GRADIO_SERVER_PORT, config.LOG_LEVEL)
+        return
 
     logger.info("Avvio dell'interfaccia Gradio")
     logger.info(
@@ -61,13 +129,11 @@ def main() -> None:
     )
     logger.info("=" * 60)
 
-    interface = create_gradio_interface(config, model_cache)
     interface.launch(
         server_name=config.GRADIO_SERVER_NAME,
         server_port=config.GRADIO_SERVER_PORT,
         share=config.GRADIO_SHARE,
     )
 
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,117 @@
+"""Avvio del servizio: caricamenti in parallelo, warm-up e tempi di avvio.
+
+Modello di embedding, artefatto del classificatore e verifica di Ollama sono
+indipendenti e vengono avviati insieme; torch e sentence-transformers sono
+importati solo dal thread che carica il modello di embedding. Il warm-up
+esegue un encode e una classificazione completi, così la prima richiesta
+reale non paga allocazioni e inizializzazioni pigre.
+"""
+import importlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+from cache import ModelCache
+from config import Config
+from ollama_service import check_ollama_health
+
+logger = logging.getLogger(__name__)
+
+WARMUP_PROMPTS = (
+    "Scrivi una funzione Python che ordina una lista di dizionari per data",
+    "Riassumi questo articolo in tre punti",
+    "Crea un post social per il lancio di un prodotto",
+)
+
+
+class StartupTimings:
+    """Durata delle fasi di avvio, in secondi, nell'ordine in cui sono registrate."""
+
+    def __init__(self, process_start: Optional[float] = None) -> None:
+        self.start = process_start if process_start is not None else time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - start
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = seconds
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            **{name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "total": round(self.total, 3),
+        }
+
+    def log(self) -> None:
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages.items())
+        logger.info("Avvio completato in %.2fs (%s)", self.total, breakdown)
+
+
+def _timed(fn: Callable[[], Any]) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def load_components(
+    config: Config,
+    model_cache: ModelCache,
+    timings: StartupTimings,
+    modules: Sequence[str] = (),
+) -> Tuple[bool, bool]:
+    """Carica in parallelo embedding, classificatore, verifica Ollama e ``modules``.
+
+    ``modules`` sono i moduli del server (``ui``, ``api``) da importare nel
+    frattempo. Ritorna ``(modello pronto, Ollama disponibile)``. Le fasi si
+    sovrappongono: in ``timings`` la durata di ciascuna e, come ``load``, il
+    tempo complessivo.
+    """
+    tasks: Dict[str, Callable[[], Any]] = {
+        "embedding_model": lambda: model_cache.get_embedding_model(
+            config.EMBEDDING_MODEL,
+            device=config.EMBEDDING_DEVICE,
+            backend=config.EMBEDDING_BACKEND,
+            cache_dir=config.ONNX_CACHE_DIR,
+            threads=config.CPU_THREADS,
+        ),
+        "classifier": lambda: model_cache.get_model_bundle(
+            config.CLASSIFIER_PATH, config.ENCODER_PATH
+        ),
+        "ollama_check": lambda: check_ollama_health(config),
+    }
+    if modules:
+        tasks["server_imports"] = lambda: [importlib.import_module(name) for name in modules]
+    results: Dict[str, Any] = {}
+    with timings.stage("load"):
+        with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="startup") as pool:
+            futures = {name: pool.submit(_timed, task) for name, task in tasks.items()}
+            for name, future in futures.items():
+                results[name], seconds = future.result()
+                timings.record(name, seconds)
+    return results["classifier"].ready, bool(results["ollama_check"])
+
+
+def warm_up(config: Config, model_cache: ModelCache, timings: StartupTimings) -> None:
+    """Una predizione completa senza cache, prima di dichiarare il servizio pronto.
+
+    Senza cache né archivio degli embedding: anche dopo il primo avvio il
+    modello di embedding viene eseguito davvero.
+    """
+    from predictor import predict_models
+
+    with timings.stage("warmup"):
+        results = predict_models(list(WARMUP_PROMPTS), config, model_cache, use_cache=False)
+    if not all(result["success"] for result in results):
+        logger.warning("Warm-up non riuscito: %s", results[0].get("error"))
@@ -0,0 +1,62 @@
+"""Test delle generazioni condivise tra richieste in streaming e non."""
+import threading
+from types import SimpleNamespace
+
+import ollama_service
+from config import Config
+from ollama_health import CircuitBreaker
+from ollama_service import GenerationScheduler
+
+
+def test_stream_follower_of_call_leader(monkeypatch):
+    config = Config()
+    scheduler = GenerationScheduler(max_in_flight=1)
+    client = SimpleNamespace(scheduler=scheduler, breaker=CircuitBreaker())
+    monkeypatch.setattr(ollama_service, "get_client", lambda _config: client)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def generate(prompt, system_instruction, target_model, config, cache, key):
+        started.set()
+        release.wait(5)
+        return {
+            "success": True,
+            "error": None,
+            "improved_prompt": "Prompt migliorato",
+            "original_prompt": prompt,
+            "target_model": target_model,
+            "elapsed_time": 0.1,
+            "cold_start": False,
+        }
+
+    monkeypatch.setattr(ollama_service, "_generate", generate)
+
+    leader: dict = {}
+    thread = threading.Thread(
+        target=lambda: leader.update(
+            ollama_service.improve_prompt_with_ollama("Scrivi una poesia", config)
+        )
+    )
+    thread.start()
+    assert started.wait(5)
+
+    items = []
+    follower = threading.Thread(
+        target=lambda: items.extend(
+            ollama_service.stream_improve_prompt_with_ollama("Scrivi una poesia", config)
+        )
+    )
+    follower.start()
+    # Il follower si aggancia alla generazione in corso prima che finisca
+    while scheduler.stats()["coalesced"] == 0:
+        follower.join(0.01)
+    release.set()
+    thread.join(5)
+    follower.join(5)
+
+    assert leader["improved_prompt"] == "Prompt migliorato"
+    assert "done" not in leader
+    assert len(items) == 1
+    assert items[0]["done"] is True
+    assert items[0]["improved_prompt"] == "Prompt migliorato"
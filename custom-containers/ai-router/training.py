@@ -1,36 +1,40 @@
 """Addestramento del modello AI Router."""
+import hashlib
 import json
 import logging
-import pickle
+import os
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-from sklearn.neural_network import MLPClassifier
-from sklearn.preprocessing import LabelEncoder
+import numpy as np
 
+from artifacts import current_artifact_path, load_artifact, save_artifact
 from cache import ModelCache
+from classifiers import predict_batched, train_classifier
 from config import Config
+from dataset import (
+    DatasetSummary,
+    fingerprint_example,
+    iter_training_chunks,
+    iter_training_examples,
+    scan_training_data,
+)
+from evaluation import evaluate_holdout, holdout_split
+from embedding_store import KEY_SIZE, embedding_namespace, encode_prompts, prompt_key
+from projection import Projection, evaluate_projection, fit_projection
 
 logger = logging.getLogger(__name__)
 
 
 def load_training_data(file_path: Path) -> Tuple[list, list]:
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    if not isinstance(data, list):
-        raise ValueError("Il file di training deve contenere una lista di oggetti")
+    """Carica in memoria tutti gli esempi (per dataset piccoli; l'addestramento legge a blocchi)."""
     prompts = []
     models = []
-    for item in data:
-        if not isinstance(item, dict):
-            raise ValueError("Ogni elemento del training deve essere un oggetto JSON")
-        if "modello" not in item or "prompts" not in item:
-            raise KeyError("Ogni elemento deve contenere le chiavi 'modello' e 'prompts'")
-        if not isinstance(item["prompts"], list):
-            raise ValueError("Il campo 'prompts' deve essere una lista")
-        for prompt in item["prompts"]:
-            prompts.append(prompt)
-            models.append(item["modello"])
+    for prompt, model in iter_training_examples(file_path):
+        prompts.append(prompt)
+        models.append(model)
     return prompts, models
 
 
@@ -53,58 +57,514 @@ def validate_training_data(prompts: list, models: list) -> bool:
     return True
 
 
+def validate_summary(summary: DatasetSummary) -> bool:
+    """Come validate_training_data, sul riepilogo di una scansione in streaming."""
+    if summary.n_examples == 0:
+        logger.error("I dati di addestramento sono vuoti")
+        return False
+    if summary.invalid_prompts:
+        logger.error("I dati di addestramento contengono prompt non validi")
+        return False
+    if summary.invalid_models:
+        logger.error("I dati di addestramento contengono modelli non validi")
+        return False
+    if len(summary.class_counts) < 2:
+        logger.error("Servono almeno 2 modelli distinti per addestrare il classificatore")
+        return False
+    return True
+
+
+def _state_embeddings_path(config: Config) -> Path:
+    return config.TRAINING_EMBEDDINGS_PATH.with_suffix(".npy")
+
+
+def _embeddings_check(embeddings: np.ndarray) -> str:
+    """Impronta economica della matrice: numero di righe e hash di un campione fisso.
+
+    Lega l'archivio di chiavi e impronte alla matrice ``.npy`` pubblicata
+    insieme: i due file sono rinominati separatamente.
+    """
+    n_rows = len(embeddings)
+    rows = np.unique(np.linspace(0, n_rows - 1, num=min(n_rows, 64), dtype=np.int64))
+    digest = hashlib.sha256(np.ascontiguousarray(embeddings[rows]).tobytes()).hexdigest()
+    return f"{n_rows}:{digest}"
+
+
+def _digest_matrix(digests: List[bytes]) -> np.ndarray:
+    # Matrice uint8: il dtype "S32" troncherebbe i digest che terminano con byte nulli
+    return np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(-1, KEY_SIZE)
+
+
+def load_training_state(config: Config, namespace: Optional[str] = None) -> Optional[dict]:
+    """Carica impronte ed embedding (in memory-map) dell'ultimo addestramento, se compatibili.
+
+    Con ``namespace`` (``embedding_namespace``) gli embedding salvati devono
+    venire dallo stesso modello e backend; senza, interessano solo le impronte.
+    """
+    path = config.TRAINING_EMBEDDINGS_PATH
+    if not path.exists():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            fingerprints = data["fingerprints"]
+            state = {
+                "namespace": str(data["namespace"]),
+                "dataset_fingerprint": str(data["dataset_fingerprint"]),
+                "fingerprints": (
+                    set(fingerprints.tolist())
+                    if fingerprints.dtype.kind == "U"
+                    else {row.tobytes().hex() for row in fingerprints}
+                ),
+                "keys": data["keys"],
+                # Formato precedente: embedding dentro l'archivio npz
+                "embeddings": data["embeddings"] if "embeddings" in data.files else None,
+            }
+            check = str(data["embeddings_check"]) if "embeddings_check" in data.files else None
+        if state["embeddings"] is None:
+            state["embeddings"] = np.load(_state_embeddings_path(config), mmap_mode="r")
+    except (OSError, KeyError, ValueError):
+        logger.warning("Embedding di training non leggibili in %s, vengono ricalcolati", path)
+        return None
+    if len(state["keys"]) != len(state["embeddings"]) or (
+        check is not None and check != _embeddings_check(state["embeddings"])
+    ):
+        # Interruzione tra le due rinomine o scrittori concorrenti
+        logger.warning(
+            "Embedding di training non allineati alle chiavi in %s, vengono ricalcolati", path
+        )
+        return None
+    if namespace is not None and state["namespace"] != namespace:
+        logger.info("Modello di embedding cambiato: embedding di training ricalcolati")
+        return None
+    return state
+
+
+@dataclass
+class TrainingSet:
+    """Embedding e metadati del dataset codificato, pronti per fit e salvataggio."""
+
+    X: np.ndarray
+    models: List[str]
+    keys: np.ndarray
+    fingerprints: np.ndarray
+    embeddings_tmp_path: Path
+    report: Dict[str, int]
+    namespace: str
+
+
+def _save_training_state(config: Config, training_set: TrainingSet, fingerprint: str) -> None:
+    path = config.TRAINING_EMBEDDINGS_PATH
+    if isinstance(training_set.X, np.memmap):
+        training_set.X.flush()
+    # Nome temporaneo unico, come per la matrice: tuning.py --apply e il
+    # riaddestramento in background possono salvare nello stesso momento
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+    ) as f:
+        tmp_path = Path(f.name)
+        try:
+            np.savez(
+                f,
+                namespace=np.array(training_set.namespace),
+                dataset_fingerprint=np.array(fingerprint),
+                fingerprints=training_set.fingerprints,
+                keys=training_set.keys,
+                embeddings_check=np.array(_embeddings_check(training_set.X)),
+            )
+        except BaseException:
+            f.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+    try:
+        os.replace(training_set.embeddings_tmp_path, _state_embeddings_path(config))
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def encode_training_examples(
+    config: Config,
+    model_cache: ModelCache,
+    n_examples: int,
+    chunk_size: Optional[int] = None,
+) -> TrainingSet:
+    """Codifica il dataset a blocchi in una matrice preallocata su file (memory-map).
+
+    Gli embedding degli esempi invariati vengono copiati dall'ultimo
+    addestramento e solo la differenza passa dal modello di embedding; la
+    memoria usata oltre alla matrice dipende dalla dimensione del blocco.
+    Il file della matrice (``embeddings_tmp_path``) è del chiamante, che lo
+    rinomina o lo elimina.
+    """
+    chunk_size = chunk_size or config.TRAINING_CHUNK_SIZE
+    namespace = embedding_namespace(config, model_cache)
+    state = load_training_state(config, namespace)
+    # File temporaneo unico per esecuzione: un riaddestramento in background e
+    # tuning.py possono codificare il dataset nello stesso momento
+    target = _state_embeddings_path(config)
+    with tempfile.NamedTemporaryFile(
+        dir=target.parent, prefix=f"{target.stem}.", suffix=".tmp.npy", delete=False
+    ) as f:
+        tmp_path = Path(f.name)
+    try:
+        return _encode_into(
+            config, model_cache, n_examples, chunk_size, tmp_path, state, namespace
+        )
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _encode_into(
+    config: Config,
+    model_cache: ModelCache,
+    n_examples: int,
+    chunk_size: int,
+    tmp_path: Path,
+    state: Optional[Dict[str, Any]],
+    namespace: str,
+) -> TrainingSet:
+    """Corpo di ``encode_training_examples``: scrive la matrice in ``tmp_path``."""
+    previous_rows: Dict[bytes, int] = {}
+    previous_fingerprints: set = set()
+    previous_embeddings: Optional[np.ndarray] = None
+    if state is not None:
+        previous_rows = {key.tobytes(): row for row, key in enumerate(state["keys"])}
+        previous_fingerprints = state["fingerprints"]
+        previous_embeddings = state["embeddings"]
+
+    X: Optional[np.ndarray] = None
+    models: List[str] = []
+    keys = np.empty((n_examples, KEY_SIZE), dtype=np.uint8)
+    fingerprints = np.empty((n_examples, KEY_SIZE), dtype=np.uint8)
+    report = {"reused": 0, "encoded": 0, "from_store": 0, "added": 0, "removed": 0}
+    matched_previous = set()
+    offset = 0
+    for prompts, chunk_models in iter_training_chunks(config.TRAINING_DATA_PATH, chunk_size):
+        end = offset + len(prompts)
+        if end > n_examples:
+            raise ValueError("Dati di training modificati durante la lettura, riprovare")
+        chunk_keys = [prompt_key(p) for p in prompts]
+        reuse = [(i, previous_rows[key]) for i, key in enumerate(chunk_keys) if key in previous_rows]
+        delta = [i for i, key in enumerate(chunk_keys) if key not in previous_rows]
+        delta_embeddings = None
+        if delta:
+            delta_embeddings, encoded = encode_prompts(
+                [prompts[i] for i in delta], config, model_cache
+            )
+            report["encoded"] += encoded
+            report["from_store"] += len(delta) - encoded
+        if X is None:
+            dimension = (
+                previous_embeddings.shape[1] if reuse else delta_embeddings.shape[1]
+            )
+            X = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.float32, shape=(n_examples, dimension)
+            )
+        block = X[offset:end]
+        if reuse:
+            positions, rows = zip(*reuse)
+            block[list(positions)] = previous_embeddings[list(rows)]
+            report["reused"] += len(reuse)
+        if delta:
+            block[delta] = delta_embeddings
+
+        keys[offset:end] = _digest_matrix(chunk_keys)
+        for i, (prompt, model) in enumerate(zip(prompts, chunk_models)):
+            fingerprint = fingerprint_example(prompt, model)
+            fingerprints[offset + i] = np.frombuffer(bytes.fromhex(fingerprint), dtype=np.uint8)
+            if fingerprint in previous_fingerprints:
+                matched_previous.add(fingerprint)
+            else:
+                report["added"] += 1
+        models.extend(chunk_models)
+        offset = end
+        logger.debug("Esempi codificati: %s/%s", offset, n_examples)
+    if offset != n_examples or X is None:
+        raise ValueError("Dati di training modificati durante la lettura, riprovare")
+    report["removed"] = len(previous_fingerprints) - len(matched_previous)
+    return TrainingSet(X, models, keys, fingerprints, tmp_path, report, namespace)
+
+
+def mlp_params(config: Config) -> Dict[str, Any]:
+    """Iperparametri del MLP: quelli della configurazione o quelli applicati da tuning.py."""
+    params: Dict[str, Any] = {
+        "hidden_layer_sizes": config.MLP_HIDDEN_LAYERS,
+        "max_iter": config.MLP_MAX_ITER,
+        "random_state": config.MLP_RANDOM_STATE,
+    }
+    if config.MLP_USE_TUNED_PARAMS and config.TUNING_REPORT_PATH.exists():
+        try:
+            with open(config.TUNING_REPORT_PATH, "r", encoding="utf-8") as f:
+                report = json.load(f)
+            if report.get("applied"):
+                tuned = dict(report["selected"]["params"])
+                tuned["hidden_layer_sizes"] = tuple(tuned["hidden_layer_sizes"])
+                params.update(tuned)
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning("Report di tuning non leggibile, uso i parametri di configurazione")
+    return params
+
+
+TRAIN_ACCURACY_SAMPLE = 5000
+
+
+def _artifact_manifest(
+    engine: Any,
+    info: Dict[str, Any],
+    X: np.ndarray,
+    y: np.ndarray,
+    config: Config,
+    fingerprint: str,
+    embedding_dimension: int,
+    rows: Optional[np.ndarray] = None,
+) -> Dict[str, Any]:
+    """Metadati salvati con il motore: embedding usati, dataset, iperparametri e metriche.
+
+    ``train_accuracy`` è misurata sulle righe ``rows`` su cui è stato
+    addestrato il motore (tutte se None), mai sull'holdout.
+    """
+    # Accuratezza su un campione: con il kNN la valutazione su tutto X costa quanto n^2
+    sample = np.arange(len(y)) if rows is None else np.asarray(rows)
+    if len(sample) > TRAIN_ACCURACY_SAMPLE:
+        sample = np.sort(
+            np.random.default_rng(config.MLP_RANDOM_STATE).choice(
+                sample, TRAIN_ACCURACY_SAMPLE, replace=False
+            )
+        )
+    predicted = predict_batched(engine, np.asarray(X[sample]))
+    metrics: Dict[str, Any] = {
+        "train_accuracy": round(float(np.mean(predicted == y[sample])), 5),
+        **{key: value for key, value in info.items() if key != "params"},
+    }
+    return {
+        "embedding_model": config.EMBEDDING_MODEL,
+        "embedding_backend": config.EMBEDDING_BACKEND,
+        "embedding_dimension": embedding_dimension,
+        "normalize_embeddings": config.NORMALIZE_EMBEDDINGS,
+        "dataset_fingerprint": fingerprint,
+        "n_examples": int(X.shape[0]),
+        "params": {
+            key: list(value) if isinstance(value, tuple) else value
+            for key, value in info["params"].items()
+        },
+        "metrics": metrics,
+    }
+
+
+def _projection_config(config: Config) -> Dict[str, Any]:
+    """Proiezione richiesta dalla configurazione, salvata nel manifest anche se non applicata."""
+    if config.PROJECTION_METHOD == "none":
+        return {"method": "none"}
+    return {"method": config.PROJECTION_METHOD, "dim": config.PROJECTION_DIM}
+
+
+def _model_file(config: Config) -> Optional[Path]:
+    """Manifest dell'artefatto attivo o, in sua assenza, il pickle legacy."""
+    artifact = current_artifact_path(config.ARTIFACT_DIR)
+    if artifact is not None:
+        return artifact / "manifest.json"
+    if config.CLASSIFIER_PATH.exists() and config.ENCODER_PATH.exists():
+        return config.CLASSIFIER_PATH
+    return None
+
+
 def should_retrain(config: Config) -> bool:
-    if not config.CLASSIFIER_PATH.exists() or not config.ENCODER_PATH.exists():
+    model_file = _model_file(config)
+    if model_file is None:
         logger.info("File del modello non trovati, addestramento necessario")
         return True
+    if model_file.name == "manifest.json":
+        with open(model_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if (
+            manifest.get("embedding_model") != config.EMBEDDING_MODEL
+            or manifest.get("normalize_embeddings") != config.NORMALIZE_EMBEDDINGS
+        ):
+            logger.info("Modello addestrato con embedding diversi, addestramento necessario")
+            return True
+        if manifest.get("projection_config", {"method": "none"}) != _projection_config(config):
+            logger.info("Proiezione degli embedding cambiata, addestramento necessario")
+            return True
     if config.RETRAIN_ON_DATA_CHANGE and config.TRAINING_DATA_PATH.exists():
         training_data_mtime = config.TRAINING_DATA_PATH.stat().st_mtime
-        classifier_mtime = config.CLASSIFIER_PATH.stat().st_mtime
+        classifier_mtime = model_file.stat().st_mtime
         if training_data_mtime > classifier_mtime:
+            state = load_training_state(config)
+            if state is not None:
+                try:
+                    summary = scan_training_data(config.TRAINING_DATA_PATH)
+                except (ValueError, KeyError, json.JSONDecodeError):
+                    return True
+                if summary.fingerprint == state["dataset_fingerprint"]:
+                    logger.info("Dati modificati solo nella data: modello ancora valido")
+                    return False
             logger.info("Dati piu recenti del modello, riaddestramento necessario")
             return True
     logger.info("Utilizzo del modello addestrato esistente")
     return False
 
 
-def train_model(config: Config, model_cache: ModelCache) -> Tuple[bool, str]:
+def _fit_projection(
+    config: Config, X: np.ndarray, rows: Optional[np.ndarray] = None
+) -> Optional[Projection]:
+    return fit_projection(
+        config.PROJECTION_METHOD,
+        X,
+        config.PROJECTION_DIM,
+        normalize=config.NORMALIZE_EMBEDDINGS,
+        seed=config.MLP_RANDOM_STATE,
+        rows=rows,
+    )
+
+
+def train_model(
+    config: Config, model_cache: ModelCache, params: Optional[Dict[str, Any]] = None
+) -> Tuple[bool, str]:
+    training_set: Optional[TrainingSet] = None
     try:
         logger.info("Caricamento dati da: %s", config.TRAINING_DATA_PATH)
         if not config.TRAINING_DATA_PATH.exists():
             return False, f"File non trovato: {config.TRAINING_DATA_PATH}"
-        prompts, models = load_training_data(config.TRAINING_DATA_PATH)
-        if not validate_training_data(prompts, models):
+        summary = scan_training_data(config.TRAINING_DATA_PATH)
+        if not validate_summary(summary):
             return False, "Formato dati non valido"
-        logger.info("Caricati %s esempi", len(prompts))
-        embedding_model = model_cache.get_embedding_model(
-            config.EMBEDDING_MODEL,
-            device=config.EMBEDDING_DEVICE,
+        logger.info(
+            "Trovati %s esempi per %s modelli", summary.n_examples, len(summary.class_counts)
         )
-        X = embedding_model.encode(
-            prompts,
-            batch_size=config.EMBEDDING_BATCH_SIZE,
-            show_progress_bar=False,
-            convert_to_numpy=True,
-            normalize_embeddings=config.NORMALIZE_EMBEDDINGS,
+        training_set = encode_training_examples(config, model_cache, summary.n_examples)
+        X, report = training_set.X, training_set.report
+        logger.info(
+            "Embedding: %s riutilizzati, %s dall'archivio, %s calcolati "
+            "(esempi aggiunti/modificati: %s, rimossi: %s)",
+            report["reused"],
+            report["from_store"],
+            report["encoded"],
+            report["added"],
+            report["removed"],
         )
+        from sklearn.preprocessing import LabelEncoder
+
         label_encoder = LabelEncoder()
-        y = label_encoder.fit_transform(models)
-        classifier = MLPClassifier(
-            hidden_layer_sizes=config.MLP_HIDDEN_LAYERS,
-            max_iter=config.MLP_MAX_ITER,
-            random_state=config.MLP_RANDOM_STATE,
+        y = label_encoder.fit_transform(training_set.models)
+        backend = config.CLASSIFIER_BACKEND
+        if backend == "mlp":
+            params = mlp_params(config) if params is None else params
+        elif params is not None:
+            # I parametri di tuning.py sono iperparametri del MLP
+            logger.warning("Parametri ignorati per il backend %s", backend)
+            params = None
+        n_classes = len(label_encoder.classes_)
+        split = holdout_split(y, config.EVAL_HOLDOUT_FRACTION, config.MLP_RANDOM_STATE)
+        # Con l'holdout la proiezione è appresa solo sugli esempi di training:
+        # le metriche di valutazione non devono dipendere dagli esempi valutati
+        train_rows = split[0] if split is not None else None
+        projection = _fit_projection(config, X, train_rows)
+        X_model = projection.transform_batched(X) if projection is not None else X
+        classes = [str(cls) for cls in label_encoder.classes_]
+        evaluation: Optional[Dict[str, Any]] = None
+        if split is not None:
+            train_idx, holdout_idx = split
+            engine, info = train_classifier(
+                backend, X_model[train_idx], y[train_idx], n_classes, config, params
+            )
+            evaluation = {
+                "backend": backend,
+                "embedding_model": config.EMBEDDING_MODEL,
+                "embedding_backend": model_cache.embedding_backend or config.EMBEDDING_BACKEND,
+                "projection": projection.params() if projection is not None else None,
+                "n_train": int(len(train_idx)),
+                "refit_full": config.EVAL_REFIT_FULL,
+                **evaluate_holdout(engine, X[holdout_idx], y[holdout_idx], classes, projection),
+            }
+            logger.info(
+                "Holdout (%s esempi): accuratezza %.4f, macro-F1 %.4f, ECE %.4f, p50 %.3f ms",
+                evaluation["n_holdout"],
+                evaluation["accuracy"],
+                evaluation["f1_macro"],
+                evaluation["calibration"]["ece"],
+                evaluation["latency"]["p50_ms"],
+            )
+        projection_report: Dict[str, Any] = {}
+        if projection is not None and config.PROJECTION_EVALUATE:
+            if evaluation is None:
+                logger.warning("Valutazione della proiezione non eseguita: serve l'holdout")
+            else:
+                # Il lato proiettato è l'holdout appena misurato: un solo addestramento in più
+                projection_report = evaluate_projection(
+                    evaluation["accuracy"],
+                    X,
+                    y,
+                    train_idx,
+                    holdout_idx,
+                    n_classes,
+                    backend,
+                    config,
+                    params,
+                )
+                logger.info(
+                    "Proiezione %s a %s dimensioni: accuratezza holdout %.4f -> %.4f",
+                    projection.method,
+                    projection.output_dim,
+                    projection_report["holdout_accuracy_full"],
+                    projection_report["holdout_accuracy_projected"],
+                )
+        if split is None or config.EVAL_REFIT_FULL:
+            if split is not None and projection is not None:
+                projection = _fit_projection(config, X)
+                X_model = projection.transform_batched(X)
+            engine, info = train_classifier(backend, X_model, y, n_classes, config, params)
+            train_rows = None
+        logger.info("Classificatore %s addestrato: %s", backend, info)
+        fingerprint = summary.fingerprint
+        manifest = _artifact_manifest(
+            engine, info, X_model, y, config, fingerprint, int(X.shape[1]), rows=train_rows
+        )
+        manifest["projection_config"] = _projection_config(config)
+        if projection_report:
+            manifest["projection"] = projection_report
+        if evaluation is not None:
+            manifest["metrics"].update(
+                {
+                    "holdout_accuracy": evaluation["accuracy"],
+                    "holdout_f1_macro": evaluation["f1_macro"],
+                    "holdout_ece": evaluation["calibration"]["ece"],
+                }
+            )
+        artifact_path = save_artifact(
+            config.ARTIFACT_DIR,
+            engine,
+            classes,
+            manifest,
+            keep=config.ARTIFACT_KEEP,
+            projection=projection,
+            report=evaluation,
+        )
+        _save_training_state(config, training_set, fingerprint)
+        model_cache.swap_model(load_artifact(artifact_path))
+        message = (
+            f"Modello addestrato con {summary.n_examples} esempi "
+            f"({summary.n_examples - report['encoded']} embedding riutilizzati, "
+            f"{report['encoded']} calcolati)"
         )
-        classifier.fit(X, y)
-        with open(config.CLASSIFIER_PATH, "wb") as f:
-            pickle.dump(classifier, f)
-        with open(config.ENCODER_PATH, "wb") as f:
-            pickle.dump(label_encoder, f)
-        model_cache.set_classifier(classifier)
-        model_cache.set_label_encoder(label_encoder)
-        return True, f"Modello addestrato con {len(prompts)} esempi"
+        if evaluation is not None:
+            message += (
+                f"; holdout: accuratezza {evaluation['accuracy']:.1%}, "
+                f"macro-F1 {evaluation['f1_macro']:.1%}"
+            )
+        if "accuracy_delta" in projection_report:
+            message += (
+                f"; proiezione {projection.method} a {projection.output_dim} dimensioni, "
+                f"accuratezza holdout {projection_report['accuracy_delta']:+.2%}"
+            )
+        return True, message
     except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
         logger.exception("Errore addestramento")
         return False, str(e)
     except Exception as e:
         logger.exception("Errore addestramento")
         return False, str(e)
+    finally:
+        # Dopo un salvataggio riuscito il file è già stato rinominato
+        if training_set is not None:
+            training_set.embeddings_tmp_path.unlink(missing_ok=True)
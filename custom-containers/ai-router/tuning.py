@@ -0,0 +1,401 @@
+"""
+Ricerca degli iperparametri del classificatore con cross-validation stratificata.
+
+Esempio:
+    python tuning.py --search random --n-iter 16 --folds 5 --latency-budget-ms 0.5 --apply
+
+Gli embedding del training vengono calcolati una sola volta e condivisi con
+i processi del pool tramite un file ``.npy`` memory-mapped. Per ogni
+configurazione si misurano accuratezza e macro-F1 su k fold e la latenza di
+una singola predizione con il motore NumPy usato in produzione; viene scelta
+la configurazione più accurata entro il budget di latenza, preferendo il
+modello più piccolo tra quelli equivalenti entro ``--tolerance``. Con
+``PROJECTION_METHOD`` attivo la proiezione viene appresa sul training di
+ogni fold e la cross-validation lavora sugli embedding proiettati, come il
+modello servito. Il report viene scritto in ``TUNING_REPORT_PATH``; con
+``--apply`` (solo con ``CLASSIFIER_BACKEND=mlp``) il modello finale viene
+addestrato con i parametri scelti, che restano in uso anche nei
+riaddestramenti successivi.
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.neural_network import MLPClassifier
+
+try:
+    from dotenv import load_dotenv
+    env_file = Path(__file__).resolve().parent / ".env"
+    if env_file.exists():
+        load_dotenv(env_file)
+except ImportError:
+    pass
+
+from config import Config
+from inference import build_inference_engine
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SPACE: Dict[str, Sequence[Any]] = {
+    "hidden_layer_sizes": [(64,), (128,), (100, 50), (256, 128)],
+    "alpha": [1e-4, 1e-3, 1e-2],
+    "learning_rate_init": [1e-3, 3e-3],
+    "early_stopping": [False, True],
+}
+LATENCY_REPEATS = 200
+
+# Stato dei processi del pool, inizializzato una volta per processo
+_X: Optional[np.ndarray] = None
+_y: Optional[np.ndarray] = None
+
+
+def _parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Cerca gli iperparametri del classificatore con k-fold cross-validation"
+    )
+    parser.add_argument(
+        "--search",
+        choices=("grid", "random"),
+        default="random",
+        help="Griglia completa o campionamento casuale (default: random)",
+    )
+    parser.add_argument(
+        "--n-iter", type=int, default=16, help="Configurazioni provate con --search random"
+    )
+    parser.add_argument("--folds", type=int, default=5, help="Numero di fold (default: 5)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processi del pool (default: numero di CPU)",
+    )
+    parser.add_argument(
+        "--latency-budget-ms",
+        type=float,
+        default=None,
+        help="Latenza massima per singola predizione (ms); nessun limite se omesso",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.005,
+        help="Scarto di accuratezza entro cui preferire il modello più piccolo (default: 0.005)",
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Addestra il modello finale con i parametri scelti e li mantiene per i riaddestramenti",
+    )
+    return parser.parse_args(argv)
+
+
+def candidate_params(
+    config: Config, search: str, n_iter: int, seed: int
+) -> List[Dict[str, Any]]:
+    """Configurazioni da valutare; la prima è sempre quella attuale come riferimento."""
+    keys = list(SEARCH_SPACE)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    if search == "random" and n_iter < len(grid):
+        grid = random.Random(seed).sample(grid, n_iter)
+    baseline = {
+        "hidden_layer_sizes": tuple(config.MLP_HIDDEN_LAYERS),
+        "alpha": 1e-4,
+        "learning_rate_init": 1e-3,
+        "early_stopping": False,
+    }
+    candidates = [baseline] + [params for params in grid if params != baseline]
+    for params in candidates:
+        params["max_iter"] = config.MLP_MAX_ITER
+        params["random_state"] = config.MLP_RANDOM_STATE
+    return candidates
+
+
+def _init_worker(embeddings_path: str, labels: np.ndarray) -> None:
+    """Apre la matrice condivisa: ``(n, d)``, o ``(fold, n, d)`` se proiettata per fold."""
+    global _X, _y
+    # Un thread BLAS per processo: il parallelismo è dato dal pool
+    try:
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(1)
+    except ImportError:
+        pass
+    _X = np.load(embeddings_path, mmap_mode="r")
+    _y = labels
+
+
+def _measure_latency_ms(classifier: MLPClassifier, sample: np.ndarray) -> float:
+    """Mediana della latenza di una singola predizione, come in produzione."""
+    engine = build_inference_engine(classifier)
+    predict = engine.predict if engine is not None else classifier.predict_proba
+    timings = []
+    for _ in range(LATENCY_REPEATS):
+        start = time.perf_counter()
+        predict(sample)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def _evaluate_fold(
+    task: Tuple[int, int, Dict[str, Any], np.ndarray, np.ndarray]
+) -> Dict[str, Any]:
+    index, fold, params, train_idx, val_idx = task
+    X = _X[fold] if _X.ndim == 3 else _X
+    classifier = MLPClassifier(**params)
+    start = time.perf_counter()
+    classifier.fit(X[train_idx], _y[train_idx])
+    fit_time = time.perf_counter() - start
+    predicted = classifier.predict(X[val_idx])
+    result = {
+        "index": index,
+        "accuracy": float(accuracy_score(_y[val_idx], predicted)),
+        "f1_macro": float(f1_score(_y[val_idx], predicted, average="macro")),
+        "fit_time_s": fit_time,
+        "n_iter": int(classifier.n_iter_),
+        "n_params": int(
+            sum(w.size for w in classifier.coefs_) + sum(b.size for b in classifier.intercepts_)
+        ),
+    }
+    if fold == 0:
+        result["latency_ms"] = _measure_latency_ms(
+            classifier, np.ascontiguousarray(X[val_idx[:1]], dtype=np.float32)
+        )
+    return result
+
+
+def stratified_splits(
+    labels: np.ndarray, folds: int, seed: int
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    return list(splitter.split(np.zeros(len(labels)), labels))
+
+
+def project_folds(
+    config: Config,
+    X: np.ndarray,
+    splits: List[Tuple[np.ndarray, np.ndarray]],
+    path: Path,
+) -> Optional[Dict[str, Any]]:
+    """Scrive in ``path`` gli embedding proiettati con la proiezione appresa su ogni fold.
+
+    La proiezione di un fold vede solo le sue righe di training, come
+    ``train_model`` con l'holdout. Ritorna None se ``PROJECTION_METHOD`` non
+    riduce la dimensione (la cross-validation usa allora ``X``).
+    """
+    from training import _fit_projection
+
+    projected: Optional[np.ndarray] = None
+    info: Optional[Dict[str, Any]] = None
+    for fold, (train_idx, _) in enumerate(splits):
+        projection = _fit_projection(config, X, rows=train_idx)
+        if projection is None:
+            return None
+        if projected is None:
+            shape = (len(splits), len(X), projection.output_dim)
+            projected = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+            info = {"method": projection.method, "dim": projection.output_dim}
+        projected[fold] = projection.transform_batched(X)
+    projected.flush()
+    return info
+
+
+def cross_validate(
+    embeddings_path: Path,
+    labels: np.ndarray,
+    candidates: List[Dict[str, Any]],
+    splits: List[Tuple[np.ndarray, np.ndarray]],
+    workers: int,
+) -> List[Dict[str, Any]]:
+    """Valuta in parallelo ogni configurazione sui fold ``splits``."""
+    tasks = [
+        (index, fold, params, train_idx, val_idx)
+        for index, params in enumerate(candidates)
+        for fold, (train_idx, val_idx) in enumerate(splits)
+    ]
+    logger.info(
+        "Cross-validation: %s configurazioni x %s fold su %s processi",
+        len(candidates),
+        len(splits),
+        workers,
+    )
+    per_candidate: List[List[Dict[str, Any]]] = [[] for _ in candidates]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(str(embeddings_path), labels),
+    ) as executor:
+        for done, fold_result in enumerate(executor.map(_evaluate_fold, tasks), 1):
+            per_candidate[fold_result["index"]].append(fold_result)
+            if done % max(1, len(tasks) // 10) == 0:
+                logger.info("Fold completati: %s/%s", done, len(tasks))
+
+    summaries = []
+    for params, fold_results in zip(candidates, per_candidate):
+        accuracy = np.array([r["accuracy"] for r in fold_results])
+        summaries.append(
+            {
+                "params": {
+                    **params,
+                    "hidden_layer_sizes": list(params["hidden_layer_sizes"]),
+                },
+                "accuracy_mean": round(float(accuracy.mean()), 5),
+                "accuracy_std": round(float(accuracy.std()), 5),
+                "f1_macro_mean": round(float(np.mean([r["f1_macro"] for r in fold_results])), 5),
+                "fit_time_s": round(float(np.mean([r["fit_time_s"] for r in fold_results])), 3),
+                "n_iter": int(np.mean([r["n_iter"] for r in fold_results])),
+                "n_params": fold_results[0]["n_params"],
+                "latency_ms": round(
+                    next(r["latency_ms"] for r in fold_results if "latency_ms" in r), 4
+                ),
+            }
+        )
+    return summaries
+
+
+def select_candidate(
+    summaries: List[Dict[str, Any]],
+    latency_budget_ms: Optional[float],
+    tolerance: float,
+) -> Dict[str, Any]:
+    """Il più accurato entro il budget; tra gli equivalenti entro ``tolerance`` il più piccolo."""
+    eligible = summaries
+    if latency_budget_ms is not None:
+        eligible = [s for s in summaries if s["latency_ms"] <= latency_budget_ms]
+        if not eligible:
+            logger.warning(
+                "Nessuna configurazione entro %.3fms: scelta la più veloce", latency_budget_ms
+            )
+            return min(summaries, key=lambda s: s["latency_ms"])
+    best_accuracy = max(s["accuracy_mean"] for s in eligible)
+    equivalent = [s for s in eligible if s["accuracy_mean"] >= best_accuracy - tolerance]
+    return min(equivalent, key=lambda s: (s["n_params"], s["latency_ms"]))
+
+
+def main(argv: List[str] | None = None) -> int:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        stream=sys.stderr,
+    )
+    args = _parse_args(argv)
+    config = Config()
+    if args.apply and config.CLASSIFIER_BACKEND != "mlp":
+        # La ricerca riguarda solo l'MLP: train_model ignorerebbe i parametri scelti
+        logger.error(
+            "--apply richiede CLASSIFIER_BACKEND=mlp (attuale: %s)", config.CLASSIFIER_BACKEND
+        )
+        return 1
+
+    # Import differiti: i processi del pool non caricano il modello di embedding
+    from cache import ModelCache
+    from training import (
+        encode_training_examples,
+        scan_training_data,
+        train_model,
+        validate_summary,
+    )
+
+    model_cache = ModelCache(config)
+    summary = scan_training_data(config.TRAINING_DATA_PATH)
+    if not validate_summary(summary):
+        return 1
+    training_set = encode_training_examples(config, model_cache, summary.n_examples)
+    # File unico per questa esecuzione: un riaddestramento concorrente non lo tocca
+    embeddings_path = training_set.embeddings_tmp_path
+    projected_path: Optional[Path] = None
+    projection_info: Optional[Dict[str, Any]] = None
+    try:
+        # La matrice è già un .npy su disco: i processi del pool la aprono in memory-map
+        training_set.X.flush()
+        classes, labels = np.unique(np.asarray(training_set.models), return_inverse=True)
+
+        folds = min(max(2, args.folds), int(np.bincount(labels).min()))
+        if folds < 2:
+            logger.error("Servono almeno 2 esempi per modello per la cross-validation")
+            return 1
+        if folds != args.folds:
+            logger.warning("Fold ridotti a %s: alcuni modelli hanno pochi esempi", folds)
+
+        candidates = candidate_params(config, args.search, args.n_iter, config.MLP_RANDOM_STATE)
+        start = time.perf_counter()
+        splits = stratified_splits(labels, folds, config.MLP_RANDOM_STATE)
+        cv_path = embeddings_path
+        if config.PROJECTION_METHOD != "none":
+            with tempfile.NamedTemporaryFile(
+                dir=embeddings_path.parent, prefix="tuning_projected.", suffix=".npy", delete=False
+            ) as f:
+                projected_path = Path(f.name)
+            projection_info = project_folds(config, training_set.X, splits, projected_path)
+            if projection_info is not None:
+                cv_path = projected_path
+        summaries = cross_validate(cv_path, labels, candidates, splits, max(1, args.workers))
+    finally:
+        embeddings_path.unlink(missing_ok=True)
+        if projected_path is not None:
+            projected_path.unlink(missing_ok=True)
+
+    selected = select_candidate(summaries, args.latency_budget_ms, args.tolerance)
+    baseline = summaries[0]
+    report: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(),
+        "n_examples": summary.n_examples,
+        "n_classes": len(classes),
+        "search": args.search,
+        "folds": folds,
+        "projection": projection_info,
+        "latency_budget_ms": args.latency_budget_ms,
+        "tolerance": args.tolerance,
+        "duration_s": round(time.perf_counter() - start, 1),
+        "baseline": baseline,
+        "selected": selected,
+        "candidates": sorted(summaries, key=lambda s: -s["accuracy_mean"]),
+        "applied": False,
+    }
+    logger.info(
+        "Configurazione scelta: %s (accuratezza %.4f, %.3fms, %s parametri); "
+        "attuale: accuratezza %.4f, %.3fms, %s parametri",
+        selected["params"],
+        selected["accuracy_mean"],
+        selected["latency_ms"],
+        selected["n_params"],
+        baseline["accuracy_mean"],
+        baseline["latency_ms"],
+        baseline["n_params"],
+    )
+
+    if args.apply:
+        params = dict(selected["params"])
+        params["hidden_layer_sizes"] = tuple(params["hidden_layer_sizes"])
+        success, message = train_model(config, model_cache, params=params)
+        if success:
+            logger.info(message)
+        else:
+            logger.error(message)
+        report["applied"] = success
+
+    tmp_path = config.TUNING_REPORT_PATH.with_name(config.TUNING_REPORT_PATH.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, config.TUNING_REPORT_PATH)
+    logger.info("Report di tuning scritto in %s", config.TUNING_REPORT_PATH)
+    return 0 if not args.apply or report["applied"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,18 @@
 """Interfaccia Gradio – AI Router: tema dark, minimal, premium."""
 import html
+import inspect
 import logging
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Iterator, Tuple
 
 import gradio as gr
 
 from cache import ModelCache
 from config import Config
-from ollama_service import improve_prompt_with_ollama
+from ollama_service import (
+    improve_prompt_with_ollama,
+    ollama_status,
+    stream_improve_prompt_with_ollama,
+)
 from predictor import predict_model
 
 logger = logging.getLogger(__name__)
@@ -80,6 +85,10 @@ CUSTOM_CSS = f"""
   border-radius: 50%;
   background: {SUCCESS};
   animation: pulse 2s ease-in-out infinite;
+}}
+.status-pill.degraded::before {{
+  background: {ERROR};
+  animation: none;
 }}
 @keyframes pulse {{ 0%, 100% {{ opacity: 1; }} 50% {{ opacity: 0.5; }} }}
 
@@ -228,6 +237,13 @@ def format_improvement_html(
         """
     improved = _escape(result.get("improved_prompt", ""))
     elapsed = result.get("elapsed_time", 0)
+    timing = f"Generated in {elapsed:.2f}s"
+    if result.get("cached"):
+        timing = f"From cache in {elapsed * 1000:.0f}ms"
+    if result.get("ttft") is not None:
+        timing += f" · first token {result['ttft']:.2f}s"
+    if result.get("tokens_per_second"):
+        timing += f" · {result['tokens_per_second']:.1f} tok/s"
     route_details = ""
     if before_route and before_route.get("success"):
         before_model = _escape(str(before_route.get("predicted_model")))
@@ -248,25 +264,103 @@ def format_improvement_html(
     return f"""
     <div class="card" style="border-color: rgba(52,211,153,0.25);">
       <div class="card-title" style="color: {SUCCESS};">Optimized prompt</div>
-      <p style="margin:0 0 0.5rem;font-size:0.75rem;color:{TEXT_MUTED};">Generated in {elapsed:.2f}s</p>
+      <p style="margin:0 0 0.5rem;font-size:0.75rem;color:{TEXT_MUTED};">{timing}</p>
       {route_details}
       <div style="background:{BG_INPUT};border:1px solid {BORDER};border-radius:8px;padding:1rem;font-size:0.875rem;line-height:1.6;color:{TEXT};white-space:pre-wrap;">{improved}</div>
     </div>
     """
 
 
+def format_header_html(status: Dict[str, Any]) -> str:
+    """Intestazione con lo stato di Ollama letto dal monitor (nessuna chiamata di rete)."""
+    if status.get("available") is False or status.get("circuit") == "open":
+        pill = '<span class="status-pill degraded">Optimizer offline</span>'
+    elif status.get("available") and not status.get("model_installed"):
+        pill = '<span class="status-pill degraded">Optimizer model missing</span>'
+    else:
+        pill = '<span class="status-pill">System ready</span>'
+    return f"""
+        <div class="app-header">
+          <h1 class="app-logo">AI <span>Router</span></h1>
+          {pill}
+        </div>
+        """
+
+
+def format_streaming_html(partial: str, elapsed: float) -> str:
+    """Prompt ottimizzato ancora in generazione."""
+    text = _escape(partial) or f'<span style="color:{TEXT_MUTED};">Waiting for the first tokens…</span>'
+    return f"""
+    <div class="card">
+      <div class="card-title">Optimizing…</div>
+      <p style="margin:0 0 0.5rem;font-size:0.75rem;color:{TEXT_MUTED};">{elapsed:.1f}s</p>
+      <div style="background:{BG_INPUT};border:1px solid {BORDER};border-radius:8px;padding:1rem;font-size:0.875rem;line-height:1.6;color:{TEXT};white-space:pre-wrap;">{text}</div>
+    </div>
+    """
+
+
+def _per_event_concurrency() -> bool:
+    """True con Gradio 4, che accetta ``concurrency_limit`` sul singolo evento."""
+    return "default_concurrency_limit" in inspect.signature(gr.Blocks.queue).parameters
+
+
+def _optimize_event_kwargs(config: Config) -> Dict[str, Any]:
+    """Limite di concorrenza per l'ottimizzazione, l'unico evento che attende Ollama."""
+    if _per_event_concurrency():
+        return {"concurrency_limit": config.GRADIO_CONCURRENCY_LIMIT}
+    return {}
+
+
+def _light_event_kwargs() -> Dict[str, Any]:
+    """Eventi rapidi (routing, copia): senza limite, per non attendere un'ottimizzazione.
+
+    Gradio 3 ha solo un limite globale sulla coda: questi eventi ne restano fuori.
+    """
+    return {} if _per_event_concurrency() else {"queue": False}
+
+
+def _enable_queue(interface: gr.Blocks, config: Config) -> None:
+    """Attiva la coda, con il nome del parametro di concorrenza di Gradio 3 o 4.
+
+    Il limite ``GRADIO_CONCURRENCY_LIMIT`` vale solo per l'ottimizzazione; le
+    generazioni verso Ollama sono comunque regolate da ``GenerationScheduler``.
+    """
+    kwargs: Dict[str, Any] = {"max_size": config.GRADIO_QUEUE_SIZE}
+    if _per_event_concurrency():
+        kwargs["default_concurrency_limit"] = None
+    else:
+        kwargs["concurrency_count"] = config.GRADIO_CONCURRENCY_LIMIT
+    interface.queue(**kwargs)
+
+
 def create_gradio_interface(config: Config, model_cache: ModelCache) -> gr.Blocks:
-    def improve_wrapper(prompt: str) -> Tuple[str, str, gr.update]:
+    def improve_wrapper(prompt: str) -> Iterator[Tuple[str, Any, Any]]:
         if not prompt or not prompt.strip():
-            return (
+            yield (
                 f'<div class="card"><div class="card-title" style="color:{TEXT_MUTED};">Enter a prompt first</div><p style="margin:0;color:{TEXT_MUTED};">Type your request above, then click Optimize Prompt.</p></div>',
                 "",
                 gr.update(visible=False),
             )
+            return
         logger.info("Avvio miglioramento prompt...")
         before_route = predict_model(prompt, config, model_cache)
         target_model = before_route.get("predicted_model") if before_route.get("success") else None
-        result = improve_prompt_with_ollama(prompt, config, target_model=target_model)
+        if config.OLLAMA_STREAM:
+            yield format_streaming_html("", 0.0), gr.update(), gr.update(visible=False)
+            result: Dict[str, Any] = {}
+            for result in stream_improve_prompt_with_ollama(
+                prompt, config, target_model=target_model, cache=model_cache.optimization_cache
+            ):
+                if not result["done"]:
+                    yield (
+                        format_streaming_html(result["partial_prompt"], result["elapsed_time"]),
+                        gr.update(),
+                        gr.update(visible=False),
+                    )
+        else:
+            result = improve_prompt_with_ollama(
+                prompt, config, target_model=target_model, cache=model_cache.optimization_cache
+            )
         improved = result.get("improved_prompt") or ""
         after_route = (
             predict_model(improved, config, model_cache)
@@ -274,7 +368,7 @@ def create_gradio_interface(config: Config, model_cache: ModelCache) -> gr.Block
             else None
         )
         html_out = format_improvement_html(result, before_route, after_route)
-        return html_out, improved, gr.update(visible=bool(improved))
+        yield html_out, improved, gr.update(visible=bool(improved))
 
     def predict_wrapper(prompt: str) -> str:
         if not prompt or not prompt.strip():
@@ -309,12 +403,7 @@ def create_gradio_interface(config: Config, model_cache: ModelCache) -> gr.Block
         theme=theme,
         css=CUSTOM_CSS,
     ) as interface:
-        gr.HTML(f"""
-        <div class="app-header">
-          <h1 class="app-logo">AI <span>Router</span></h1>
-          <span class="status-pill">System ready</span>
-        </div>
-        """)
+        header = gr.HTML(format_header_html(ollama_status(config)))
 
         with gr.Row():
             with gr.Column(scale=3):
@@ -381,21 +470,32 @@ def create_gradio_interface(config: Config, model_cache: ModelCache) -> gr.Block
             fn=improve_wrapper,
             inputs=prompt_input,
             outputs=[improvement_output, improved_prompt_box, copy_btn],
+            **_optimize_event_kwargs(config),
         )
         copy_btn.click(
             fn=lambda x: x,
             inputs=improved_prompt_box,
             outputs=prompt_input,
+            **_light_event_kwargs(),
         )
         predict_btn.click(
             fn=predict_wrapper,
             inputs=prompt_input,
             outputs=prediction_output,
+            **_light_event_kwargs(),
         )
         prompt_input.submit(
             fn=predict_wrapper,
             inputs=prompt_input,
             outputs=prediction_output,
+            **_light_event_kwargs(),
         )
 
+        interface.load(
+            fn=lambda: format_header_html(ollama_status(config)),
+            outputs=header,
+            **_light_event_kwargs(),
+        )
+
+    _enable_queue(interface, config)
     return interface